@@ -12,6 +12,7 @@ class AminoAcid:
         self._mem: the membrane affiliation (from the Topcons server)
         self._secstruct: the type of secondary structure the residue is in (from DSSP)
         self._solex: the solvent accessibility of the residue (from DSSP)
+        self._rsa: the relative solvent accessibility of the residue, between 0 and 1 (from sasa.py)
     """
 
     d3to1 = {'CYS': 'C', 'ASP': 'D', 'SER': 'S', 'GLN': 'Q', 'LYS': 'K',
@@ -27,7 +28,8 @@ class AminoAcid:
             cons: float = 0,
             mem: str = "",
             secstruct: str = "",
-            solex: int = 0
+            solex: int = 0,
+            rsa: float = 0
                  ):
 
         r"""
@@ -37,6 +39,8 @@ class AminoAcid:
         :param cons: the conservation score of the residue (from the ConSurf server)
         :param mem: the membrane affiliation (from the Topcons server, should be a single letter)
         :param secstruct: the type of secondary structure the residue is in (from DSSP, should be a single letter or empty)
+        :param solex: the solvent accessibility of the residue
+        :param rsa: the relative solvent accessibility of the residue
         """
 
         self._num = num
@@ -46,6 +50,7 @@ class AminoAcid:
         self._mem = mem
         self._secstruct = secstruct
         self._solex = solex
+        self._rsa = rsa
 
     def set_num(self, num: int):
 
@@ -117,6 +122,16 @@ class AminoAcid:
 
         self._solex = solex
 
+    def set_rsa(self, rsa: float):
+
+        r"""
+        Sets relative solvent accessibility of the residue
+        :param rsa: relative solvent accessibility
+        :return: N/A
+        """
+
+        self._rsa = rsa
+
     def get_num(self) -> int:
 
         r"""
@@ -180,6 +195,24 @@ class AminoAcid:
 
         return self._solex
 
+    def get_rsa(self) -> float:
+
+        r"""
+        Returns rsa
+        :return: rsa
+        """
+
+        return self._rsa
+
+    def aa_str(self) -> str:
+
+        r"""
+        Returns all stored information in the amino acid object in a ordered manner.
+        :return: one line of text
+        """
+
+        return f"{self._num} {self._chain_id} {self._aa} {self._mem} {self._solex} {self._cons} {self._secstruct}"
+
     def aa_display(self):
 
         r"""
@@ -187,8 +220,7 @@ class AminoAcid:
         :return: N/A
         """
 
-        str = f"{self._num} {self._chain_id} {self._aa} {self._mem} {self._solex} {self._cons} {self._secstruct}"
-        print(str)
+        print(self.aa_str())
 
 
 
@@ -0,0 +1,631 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import numpy as np
+from conservation import msa_grades, map_to_chain
+from output_writer import write_pairs, write_residues
+from pdb_coords import read_atoms
+from residue_table import ResidueTable, iter_pairs
+from result_parsers import add_dssp, read_dssp
+from sasa import residue_sasa
+
+
+r"""
+Archive-scale processing of a local PDB mirror across several machines.
+
+The work is shared through a file-based queue on storage that every node can reach:
+    {queue}/todo/{shard}/{pdb_id}   one empty file per entry, grouped by shard (a hash of the PDB ID)
+    {queue}/leases/{pdb_id}         created atomically by the worker that claims the entry; its mtime is the heartbeat
+    {queue}/done/{pdb_id}           written when the entry is finished
+    {queue}/failed/{pdb_id}         the last error and the number of attempts
+A lease whose heartbeat is older than lease_timeout belongs to a dead worker and can be taken over.
+
+Every entry is written into {out}/{middle two letters}/{pdb_id}/, the same kind of per-job directory main.py creates.
+Outputs are built in a temporary directory and renamed into place, so an entry is either complete or absent, and running
+it twice gives the same result.
+
+Usage:
+    python archive_runner.py enqueue --queue Q --mirror M --shards 64
+    python archive_runner.py work --queue Q --mirror M --out O [--shards 0,1,2] [--msa-dir D] [--dssp-dir D]
+                                [--msa-store D]
+    python archive_runner.py status --queue Q
+"""
+
+
+def shard_of(pdb_id: str, n_shards: int) -> int:
+
+    r"""
+    Assigns a PDB ID to a shard. The hash is stable across machines and Python versions.
+    :param pdb_id: PDB ID
+    :param n_shards: the number of shards
+    :return: the shard number
+    """
+
+    return int(hashlib.sha1(pdb_id.lower().encode()).hexdigest()[:8], 16) % n_shards
+
+
+def mirror_path(mirror: str, pdb_id: str):
+
+    r"""
+    Finds the file of an entry in a local PDB mirror. Both the wwPDB divided layout (ab/pdb1abc.ent.gz) and flat
+    directories of .pdb files are recognised.
+    :param mirror: the mirror directory
+    :param pdb_id: PDB ID
+    :return: the path of the file, or None
+    """
+
+    pdb_id = pdb_id.lower()
+    mid = pdb_id[1:3]
+    for candidate in (os.path.join(mirror, mid, f"pdb{pdb_id}.ent.gz"),
+                      os.path.join(mirror, mid, f"pdb{pdb_id}.ent"),
+                      os.path.join(mirror, mid, f"{pdb_id}.pdb"),
+                      os.path.join(mirror, f"{pdb_id}.pdb"),
+                      os.path.join(mirror, f"{pdb_id}.pdb.gz")):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def scan_mirror(mirror: str):
+
+    r"""
+    Lists the PDB IDs present in a local mirror.
+    :param mirror: the mirror directory
+    :return: a generator of PDB IDs
+    """
+
+    for _, _, files in os.walk(mirror):
+        for name in files:
+            if name.startswith("pdb") and (name.endswith(".ent.gz") or name.endswith(".ent")):
+                yield name[3:7].lower()
+            elif name.endswith(".pdb") or name.endswith(".pdb.gz"):
+                yield name.split(".")[0].lower()
+
+
+class WorkQueue:
+
+    r"""
+    Class name: WorkQueue
+    Description: A file-based work queue with leases, for workers on several machines sharing one file system.
+                 Claiming relies on exclusive file creation and taking over a stale lease on rename, both of which are
+                 atomic; a taken-over lease is checked to be the one found stale (same inode and mtime) and put back
+                 otherwise, so two workers never process the same entry at the same time.
+    Variables:
+        self.root: the queue directory
+        self.lease_timeout: seconds without heartbeat after which a lease is considered abandoned
+        self.max_attempts: the number of failures after which an entry is no longer retried
+    """
+
+    def __init__(self, root: str, lease_timeout: float = 600, max_attempts: int = 3):
+
+        r"""
+        Object constructor. Creates the queue directories if needed.
+        :param root: the queue directory
+        :param lease_timeout: seconds without heartbeat after which a lease is considered abandoned
+        :param max_attempts: the number of failures after which an entry is no longer retried
+        """
+
+        self._root = root
+        self._lease_timeout = lease_timeout
+        self._max_attempts = max_attempts
+        for sub in ("todo", "leases", "done", "failed"):
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+
+    def _path(self, kind: str, pdb_id: str) -> str:
+
+        r"""
+        Returns the path of a queue file.
+        :param kind: "leases", "done" or "failed"
+        :param pdb_id: PDB ID
+        :return: the path
+        """
+
+        return os.path.join(self._root, kind, pdb_id)
+
+    def enqueue(self, pdb_ids, n_shards: int) -> int:
+
+        r"""
+        Adds entries to the queue. Entries already queued or done are skipped.
+        :param pdb_ids: an iterable of PDB IDs
+        :param n_shards: the number of shards
+        :return: the number of entries added
+        """
+
+        added = 0
+        for pdb_id in pdb_ids:
+            pdb_id = pdb_id.lower()
+            if os.path.exists(self._path("done", pdb_id)):
+                continue
+            shard_dir = os.path.join(self._root, "todo", f"{shard_of(pdb_id, n_shards):04d}")
+            entry = os.path.join(shard_dir, pdb_id)
+            if os.path.exists(entry):
+                continue
+            while True:
+                os.makedirs(shard_dir, exist_ok=True)
+                try:
+                    open(entry, "w").close()
+                    break
+                except FileNotFoundError:
+                    # A worker removed the shard directory after emptying it
+                    continue
+            added += 1
+        return added
+
+    def shards(self) -> list:
+
+        r"""
+        Lists the shards that still have queued entries.
+        :return: a list of shard numbers
+        """
+
+        return sorted(int(name) for name in os.listdir(os.path.join(self._root, "todo")))
+
+    def _try_lease(self, pdb_id: str, worker_id: str) -> bool:
+
+        r"""
+        Tries to create the lease of an entry, taking over an abandoned lease if necessary.
+        :param pdb_id: PDB ID
+        :param worker_id: the identifier of the worker
+        :return: True if the lease now belongs to the worker
+        """
+
+        lease = self._path("leases", pdb_id)
+        for _ in range(2):
+            try:
+                fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    seen = os.stat(lease)
+                except FileNotFoundError:
+                    continue
+                if time.time() - seen.st_mtime <= self._lease_timeout:
+                    return False
+                # Only one worker can rename the stale lease away; the others fail and move on
+                taken = f"{lease}.stale.{worker_id}"
+                try:
+                    os.rename(lease, taken)
+                    moved = os.stat(taken)
+                except FileNotFoundError:
+                    return False
+                if (moved.st_ino, moved.st_mtime_ns) != (seen.st_ino, seen.st_mtime_ns):
+                    # Between the check and the rename the stale lease was replaced by a fresh one (or renewed):
+                    # put it back without overwriting anything and leave the entry to its owner
+                    self._put_back(taken, lease, moved)
+                    return False
+                os.remove(taken)
+                continue
+            with os.fdopen(fd, "w") as out:
+                json.dump({"worker": worker_id, "host": socket.gethostname(), "pid": os.getpid(),
+                           "claimed": time.time()}, out)
+            return True
+        return False
+
+    @staticmethod
+    def _put_back(taken: str, lease: str, moved: os.stat_result):
+
+        r"""
+        Restores a lease that was renamed away by mistake, unless a new lease has been created in the meantime.
+        :param taken: the renamed lease
+        :param lease: the lease path
+        :param moved: the stat result of the renamed lease
+        :return: N/A
+        """
+
+        try:
+            os.link(taken, lease)
+        except FileExistsError:
+            pass
+        except OSError:
+            # Some shared file systems have no hard links: copy the lease into an exclusively created file instead
+            try:
+                fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                pass
+            else:
+                with open(taken, "rb") as src, os.fdopen(fd, "wb") as out:
+                    out.write(src.read())
+                # Keep the heartbeat time of the owner so the copy is not taken for stale
+                os.utime(lease, ns=(moved.st_atime_ns, moved.st_mtime_ns))
+        os.remove(taken)
+
+    def claim(self, worker_id: str, shards: list = None):
+
+        r"""
+        Claims the next entry. The worker's own shards are searched first; the remaining shards follow, so idle
+        workers help with shards whose workers are slow or gone.
+        :param worker_id: the identifier of the worker
+        :param shards: the preferred shards, or None for all
+        :return: (shard, PDB ID), or None when nothing is left
+        """
+
+        available = self.shards()
+        preferred = [s for s in available if shards is None or s in shards]
+        order = preferred + [s for s in available if s not in preferred]
+        for shard in order:
+            shard_dir = os.path.join(self._root, "todo", f"{shard:04d}")
+            try:
+                entries = sorted(os.listdir(shard_dir))
+            except FileNotFoundError:
+                continue
+            if not entries:
+                try:
+                    os.rmdir(shard_dir)
+                except OSError:
+                    pass
+                continue
+            for pdb_id in entries:
+                if os.path.exists(self._path("done", pdb_id)) or self._attempts(pdb_id) >= self._max_attempts:
+                    continue
+                if self._try_lease(pdb_id, worker_id):
+                    return shard, pdb_id
+        return None
+
+    def heartbeat(self, pdb_id: str):
+
+        r"""
+        Renews the lease of an entry.
+        :param pdb_id: PDB ID
+        :return: N/A
+        """
+
+        try:
+            os.utime(self._path("leases", pdb_id))
+        except FileNotFoundError:
+            pass
+
+    def _attempts(self, pdb_id: str) -> int:
+
+        r"""
+        Returns how many times an entry has failed.
+        :param pdb_id: PDB ID
+        :return: the number of failed attempts
+        """
+
+        try:
+            with open(self._path("failed", pdb_id), "r") as file:
+                return json.load(file)["attempts"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return 0
+
+    def complete(self, shard: int, pdb_id: str, summary: dict):
+
+        r"""
+        Marks an entry as done and releases its lease.
+        :param shard: the shard of the entry
+        :param pdb_id: PDB ID
+        :param summary: a small JSON-serializable summary stored in the done marker
+        :return: N/A
+        """
+
+        with open(self._path("done", pdb_id), "w") as out:
+            json.dump(summary, out)
+        self._dequeue(pdb_id, shard)
+        for path in (self._path("failed", pdb_id), self._path("leases", pdb_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def fail(self, pdb_id: str, error: str, shard: int = None):
+
+        r"""
+        Records a failure and releases the lease so the entry can be retried. An entry that has used up its attempts
+        is taken out of the queue; its failure record stays.
+        :param pdb_id: PDB ID
+        :param error: the error message
+        :param shard: the shard of the entry. Searched for when not given.
+        :return: N/A
+        """
+
+        attempts = self._attempts(pdb_id) + 1
+        with open(self._path("failed", pdb_id), "w") as out:
+            json.dump({"attempts": attempts, "error": error, "time": time.time()}, out)
+        if attempts >= self._max_attempts:
+            self._dequeue(pdb_id, shard)
+        try:
+            os.remove(self._path("leases", pdb_id))
+        except FileNotFoundError:
+            pass
+
+    def _dequeue(self, pdb_id: str, shard: int = None):
+
+        r"""
+        Removes an entry from todo/ and drops its shard directory once it is empty.
+        :param pdb_id: PDB ID
+        :param shard: the shard of the entry, or None to search all shards
+        :return: N/A
+        """
+
+        todo_dir = os.path.join(self._root, "todo")
+        names = [f"{shard:04d}"] if shard is not None else os.listdir(todo_dir)
+        for name in names:
+            shard_dir = os.path.join(todo_dir, name)
+            try:
+                os.remove(os.path.join(shard_dir, pdb_id))
+            except FileNotFoundError:
+                continue
+            try:
+                os.rmdir(shard_dir)
+            except OSError:
+                # Not empty yet, or already removed by another worker
+                pass
+            return
+
+    def status(self) -> dict:
+
+        r"""
+        Counts the entries in every state.
+        :return: a dictionary with keys "queued", "leased", "done" and "failed"
+        """
+
+        todo_dir = os.path.join(self._root, "todo")
+        queued = 0
+        for name in os.listdir(todo_dir):
+            try:
+                queued += len(os.listdir(os.path.join(todo_dir, name)))
+            except FileNotFoundError:
+                pass
+        return {"queued": queued,
+                "leased": len([f for f in os.listdir(os.path.join(self._root, "leases")) if ".stale." not in f]),
+                "done": len(os.listdir(os.path.join(self._root, "done"))),
+                "failed": len(os.listdir(os.path.join(self._root, "failed")))}
+
+
+class Heartbeat:
+
+    r"""
+    Class name: Heartbeat
+    Description: Renews the lease of the entry being processed from a background thread, so long entries are not
+                 mistaken for abandoned ones.
+    Variables:
+        self.queue: the WorkQueue
+        self.pdb_id: the entry being processed
+        self.interval: seconds between two renewals
+    """
+
+    def __init__(self, queue: WorkQueue, pdb_id: str, interval: float = 60):
+
+        r"""
+        Object constructor.
+        :param queue: the WorkQueue
+        :param pdb_id: the entry being processed
+        :param interval: seconds between two renewals
+        """
+
+        self._queue = queue
+        self._pdb_id = pdb_id
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self._queue.heartbeat(self._pdb_id)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def read_cached_dssp(dssp_path: str, table: ResidueTable):
+
+    r"""
+    Copies secondary structure and accessibility from a cached .dssp file into a residue table, matching residues by
+    chain and number (see result_parsers.read_dssp).
+    :param dssp_path: the .dssp file
+    :param table: the ResidueTable to update
+    :return: N/A
+    """
+
+    add_dssp(table, read_dssp(dssp_path), ["secstruct", "solex"])
+
+
+class ArchiveWorker:
+
+    r"""
+    Class name: ArchiveWorker
+    Description: Claims entries from a WorkQueue and runs the local stages on each of them: parsing, cached DSSP,
+                 solvent accessibility, conservation from cached MSAs and candidate pair distances.
+    Variables:
+        self.queue: the WorkQueue
+        self.mirror: the local PDB mirror
+        self.out: the output directory
+        self.msa_dir: directory of cached MSAs named {pdb_id}_{chain}.a3m, or None
+        self.msa_store: an MSAStore the cached MSAs are encoded into once, or None
+        self.dssp_dir: directory of cached {pdb_id}.dssp files, or None
+        self.shards: the preferred shards of this worker
+        self.worker_id: a unique identifier of the worker
+    """
+
+    def __init__(
+            self,
+            queue: WorkQueue,
+            mirror: str,
+            out: str,
+            msa_dir: str = None,
+            dssp_dir: str = None,
+            shards: list = None,
+            min_dist: float = 20.0,
+            max_dist: float = 50.0,
+            msa_store: str = None
+                 ):
+
+        r"""
+        Object constructor.
+        :param queue: the WorkQueue
+        :param mirror: the local PDB mirror
+        :param out: the output directory
+        :param msa_dir: directory of cached MSAs named {pdb_id}_{chain}.a3m
+        :param dssp_dir: directory of cached {pdb_id}.dssp files
+        :param shards: the preferred shards of this worker
+        :param min_dist: smallest distance of a candidate pair in Angstrom
+        :param max_dist: largest distance of a candidate pair in Angstrom
+        :param msa_store: an optional MSAStore directory; MSAs shared by many entries are then tokenized only once
+        """
+
+        self._queue = queue
+        self._mirror = mirror
+        self._out = out
+        self._msa_dir = msa_dir
+        self._dssp_dir = dssp_dir
+        self._shards = shards
+        self._min_dist = min_dist
+        self._max_dist = max_dist
+        self._msa_store = None
+        if msa_store:
+            from msa_store import MSAStore
+            self._msa_store = MSAStore(msa_store)
+        self._worker_id = f"{socket.gethostname()}_{os.getpid()}"
+
+    def entry_dir(self, pdb_id: str) -> str:
+
+        r"""
+        Returns the output directory of an entry.
+        :param pdb_id: PDB ID
+        :return: the directory path
+        """
+
+        return os.path.join(self._out, pdb_id[1:3], pdb_id)
+
+    def process(self, pdb_id: str) -> dict:
+
+        r"""
+        Runs the local stages on one entry. Does nothing if the entry is already complete.
+        :param pdb_id: PDB ID
+        :return: a summary of the entry
+        """
+
+        final = self.entry_dir(pdb_id)
+        meta_path = os.path.join(final, "meta.json")
+        if os.path.isfile(meta_path):
+            with open(meta_path, "r") as file:
+                return json.load(file)
+
+        PDB_path = mirror_path(self._mirror, pdb_id)
+        if PDB_path is None:
+            raise FileNotFoundError(f"{pdb_id} is not in the mirror {self._mirror}")
+
+        atoms = read_atoms(PDB_path)
+        table = ResidueTable.from_atoms(atoms, pdb_id)
+        absolute, relative = residue_sasa(atoms)
+        table.set_column("solex", absolute.astype(np.float32))
+        table.set_column("rsa", np.nan_to_num(relative).astype(np.float32))
+
+        stages = ["parse", "sasa"]
+        if self._dssp_dir and os.path.isfile(os.path.join(self._dssp_dir, f"{pdb_id}.dssp")):
+            read_cached_dssp(os.path.join(self._dssp_dir, f"{pdb_id}.dssp"), table)
+            stages.append("dssp")
+        if self._msa_dir:
+            cons = table.get_column("cons").copy()
+            for chainID in np.unique(table.get_column("chain")):
+                a3m_path = os.path.join(self._msa_dir, f"{pdb_id}_{chainID}.a3m")
+                if not os.path.isfile(a3m_path):
+                    continue
+                rows = np.flatnonzero(table.get_column("chain") == chainID)
+                query, grades = msa_grades(a3m_path, store=self._msa_store)
+                positions = map_to_chain(query, "".join(table.get_column("aa")[rows]))
+                if positions is not None:
+                    cons[rows] = grades[positions]
+            table.set_column("cons", cons)
+            stages.append("conservation")
+
+        # Build in a private directory, then rename into place so the entry appears complete or not at all
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        tmp = f"{final}.tmp.{self._worker_id}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        write_residues(os.path.join(tmp, "residues.tsv.gz"), table)
+        secstruct = table.get_column("secstruct")
+        mask = np.isin(secstruct, list("HBEGITS")) if "dssp" in stages else None
+        n_pairs = write_pairs(os.path.join(tmp, "pairs.pslb"), table,
+                              iter_pairs(table, mask=mask, min_dist=self._min_dist, max_dist=self._max_dist))
+        summary = {"pdb_id": pdb_id, "residues": table.get_length(), "pairs": n_pairs, "stages": stages,
+                   "min_dist": self._min_dist, "max_dist": self._max_dist}
+        with open(os.path.join(tmp, "meta.json"), "w") as out:
+            json.dump(summary, out)
+        try:
+            os.rename(tmp, final)
+        except OSError:
+            # Another worker finished the same entry first; its output is equivalent
+            shutil.rmtree(tmp, ignore_errors=True)
+        return summary
+
+    def run(self, max_entries: int = None, heartbeat: float = 60) -> int:
+
+        r"""
+        Processes entries until the queue is empty.
+        :param max_entries: stop after this many entries
+        :param heartbeat: seconds between two lease renewals
+        :return: the number of entries processed
+        """
+
+        processed = 0
+        while max_entries is None or processed < max_entries:
+            claimed = self._queue.claim(self._worker_id, self._shards)
+            if claimed is None:
+                break
+            shard, pdb_id = claimed
+            with Heartbeat(self._queue, pdb_id, heartbeat):
+                try:
+                    summary = self.process(pdb_id)
+                except Exception as e:
+                    self._queue.fail(pdb_id, f"{type(e).__name__}: {e}", shard)
+                    print(f"{pdb_id} failed: {e}")
+                    continue
+            self._queue.complete(shard, pdb_id, summary)
+            processed += 1
+            print(f"{pdb_id}: {summary['residues']} residues, {summary['pairs']} pairs")
+        return processed
+
+
+def main():
+
+    r"""
+    Command line entry point.
+    :return: N/A
+    """
+
+    parser = argparse.ArgumentParser(description="Process a local PDB mirror through a shared work queue.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    enqueue = sub.add_parser("enqueue")
+    enqueue.add_argument("--queue", required=True)
+    enqueue.add_argument("--mirror", required=True)
+    enqueue.add_argument("--shards", type=int, default=64)
+    work = sub.add_parser("work")
+    work.add_argument("--queue", required=True)
+    work.add_argument("--mirror", required=True)
+    work.add_argument("--out", required=True)
+    work.add_argument("--shards", default=None, help="comma separated preferred shards")
+    work.add_argument("--msa-dir", default=None)
+    work.add_argument("--dssp-dir", default=None)
+    work.add_argument("--msa-store", default=None, help="encode cached MSAs once into this MSA store")
+    work.add_argument("--lease-timeout", type=float, default=600)
+    work.add_argument("--max-entries", type=int, default=None)
+    status = sub.add_parser("status")
+    status.add_argument("--queue", required=True)
+    args = parser.parse_args()
+
+    if args.command == "enqueue":
+        added = WorkQueue(args.queue).enqueue(scan_mirror(args.mirror), args.shards)
+        print(f"{added} entries queued.")
+    elif args.command == "work":
+        shards = [int(s) for s in args.shards.split(",")] if args.shards else None
+        worker = ArchiveWorker(WorkQueue(args.queue, lease_timeout=args.lease_timeout), args.mirror, args.out,
+                               msa_dir=args.msa_dir, dssp_dir=args.dssp_dir, shards=shards,
+                               msa_store=args.msa_store)
+        print(f"{worker.run(max_entries=args.max_entries)} entries processed.")
+    else:
+        print(WorkQueue(args.queue).status())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+import gzip
+import re
+import numpy as np
+from residue_table import ResidueTable, iter_pairs
+
+
+r"""
+Biological assemblies from the REMARK 350 BIOMT records of a PDB file. The file holds the asymmetric unit; the
+assembly is made of copies of some of its chains, each copy moved by a rotation R and a translation t.
+
+For an oligomer built by a symmetry group G (the operators are closed under composition), the distance between residue
+i of copy a and residue j of copy b equals the distance between residue i of the first copy and residue j of copy
+a^-1 b, so only pairs whose first residue lies in the first copy are computed. Each of them stands for an orbit of
+equivalent pairs, whose size is given in the "mult" column, and expand_pairs lists the equivalents on request. This
+takes about 2 / N of the work of comparing all N copies with each other.
+
+Expanded rows are numbered copy * n + row, n being the number of residues of one copy.
+"""
+
+
+def read_biomt(PDB_path: str, assembly_id: str = "1") -> list:
+
+    r"""
+    Reads the operators of one biological assembly.
+    :param PDB_path: The path that contains the PDB file (may be gzip-compressed)
+    :param assembly_id: the BIOMOLECULE number
+    :return: a list of groups, each a dictionary with "chains" (chain identifiers) and "operators" (a list of (R, t),
+             R a 3x3 array and t a length-3 array). Empty when the file has no REMARK 350 for the assembly.
+    """
+
+    groups, current, rows = [], None, {}
+    opener = gzip.open if PDB_path.endswith(".gz") else open
+    with opener(PDB_path, "rt") as file:
+        for line in file:
+            if line.startswith("ATOM") or line.startswith("HETATM"):
+                break
+            if not line.startswith("REMARK 350"):
+                continue
+            text = line[10:].strip()
+            if text.startswith("BIOMOLECULE:"):
+                current = text.split(":")[1].strip()
+            elif current != str(assembly_id):
+                continue
+            elif "APPLY THE FOLLOWING TO CHAINS:" in text or "AND CHAINS:" in text:
+                chains = [c.strip() for c in text.split(":", 1)[1].split(",") if c.strip()]
+                if "APPLY" in text or not groups:
+                    groups.append({"chains": [], "operators": []})
+                groups[-1]["chains"].extend(chains)
+            elif text.startswith("BIOMT"):
+                axis = int(text[5]) - 1
+                values = [float(v) for v in re.findall(r"-?\d+\.\d*", line[23:])]
+                rows[axis] = values[:4]
+                if axis == 2 and groups:
+                    matrix = np.array([rows[0], rows[1], rows[2]], dtype=np.float64)
+                    groups[-1]["operators"].append((matrix[:, :3], matrix[:, 3]))
+    return [group for group in groups if group["operators"]]
+
+
+def compose_table(operators: list, rot_tol: float = 1e-3, trans_tol: float = 0.05):
+
+    r"""
+    Builds the multiplication table of a set of operators, if they form a group.
+    :param operators: a list of (R, t)
+    :param rot_tol: largest difference of rotation matrix entries treated as equal
+    :param trans_tol: largest difference of translations (Angstrom) treated as equal
+    :return: an (N, N) integer array whose entry [a, b] is the index of the operator a after b, or None if the
+             operators are not closed under composition or miss the identity
+    """
+
+    rot = np.array([r for r, _ in operators])
+    trans = np.array([t for _, t in operators])
+    n = len(operators)
+    identity = [k for k in range(n) if np.allclose(rot[k], np.eye(3), atol=rot_tol)
+                and np.allclose(trans[k], 0, atol=trans_tol)]
+    if not identity:
+        return None
+    table = np.empty((n, n), dtype=np.int64)
+    for a in range(n):
+        # x -> R_a (R_b x + t_b) + t_a
+        r_ab = np.einsum("ij,bjk->bik", rot[a], rot)
+        t_ab = trans @ rot[a].T + trans[a]
+        for b in range(n):
+            match = np.flatnonzero((np.abs(rot - r_ab[b]).max(axis=(1, 2)) < rot_tol)
+                                   & (np.abs(trans - t_ab[b]).max(axis=1) < trans_tol))
+            if len(match) == 0:
+                return None
+            table[a, b] = match[0]
+    return table
+
+
+class Assembly:
+
+    r"""
+    Class name: Assembly
+    Description: A biological assembly built from a ResidueTable of the asymmetric unit and BIOMT operators.
+    Variables:
+        self.table: the residues of the chains the operators apply to
+        self.rows: the rows of the original table they come from
+        self.operators: the (R, t) of every copy
+        self.compose: the multiplication table of the operators, or None if they do not form a group
+    """
+
+    def __init__(self, table: ResidueTable, groups: list):
+
+        r"""
+        Object constructor.
+        :param table: the ResidueTable of the asymmetric unit
+        :param groups: the groups returned by read_biomt. An empty list gives the asymmetric unit itself.
+        """
+
+        if not groups:
+            groups = [{"chains": list(np.unique(table.get_column("chain"))),
+                       "operators": [(np.eye(3), np.zeros(3))]}]
+        self._groups = groups
+        chain = table.get_column("chain")
+        # Symmetry is used when one set of operators moves all the chains of the assembly
+        self._compose = compose_table(groups[0]["operators"]) if len(groups) == 1 else None
+        self._rows = np.flatnonzero(np.isin(chain, groups[0]["chains"])) if len(groups) == 1 else None
+        if self._rows is not None:
+            self._table = ResidueTable(table.get_pdb_id(), table.take(self._rows))
+            self._operators = groups[0]["operators"]
+        else:
+            self._table = table
+            self._operators = None
+        self._source = table
+
+    @classmethod
+    def from_pdb(cls, table: ResidueTable, PDB_path: str, assembly_id: str = "1"):
+
+        r"""
+        Builds the assembly described in a PDB file.
+        :param table: the ResidueTable of the asymmetric unit, e.g. from ResidueTable.from_pdb or Protein.to_table
+        :param PDB_path: the PDB file with the REMARK 350 records
+        :param assembly_id: the BIOMOLECULE number
+        :return: an Assembly
+        """
+
+        return cls(table, read_biomt(PDB_path, assembly_id))
+
+    def get_size(self) -> int:
+
+        r"""
+        Returns the number of copies.
+        :return: the number of copies (for a symmetric assembly), or the number of operators of all groups
+        """
+
+        if self._operators is not None:
+            return len(self._operators)
+        return sum(len(group["operators"]) for group in self._groups)
+
+    def is_symmetric(self) -> bool:
+
+        r"""
+        Checks whether pairs can be reduced by symmetry.
+        :return: True if one group of operators forms a symmetry group
+        """
+
+        return self._compose is not None
+
+    def expand(self) -> ResidueTable:
+
+        r"""
+        Builds the residue table of the whole assembly. A "copy" column holds the operator index of every row; for a
+        symmetric assembly row copy * n + k is residue k of the asymmetric chains moved by operator copy.
+        :return: a ResidueTable
+        """
+
+        if self._operators is not None:
+            parts = [(self._table, self._operators)]
+        else:
+            chain = self._source.get_column("chain")
+            parts = [(ResidueTable(self._source.get_pdb_id(),
+                                   self._source.take(np.flatnonzero(np.isin(chain, group["chains"])))),
+                      group["operators"]) for group in self._groups]
+        columns, copy = {}, 0
+        for table, operators in parts:
+            coords = table.get_coords().astype(np.float64)
+            for rot, trans in operators:
+                moved = coords @ rot.T + trans
+                block = dict(table.take(np.arange(table.get_length())))
+                block["x"], block["y"], block["z"] = (moved[:, k].astype(np.float32) for k in range(3))
+                block["copy"] = np.full(table.get_length(), copy, dtype=np.int32)
+                for name, values in block.items():
+                    columns.setdefault(name, []).append(values)
+                copy += 1
+        return ResidueTable(self._table.get_pdb_id(),
+                            {name: np.concatenate(values) for name, values in columns.items()})
+
+    def _inverse(self) -> tuple:
+        size = len(self._operators)
+        identity = next(k for k in range(size) if (self._compose[k] == np.arange(size)).all())
+        return identity, np.array([int(np.flatnonzero(self._compose[:, b] == identity)[0]) for b in range(size)])
+
+    def iter_pairs(
+            self,
+            mask: np.ndarray = None,
+            min_dist: float = 20.0,
+            max_dist: float = 50.0,
+            block: int = 2048
+                   ):
+
+        r"""
+        Enumerates the residue pairs of the assembly whose distance lies in [min_dist, max_dist]. For a symmetric
+        assembly only one pair of every orbit is produced, with its first residue in the identity copy, and "mult"
+        gives the number of pairs of the orbit. Otherwise all pairs of the expanded table are produced with mult 1.
+        :param mask: optional boolean array over the rows of the table given to the constructor (symmetric) or of the
+                     expanded table
+        :param min_dist: smallest distance in Angstrom
+        :param max_dist: largest distance in Angstrom
+        :param block: the number of rows compared at once
+        :return: a generator of dictionaries with columns "i", "j" (expanded rows), "dist" and "mult"
+        """
+
+        if self._compose is None:
+            for chunk in iter_pairs(self.expand(), mask=mask, min_dist=min_dist, max_dist=max_dist, block=block):
+                chunk["mult"] = np.ones(len(chunk["i"]), dtype=np.int32)
+                yield chunk
+            return
+
+        n = self._table.get_length()
+        size = len(self._operators)
+        identity, inverse = self._inverse()
+        if mask is not None:
+            mask = np.asarray(mask)[self._rows]
+        idx = np.arange(n) if mask is None else np.flatnonzero(mask)
+        coords = self._table.get_coords()[idx].astype(np.float64)
+        valid = ~np.isnan(coords).any(axis=1)
+        idx, coords = idx[valid], coords[valid]
+        lo2, hi2 = min_dist ** 2, max_dist ** 2
+
+        for b in range(size):
+            if b == identity:
+                for chunk in iter_pairs(self._table, mask=mask, min_dist=min_dist, max_dist=max_dist, block=block):
+                    chunk["i"] = identity * n + chunk["i"]
+                    chunk["j"] = identity * n + chunk["j"]
+                    chunk["mult"] = np.full(len(chunk["i"]), size, dtype=np.int32)
+                    yield chunk
+                continue
+            if inverse[b] < b:
+                # Equivalent to the pairs of copy inverse[b] with the ends swapped
+                continue
+            rot, trans = self._operators[b]
+            other = coords @ rot.T + trans
+            involution = inverse[b] == b
+            for start in range(0, len(idx), block):
+                diff = coords[start:start + block, None, :] - other[None, :, :]
+                d2 = np.einsum("abk,abk->ab", diff, diff)
+                keep = (d2 >= lo2) & (d2 <= hi2)
+                if involution:
+                    # Copy b maps back onto the identity, so (i, j) and (j, i) are the same pair
+                    keep &= np.arange(start, start + len(keep))[:, None] <= np.arange(len(idx))[None, :]
+                a, c = np.nonzero(keep)
+                same = (a + start) == c
+                mult = np.full(len(a), size, dtype=np.int32)
+                if involution:
+                    mult[same] = size // 2
+                yield {"i": identity * n + idx[a + start], "j": b * n + idx[c],
+                       "dist": np.sqrt(d2[a, c]).astype(np.float32), "mult": mult}
+
+    def expand_pairs(self, pairs: dict) -> dict:
+
+        r"""
+        Lists every pair of the assembly equivalent to the given pairs.
+        :param pairs: a chunk produced by iter_pairs of a symmetric assembly
+        :return: a dictionary with columns "i", "j" (i < j, expanded rows) and "dist", without duplicates
+        """
+
+        if self._compose is None:
+            return {key: pairs[key] for key in ("i", "j", "dist")}
+        n = self._table.get_length()
+        row_i, copy_i = pairs["i"] % n, pairs["i"] // n
+        row_j, copy_j = pairs["j"] % n, pairs["j"] // n
+        new_i = (self._compose[:, copy_i] * n + row_i[None, :]).ravel()
+        new_j = (self._compose[:, copy_j] * n + row_j[None, :]).ravel()
+        dist = np.tile(pairs["dist"], len(self._operators))
+        lo, hi = np.minimum(new_i, new_j), np.maximum(new_i, new_j)
+        _, first = np.unique(lo * (n * len(self._operators)) + hi, return_index=True)
+        return {"i": lo[first], "j": hi[first], "dist": dist[first]}
+
+    def symmetric_distances(self) -> np.ndarray:
+
+        r"""
+        Computes the distances between the copies of every residue, i.e. the distances measured when one spin label per
+        protomer is attached at the residue.
+        :return: an (n, size) array; column b holds the distance from the residue in the identity copy to the residue in
+                 copy b (0 for the identity)
+        """
+
+        coords = self._table.get_coords().astype(np.float64)
+        rot = np.array([r for r, _ in self._operators])
+        trans = np.array([t for _, t in self._operators])
+        moved = np.einsum("bij,nj->nbi", rot, coords) + trans[None, :, :]
+        return np.sqrt(((moved - coords[:, None, :]) ** 2).sum(axis=2)).astype(np.float32)
+
+    def source_rows(self, rows: np.ndarray) -> np.ndarray:
+
+        r"""
+        Maps expanded rows of a symmetric assembly back to rows of the asymmetric unit table.
+        :param rows: expanded row indices
+        :return: row indices into the table given to the constructor
+        """
+
+        return self._rows[np.asarray(rows) % self._table.get_length()]
@@ -0,0 +1,128 @@
+import numpy as np
+
+
+r"""
+Conservation grades computed locally from an MSA, for cases where the MSA is already cached and a ConSurf run is not
+possible (e.g. whole-archive processing). Every query column gets the Shannon entropy of its amino acid distribution,
+and the entropies are binned into nine grades with the ConSurf convention: 1 is the most variable, 9 the most conserved.
+The grades approximate ConSurf's rate4site grades; they are not identical to them.
+"""
+
+alphabet = b"ACDEFGHIKLMNPQRSTVWY-"
+
+
+def read_a3m(a3m_path: str) -> tuple:
+
+    r"""
+    Reads an a3m alignment and drops insertions (lower-case letters), so every row has the length of the query.
+    :param a3m_path: the a3m file
+    :return: (query sequence, list of aligned rows as bytes)
+    """
+
+    rows, seq = [], []
+    with open(a3m_path, "rb") as a3:
+        for line in a3:
+            line = line.strip().strip(b"\x00")
+            if not line:
+                continue
+            if line.startswith(b">"):
+                if seq:
+                    rows.append(b"".join(seq))
+                seq = []
+            elif line[:1] != b"#":
+                seq.append(line.translate(None, b"abcdefghijklmnopqrstuvwxyz."))
+    if seq:
+        rows.append(b"".join(seq))
+    return rows[0].decode() if rows else "", rows
+
+
+def encode_rows(rows: list, length: int) -> np.ndarray:
+
+    r"""
+    Encodes aligned rows into an integer matrix. Letters outside the alphabet become gaps.
+    :param rows: aligned rows as bytes
+    :param length: the number of query columns
+    :return: a (n_rows, length) uint8 matrix of indices into alphabet
+    """
+
+    lookup = np.full(256, alphabet.index(b"-"), dtype=np.uint8)
+    for k, letter in enumerate(alphabet):
+        lookup[letter] = k
+    raw = np.frombuffer(b"".join(r[:length].ljust(length, b"-") for r in rows), dtype=np.uint8)
+    return lookup[raw].reshape(len(rows), length)
+
+
+def column_entropy(matrix: np.ndarray, block: int = 16384) -> np.ndarray:
+
+    r"""
+    Computes the Shannon entropy of every column, ignoring gaps. Rows are counted a block at a time, so a memory-mapped
+    matrix (see msa_store.py) is scanned without being loaded. Codes past the alphabet count as gaps.
+    :param matrix: the matrix returned by encode_rows, or the matrix of a StoredMSA
+    :param block: the number of rows counted at once
+    :return: an array of entropies (nats), one per column
+    """
+
+    n_rows, length = matrix.shape
+    k = len(alphabet)
+    gap = alphabet.index(b"-")
+    counts = np.zeros(length * k, dtype=np.int64)
+    offsets = np.arange(length, dtype=np.int64)[None, :] * k
+    for start in range(0, n_rows, block):
+        part = np.minimum(matrix[start:start + block], gap)
+        counts += np.bincount((offsets + part).ravel(), minlength=length * k)
+    counts = counts.reshape(length, k)[:, :-1].astype(np.float64)
+    totals = counts.sum(axis=1, keepdims=True)
+    freq = np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return -np.where(freq > 0, freq * np.log(freq), 0.0).sum(axis=1)
+
+
+def entropy_grades(entropy: np.ndarray) -> np.ndarray:
+
+    r"""
+    Bins entropies into conservation grades 1 (variable) to 9 (conserved), using nine equal intervals between the
+    lowest and the highest entropy of the protein.
+    :param entropy: column entropies
+    :return: an integer array of grades
+    """
+
+    if len(entropy) == 0:
+        return np.zeros(0, dtype=np.int8)
+    low, high = entropy.min(), entropy.max()
+    scaled = (entropy - low) / (high - low) if high > low else np.zeros_like(entropy)
+    return (9 - np.minimum(8, np.floor(scaled * 9))).astype(np.int8)
+
+
+def msa_grades(a3m_path: str, store=None) -> tuple:
+
+    r"""
+    Computes conservation grades for every query column of an a3m alignment.
+    :param a3m_path: the a3m file
+    :param store: an optional MSAStore. The alignment is converted into it on first use and read from it afterwards
+    :return: (query sequence, integer array of grades)
+    """
+
+    if store is not None:
+        msa = store.add(a3m_path)
+        return msa.get_query(), entropy_grades(column_entropy(msa.get_matrix()))
+    query, rows = read_a3m(a3m_path)
+    matrix = encode_rows(rows, len(query))
+    return query, entropy_grades(column_entropy(matrix))
+
+
+def map_to_chain(query: str, chain_seq: str):
+
+    r"""
+    Finds where the residues of a chain sit in the query sequence of an MSA. The chain (from the ATOM records) is
+    usually the query (from SEQRES) with missing terminal residues, so a substring match is tried first.
+    :param query: the query sequence of the MSA
+    :param chain_seq: the sequence of the modelled residues of the chain
+    :return: an array of query positions, one per chain residue, or None when the sequences cannot be matched
+    """
+
+    offset = query.find(chain_seq)
+    if offset >= 0:
+        return np.arange(offset, offset + len(chain_seq))
+    if len(query) == len(chain_seq):
+        return np.arange(len(chain_seq))
+    return None
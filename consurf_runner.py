@@ -1,4 +1,3 @@
-import os
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
@@ -6,6 +5,7 @@ from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.support.ui import Select
 import requests
+from workspace import get_workspace
 
 
 class ConsurfRunner:
@@ -19,9 +19,12 @@ class ConsurfRunner:
         self.job_id: Job ID for the job.
         self.chain_id: Chain Identifier in the PDB file
         self.q_seq: query sequence of MSA.
+        self.host_url: the url of the ConSurf server
+        self.workspace: the Workspace the PDB and MSA files are read from and the grades written to
+        self.msa_path: the MSA file uploaded for the chain
 
     Input: the required parameters of the server, including a PDB file and a MSA file (in clustal format)
-    Output: a text file containing conservation score for each amino acid.
+    Output: a text file ({pdb_id}_{chain_id}_CONS.txt) containing conservation score for each amino acid.
 
     Reference:
     Ashkenazy H., Abadi S., Martz E., Chay O., Mayrose I., Pupko T., and Ben-Tal N. 2016
@@ -49,7 +52,11 @@ class ConsurfRunner:
             self,
             pdb_id,
             email,
-            job_id
+            job_id,
+            chain_id: str = None,
+            host_url: str = "https://consurf.tau.ac.il/",
+            workspace=None,
+            msa_name: str = None
                  ):
 
         r"""
@@ -57,13 +64,21 @@ class ConsurfRunner:
         :param pdb_id: PDB ID of the protein
         :param email: User's email that receives notification when the job is done
         :param job_id: Job ID for the job
+        :param chain_id: Chain identifier. The user is asked for it when not given.
+        :param host_url: the url of the ConSurf server
+        :param workspace: the Workspace of the job. Defaults to the current working directory
+        :param msa_name: the MSA of the chain is {msa_name}_MSA.fasta, e.g. "1abc_B" for a file written by
+                         MMSeqs2BatchRunner. Defaults to the PDB ID ({pdb_id}_MSA.fasta)
         """
 
         self._pdb_id = pdb_id
         self._email = email
-        self._chain_id = self._get_chain_id()
+        self._workspace = get_workspace(workspace)
+        self._chain_id = chain_id if chain_id else self._get_chain_id()
         # self._q_seq = self._get_q_seq()
         self._job_id = job_id
+        self._host_url = host_url
+        self._msa_path = self._workspace.msa_fasta(msa_name if msa_name else pdb_id)
 
     def _get_chain_id(self) -> str:
 
@@ -72,8 +87,7 @@ class ConsurfRunner:
         :return: A valid chain id
         """
 
-        current_path = os.getcwd()
-        PDB_path = os.path.join(current_path, f"{self._pdb_id}.pdb")
+        PDB_path = self._workspace.pdb(self._pdb_id)
         chain_id_list = []
         with open(PDB_path, "r") as file:
             line = file.readline()
@@ -128,18 +142,15 @@ class ConsurfRunner:
 
         return self._chain_id
 
-    def run_job(self):
+    def _fill_form(self, driver) -> str:
 
         r"""
-        The program opens a Chrome window and runs the Consurf server and download result automatically.
-        THIS MAY TAKE HOURS.
-        :return: N/A
+        Fills in and submits the ConSurf form.
+        :param driver: a running webdriver
+        :return: the job id given by the ConSurf server
         """
 
-        current_path = os.getcwd()
-
-        driver = webdriver.Chrome(ChromeDriverManager().install())
-        server_url = "https://consurf.tau.ac.il/?redirect=NO"
+        server_url = f"{self._host_url}?redirect=NO"
 
         # Access the Consurf server
         print("Starting Consurf server...")
@@ -170,7 +181,7 @@ class ConsurfRunner:
 
         # Upload PDB file
         pdb_FILE = driver.find_element(By.XPATH, "//*[@id='pdb_file_field']")
-        PDB_path = os.path.join(current_path, f"{self._pdb_id}.pdb")
+        PDB_path = self._workspace.pdb(self._pdb_id)
         pdb_FILE.send_keys(PDB_path)
         print("Analyzing PDB...")
 
@@ -215,8 +226,7 @@ class ConsurfRunner:
 
         # Upload MSA
         MSA_upload = driver.find_element(By.XPATH, "//*[@id='fileSelect']")
-        MSA_path = os.path.join(current_path, f"{self._pdb_id}_MSA.fasta")
-        MSA_upload.send_keys(MSA_path)
+        MSA_upload.send_keys(self._msa_path)
         print("Fetching query sequences...")
 
         # Wait for the page to load
@@ -268,13 +278,55 @@ class ConsurfRunner:
 
         print(driver.find_element(By.XPATH, "/html/body/div[3]/b").text)
         job_id = driver.find_element(By.XPATH, "/html/body/div[3]/b").text.split()[7][:-1]
+        return job_id
+
+    def submit(self, driver=None):
+
+        r"""
+        Submits the job and returns right away instead of keeping the browser open until ConSurf finishes. The
+        returned handle can be saved in a remote_jobs.HandleStore and collected later by a remote_jobs.Collector,
+        which writes {pdb_id}_{chain_id}_CONS.txt.
+        :param driver: an already running webdriver to reuse. A new Chrome window is started (and closed) when not given.
+        :return: a remote_jobs.JobHandle
+        """
+
+        from remote_jobs import JobHandle, file_hash
+
+        own_driver = driver is None
+        if own_driver:
+            driver = webdriver.Chrome(ChromeDriverManager().install())
+        try:
+            job_id = self._fill_form(driver)
+        finally:
+            if own_driver:
+                driver.quit()
+        return JobHandle("consurf", job_id, result_url=f"{self._host_url}results/{job_id}/consurf.grades",
+                         output=self._workspace.cons(self._pdb_id, self._chain_id),
+                         inputs={"pdb": file_hash(self._workspace.pdb(self._pdb_id)),
+                                 "msa": file_hash(self._msa_path),
+                                 "chain": self._chain_id})
+
+    def run_job(self, driver=None):
+
+        r"""
+        The program opens a Chrome window and runs the Consurf server and download result automatically.
+        THIS MAY TAKE HOURS.
+        :param driver: an already running webdriver to reuse. A new Chrome window is started (and closed) when not given.
+        :return: N/A
+        """
+
+        own_driver = driver is None
+        if own_driver:
+            driver = webdriver.Chrome(ChromeDriverManager().install())
+        job_id = self._fill_form(driver)
 
         WebDriverWait(driver, 36000).until(
              EC.element_to_be_clickable((By.XPATH, "/html/body/div[3]/ul[9]/li/a"))
         )
 
-        result = requests.get(f"https://consurf.tau.ac.il/results/{job_id}/consurf.grades", verify=False)
-        with open(f"{self._pdb_id}_CONS.txt", "w") as out:
+        result = requests.get(f"{self._host_url}results/{job_id}/consurf.grades", verify=False)
+        with open(self._workspace.cons(self._pdb_id, self._chain_id), "w") as out:
             out.write(result.text)
 
-        driver.quit()
+        if own_driver:
+            driver.quit()
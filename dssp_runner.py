@@ -1,6 +1,8 @@
 import json
 import requests
 import time
+from concurrent.futures import ThreadPoolExecutor
+from workspace import get_workspace
 
 
 class DSSPRunner:
@@ -16,6 +18,8 @@ class DSSPRunner:
         self.file_name: the PDB file to be uploaded
         self.server_url: the url of the server
         self.job_id: job id
+        self.session: the object used for HTTP requests (the requests module or a requests.Session)
+        self.workspace: the Workspace the PDB file is read from and the .dssp file written to
 
     Reference:
     A series of PDB related databases for everyday needs.
@@ -32,17 +36,23 @@ class DSSPRunner:
             self,
             file_name: str = "",
             server_url: str = "https://www3.cmbi.umcn.nl/xssp/",
+            session=None,
+            workspace=None
     ):
 
         r"""
         Object constructor
         :param file_name: the PDB file to be uploaded
         :param server_url: the server url
+        :param session: an optional requests.Session shared between runners, so connections are reused
+        :param workspace: the Workspace of the job. Defaults to the current working directory
         """
 
         self._file_name = file_name
         self._server_url = server_url
         self._job_id = ""
+        self._session = session if session is not None else requests
+        self._workspace = get_workspace(workspace)
 
     def _submit_job(self):
 
@@ -53,10 +63,10 @@ class DSSPRunner:
 
         # Upload PDB file
         print("Submitting DSSP job to server...")
-        with open(f"{self._file_name}.pdb", 'rb') as PDB_file:
+        with open(self._workspace.pdb(self._file_name), 'rb') as PDB_file:
             url_create = f"{self._server_url}api/create/pdb_file/dssp/"
             files = {'file_': PDB_file}
-            r = requests.post(url_create, files=files)
+            r = self._session.post(url_create, files=files)
         r.raise_for_status()
         job_id = json.loads(r.text)['id']
         self._job_id = job_id
@@ -76,6 +86,38 @@ class DSSPRunner:
         status = json.loads(r.text)['status']
         return status
 
+    def _check_status(self) -> str:
+
+        r"""
+        Asks the server for the status of the submitted job once.
+        :return: the status of the job
+        """
+
+        url_status = f'{self._server_url}api/status/pdb_file/dssp/{self._job_id}/'
+        r = self._session.get(url_status)
+        status = self._get_status(r)
+        if status in ['FAILURE', 'REVOKED']:
+            raise Exception(json.loads(r.text)['message'])
+        return status
+
+    def get_file_name(self) -> str:
+
+        r"""
+        Returns file_name.
+        :return: file_name
+        """
+
+        return self._file_name
+
+    def get_job_id(self) -> str:
+
+        r"""
+        Returns job_id.
+        :return: job_id
+        """
+
+        return self._job_id
+
     def _get_result(self):
 
         r"""
@@ -84,13 +126,30 @@ class DSSPRunner:
         """
 
         url_result = '{}api/result/pdb_file/dssp/{}/'.format(self._server_url, self._job_id)
-        r = requests.get(url_result)
+        r = self._session.get(url_result)
         r.raise_for_status()
         result = json.loads(r.text)['result']
 
-        with open(f"{self._file_name}.dssp", "w") as out:
+        with open(self._workspace.dssp(self._file_name), "w") as out:
             out.write(result)
 
+    def submit(self):
+
+        r"""
+        Submits the job without waiting for it. The returned handle can be saved in a remote_jobs.HandleStore and
+        collected later by a remote_jobs.Collector, which writes the .dssp file.
+        :return: a remote_jobs.JobHandle
+        """
+
+        from remote_jobs import JobHandle, file_hash
+
+        self._submit_job()
+        return JobHandle("xssp", self._job_id,
+                         result_url=f"{self._server_url}api/result/pdb_file/dssp/{self._job_id}/",
+                         output=self._workspace.dssp(self._file_name),
+                         status_url=f"{self._server_url}api/status/pdb_file/dssp/{self._job_id}/",
+                         inputs={"pdb": file_hash(self._workspace.pdb(self._file_name))})
+
     def run_job(self):
 
         r"""
@@ -99,16 +158,150 @@ class DSSPRunner:
         """
 
         self._submit_job()
-        ready = False
-        while not ready:
-            url_status = f'{self._server_url}api/status/pdb_file/dssp/{self._job_id}/'
-            r = requests.get(url_status)
-            status = self._get_status(r)
-            if status == 'SUCCESS':
-                ready = True
-            elif status in ['FAILURE', 'REVOKED']:
-                raise Exception(json.loads(r.text)['message'])
-            else:
-                time.sleep(5)
+        while self._check_status() != 'SUCCESS':
+            time.sleep(5)
         self._get_result()
-        print(f"{self._file_name}.dssp generated successfully.")
\ No newline at end of file
+        print(f"{self._file_name}.dssp generated successfully.")
+
+
+class DSSPBatchRunner:
+
+    r"""
+    Class name: DSSPBatchRunner
+    Description: Runs DSSP on many PDB files through the XSSP API at the same time.
+                 Up to max_in_flight jobs are kept on the server. All outstanding jobs are polled together in one round,
+                 and every finished job is downloaded right away, freeing its slot for the next file. The total time is
+                 therefore close to that of the slowest job instead of the sum of all jobs.
+    Variables:
+        self.file_names: the PDB files to be uploaded (without the .pdb extension)
+        self.server_url: the url of the server
+        self.max_in_flight: the largest number of jobs submitted but not yet downloaded
+        self.poll_interval: seconds between two polling rounds
+        self.errors: a dictionary from file name to the error raised for it
+        self.session: the session shared by all jobs
+        self.workspace: the Workspace shared by all jobs
+    """
+
+    def __init__(
+            self,
+            file_names: list,
+            server_url: str = "https://www3.cmbi.umcn.nl/xssp/",
+            max_in_flight: int = 4,
+            poll_interval: float = 5,
+            session=None,
+            workspace=None
+    ):
+
+        r"""
+        Object constructor
+        :param file_names: the PDB files to be uploaded (without the .pdb extension)
+        :param server_url: the server url
+        :param max_in_flight: the largest number of jobs submitted but not yet downloaded
+        :param poll_interval: seconds between two polling rounds
+        :param session: an optional requests.Session (e.g. a rate_governor.GovernedSession). A new one is used otherwise
+        :param workspace: the Workspace the PDB files are read from. Defaults to the current working directory
+        """
+
+        self._file_names = list(dict.fromkeys(file_names))
+        self._server_url = server_url
+        self._max_in_flight = max(1, max_in_flight)
+        self._poll_interval = poll_interval
+        self._errors = {}
+        self._session = session
+        self._workspace = get_workspace(workspace)
+
+    def _submit(self, runner: DSSPRunner) -> bool:
+
+        r"""
+        Submits one job. Errors are recorded instead of raised, so one failed job does not stop the batch.
+        :param runner: the runner of the job
+        :return: True if the job was submitted
+        """
+
+        try:
+            runner._submit_job()
+            return True
+        except Exception as e:
+            self._errors[runner.get_file_name()] = e
+            return False
+
+    def _poll(self, runner: DSSPRunner):
+
+        r"""
+        Checks the status of one job.
+        :param runner: the runner of the job
+        :return: the status of the job, or None if it failed
+        """
+
+        try:
+            return runner._check_status()
+        except Exception as e:
+            self._errors[runner.get_file_name()] = e
+            return None
+
+    def _fetch(self, runner: DSSPRunner) -> bool:
+
+        r"""
+        Downloads the result of one finished job.
+        :param runner: the runner of the job
+        :return: True if the .dssp file was written
+        """
+
+        try:
+            runner._get_result()
+            return True
+        except Exception as e:
+            self._errors[runner.get_file_name()] = e
+            return False
+
+    def get_errors(self) -> dict:
+
+        r"""
+        Returns errors.
+        :return: a dictionary from file name to the error raised for it
+        """
+
+        return self._errors
+
+    def run_job(self) -> list:
+
+        r"""
+        Runs all jobs.
+        :return: the names of the .dssp files generated, in the order the jobs finished
+        """
+
+        session = self._session if self._session is not None else requests.Session()
+        pending = [DSSPRunner(file_name=f, server_url=self._server_url, session=session,
+                              workspace=self._workspace) for f in self._file_names]
+        pending.reverse()
+        in_flight = []
+        done = []
+
+        with ThreadPoolExecutor(max_workers=self._max_in_flight) as pool:
+            while pending or in_flight:
+                # Fill the free slots
+                batch = []
+                while pending and len(in_flight) + len(batch) < self._max_in_flight:
+                    batch.append(pending.pop())
+                submitted = list(pool.map(self._submit, batch))
+                in_flight.extend(runner for runner, ok in zip(batch, submitted) if ok)
+                if not in_flight:
+                    continue
+
+                # One polling round over every outstanding job
+                statuses = list(pool.map(self._poll, in_flight))
+                finished = [runner for runner, status in zip(in_flight, statuses) if status == 'SUCCESS']
+                in_flight = [runner for runner, status in zip(in_flight, statuses) if status not in ('SUCCESS', None)]
+
+                # Download the finished jobs right away
+                for runner, ok in zip(finished, pool.map(self._fetch, finished)):
+                    if ok:
+                        done.append(f"{runner.get_file_name()}.dssp")
+                        print(f"{runner.get_file_name()}.dssp generated successfully.")
+
+                if in_flight:
+                    time.sleep(self._poll_interval)
+
+        for name, error in self._errors.items():
+            print(f"DSSP failed for {name}: {error}")
+        return done
\ No newline at end of file
@@ -0,0 +1,400 @@
+import re
+import numpy as np
+
+
+r"""
+A small expression language for selecting and ranking residues and pairs, compiled to NumPy operations on the columns
+of a ResidueTable. For example:
+    secstruct in "HE" and solex > 40 and cons_grade <= 4 and 25 <= dist <= 55
+Names are the columns of the table (cons_grade is an alias of cons) and, for pairs, dist. In a pair expression a
+residue attribute refers to both residues and a condition on it must hold for both; solex_1 and solex_2 refer to the
+first and the second residue only. The same expressions give scores, e.g. "rsa - 0.5 * cons + dist / 10"; a residue
+attribute in a pair score is averaged over the two residues.
+Supported: numbers, "strings", and/or/not, comparisons (chained, as in Python), in / not in a string of letters,
++ - * /, parentheses and the functions abs, min, max, sqrt.
+"""
+
+aliases = {"cons_grade": "cons"}
+
+functions = {"abs": np.abs, "sqrt": np.sqrt, "min": np.minimum, "max": np.maximum}
+
+_token = re.compile(r"""\s*(?:(?P<number>\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)
+                          |(?P<string>"[^"]*"|'[^']*')
+                          |(?P<name>[A-Za-z_][A-Za-z_0-9]*)
+                          |(?P<op><=|>=|==|!=|<|>|[-+*/(),]))""", re.VERBOSE)
+
+_comparisons = {"<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal, "==": np.equal,
+                "!=": np.not_equal}
+
+_arithmetic = {"+": np.add, "-": np.subtract, "*": np.multiply, "/": np.true_divide}
+
+
+def tokenize(text: str) -> list:
+
+    r"""
+    Splits an expression into tokens.
+    :param text: the expression
+    :return: a list of (kind, value, position)
+    """
+
+    tokens, pos = [], 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = _token.match(text, pos)
+        if m is None or m.end() == pos:
+            raise ValueError(f"Unexpected character at {pos}: {text[pos:pos + 10]!r}")
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == "name" and value in ("and", "or", "not", "in"):
+            kind = "op"
+        tokens.append((kind, value, m.start(kind)))
+        pos = m.end()
+    tokens.append(("end", "", len(text)))
+    return tokens
+
+
+class _Parser:
+
+    r"""
+    Class name: _Parser
+    Description: Recursive-descent parser producing nested tuples:
+                 ("num", x), ("str", s), ("name", n), ("call", f, args), ("neg", a), ("arith", op, a, b),
+                 ("cmp", [a, op, b, op, c ...]), ("in", a, letters, negated), ("and", a, b), ("or", a, b), ("not", a)
+    """
+
+    def __init__(self, text: str):
+        self._text = text
+        self._tokens = tokenize(text)
+        self._k = 0
+
+    def _peek(self):
+        return self._tokens[self._k]
+
+    def _next(self):
+        token = self._tokens[self._k]
+        self._k += 1
+        return token
+
+    def _expect(self, value: str):
+        kind, got, pos = self._next()
+        if got != value or kind not in ("op",):
+            raise ValueError(f"Expected {value!r} at {pos} in {self._text!r}")
+
+    def parse(self):
+        node = self._or()
+        kind, value, pos = self._peek()
+        if kind != "end":
+            raise ValueError(f"Unexpected {value!r} at {pos} in {self._text!r}")
+        return node
+
+    def _or(self):
+        node = self._and()
+        while self._peek()[:2] == ("op", "or"):
+            self._next()
+            node = ("or", node, self._and())
+        return node
+
+    def _and(self):
+        node = self._not()
+        while self._peek()[:2] == ("op", "and"):
+            self._next()
+            node = ("and", node, self._not())
+        return node
+
+    def _not(self):
+        if self._peek()[:2] == ("op", "not"):
+            self._next()
+            return ("not", self._not())
+        return self._comparison()
+
+    def _comparison(self):
+        node = self._sum()
+        kind, value, pos = self._peek()
+        if kind == "op" and value in _comparisons:
+            chain = [node]
+            while self._peek()[0] == "op" and self._peek()[1] in _comparisons:
+                chain.append(self._next()[1])
+                chain.append(self._sum())
+            return ("cmp", chain)
+        negated = False
+        if (kind, value) == ("op", "not") and self._tokens[self._k + 1][:2] == ("op", "in"):
+            self._next()
+            negated = True
+            kind, value, pos = self._peek()
+        if (kind, value) == ("op", "in"):
+            self._next()
+            kind, letters, pos = self._next()
+            if kind != "string":
+                raise ValueError(f"Expected a string after 'in' at {pos} in {self._text!r}")
+            return ("in", node, letters[1:-1], negated)
+        return node
+
+    def _sum(self):
+        node = self._term()
+        while self._peek()[0] == "op" and self._peek()[1] in "+-":
+            op = self._next()[1]
+            node = ("arith", op, node, self._term())
+        return node
+
+    def _term(self):
+        node = self._unary()
+        while self._peek()[0] == "op" and self._peek()[1] in "*/":
+            op = self._next()[1]
+            node = ("arith", op, node, self._unary())
+        return node
+
+    def _unary(self):
+        if self._peek()[:2] == ("op", "-"):
+            self._next()
+            return ("neg", self._unary())
+        return self._atom()
+
+    def _atom(self):
+        kind, value, pos = self._next()
+        if kind == "number":
+            return ("num", float(value))
+        if kind == "string":
+            return ("str", value[1:-1])
+        if kind == "name":
+            if self._peek()[:2] == ("op", "("):
+                if value not in functions:
+                    raise ValueError(f"Unknown function {value!r} at {pos}")
+                self._next()
+                args = [self._sum()]
+                while self._peek()[:2] == ("op", ","):
+                    self._next()
+                    args.append(self._sum())
+                self._expect(")")
+                return ("call", value, args)
+            return ("name", value)
+        if (kind, value) == ("op", "("):
+            node = self._or()
+            self._expect(")")
+            return node
+        if kind == "end":
+            raise ValueError(f"Unexpected end of {self._text!r}")
+        raise ValueError(f"Unexpected {value!r} at {pos} in {self._text!r}")
+
+
+def _names(node) -> set:
+    kind = node[0]
+    if kind == "name":
+        return {node[1]}
+    if kind in ("num", "str"):
+        return set()
+    if kind == "call":
+        return set().union(*(_names(a) for a in node[2]))
+    if kind == "cmp":
+        return set().union(*(_names(a) for a in node[1][::2]))
+    return set().union(*(_names(a) for a in node[1:] if isinstance(a, tuple)))
+
+
+class _Columns:
+
+    r"""
+    Class name: _Columns
+    Description: Looks up the arrays named in an expression, gathering only the columns that are used. For pairs, a
+                 residue attribute becomes a (2, n_pairs) array holding the values of both residues.
+    """
+
+    def __init__(self, table, pairs: dict = None):
+        self._table = table
+        self._pairs = pairs
+        self._cache = {}
+
+    def get(self, name: str):
+        if name in self._cache:
+            return self._cache[name]
+        column, end = aliases.get(name, name), None
+        if self._pairs is not None and name in self._pairs:
+            value = np.asarray(self._pairs[name])
+        else:
+            if not self._table.has_column(column) and re.fullmatch(r".+_[12]", column):
+                column, end = aliases.get(column[:-2], column[:-2]), int(column[-1])
+            if not self._table.has_column(column):
+                raise ValueError(f"Unknown attribute {name!r}")
+            value = self._table.get_column(column)
+            if self._pairs is not None:
+                i, j = self._pairs["i"], self._pairs["j"]
+                value = value[i] if end == 1 else value[j] if end == 2 else np.stack((value[i], value[j]))
+            elif end is not None:
+                raise ValueError(f"{name!r} is only defined for pairs")
+        self._cache[name] = value
+        return value
+
+
+def _both(value):
+    value = np.asarray(value)
+    return value.all(axis=0) if value.ndim == 2 else value
+
+
+def _evaluate(node, columns: _Columns):
+    kind = node[0]
+    if kind == "num" or kind == "str":
+        return node[1]
+    if kind == "name":
+        return columns.get(node[1])
+    if kind == "neg":
+        return np.negative(_evaluate(node[1], columns))
+    if kind == "arith":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return _arithmetic[node[1]](_evaluate(node[2], columns), _evaluate(node[3], columns))
+    if kind == "call":
+        return functions[node[1]](*(_evaluate(a, columns) for a in node[2]))
+    if kind == "cmp":
+        chain = node[1]
+        left = _evaluate(chain[0], columns)
+        result = True
+        for k in range(1, len(chain), 2):
+            right = _evaluate(chain[k + 1], columns)
+            with np.errstate(invalid="ignore"):
+                result = result & _both(_comparisons[chain[k]](left, right))
+            left = right
+        return result
+    if kind == "in":
+        value = np.asarray(_evaluate(node[1], columns))
+        found = np.isin(value, list(node[2]))
+        # Negate before reducing, so "not in" must hold for both residues of a pair like any residue condition
+        return _both(~found if node[3] else found)
+    if kind == "and":
+        return _both(_evaluate(node[1], columns)) & _both(_evaluate(node[2], columns))
+    if kind == "or":
+        return _both(_evaluate(node[1], columns)) | _both(_evaluate(node[2], columns))
+    if kind == "not":
+        return ~_both(_evaluate(node[1], columns))
+    raise ValueError(f"Unknown node {kind}")
+
+
+class Expression:
+
+    r"""
+    Class name: Expression
+    Description: A compiled filter or score expression. Parsing happens once; evaluating it on a table only runs NumPy
+                 operations on the columns it names.
+    Variables:
+        self.text: the source of the expression
+        self.names: the attribute names used in the expression
+    """
+
+    def __init__(self, text: str):
+
+        r"""
+        Object constructor.
+        :param text: the expression
+        """
+
+        self._text = text
+        self._node = _Parser(text).parse()
+        self._names = _names(self._node)
+
+    def get_text(self) -> str:
+
+        r"""
+        Returns text.
+        :return: text
+        """
+
+        return self._text
+
+    def get_names(self) -> set:
+
+        r"""
+        Returns names.
+        :return: the attribute names used in the expression
+        """
+
+        return set(self._names)
+
+    def mask(self, table, pairs: dict = None) -> np.ndarray:
+
+        r"""
+        Evaluates the expression as a filter.
+        :param table: a ResidueTable
+        :param pairs: optional pair columns ("i", "j", "dist", ...) from residue_table.iter_pairs. When given, the
+                      mask has one value per pair.
+        :return: a boolean array
+        """
+
+        n = len(pairs["i"]) if pairs is not None else table.get_length()
+        value = _both(_evaluate(self._node, _Columns(table, pairs)))
+        return np.broadcast_to(np.asarray(value, dtype=bool), (n,))
+
+    def score(self, table, pairs: dict = None) -> np.ndarray:
+
+        r"""
+        Evaluates the expression as a score. Residue attributes in a pair score are averaged over both residues.
+        :param table: a ResidueTable
+        :param pairs: optional pair columns from residue_table.iter_pairs
+        :return: a float array
+        """
+
+        n = len(pairs["i"]) if pairs is not None else table.get_length()
+        value = np.asarray(_evaluate(self._node, _Columns(table, pairs)), dtype=np.float64)
+        if value.ndim == 2:
+            value = value.mean(axis=0)
+        return np.broadcast_to(value, (n,))
+
+
+def compile_expr(text) -> Expression:
+
+    r"""
+    Compiles an expression. Expressions are returned unchanged, so either form can be passed around.
+    :param text: the expression text, or an Expression
+    :return: an Expression
+    """
+
+    return text if isinstance(text, Expression) else Expression(text)
+
+
+def top_k(scores: np.ndarray, k: int, mask: np.ndarray = None) -> np.ndarray:
+
+    r"""
+    Finds the indices of the k largest scores without sorting the whole array.
+    :param scores: the scores
+    :param k: the number of indices returned
+    :param mask: optional boolean array; only selected entries are ranked
+    :return: indices, best first
+    """
+
+    idx = np.flatnonzero(mask) if mask is not None else np.arange(len(scores))
+    values = np.nan_to_num(np.asarray(scores, dtype=np.float64)[idx], nan=-np.inf)
+    if k < len(idx):
+        part = np.argpartition(-values, k - 1)[:k]
+        idx, values = idx[part], values[part]
+    return idx[np.argsort(-values, kind="stable")]
+
+
+def select(table, where=None, score=None, k: int = None, pairs: dict = None) -> np.ndarray:
+
+    r"""
+    Filters and ranks residues or pairs.
+    :param table: a ResidueTable
+    :param where: a filter expression (text or Expression), or None to keep everything
+    :param score: a score expression; without it the selected indices keep their order
+    :param k: the largest number of indices returned
+    :param pairs: optional pair columns from residue_table.iter_pairs
+    :return: indices into the table rows, or into the pairs
+    """
+
+    n = len(pairs["i"]) if pairs is not None else table.get_length()
+    mask = compile_expr(where).mask(table, pairs) if where is not None else np.ones(n, dtype=bool)
+    if score is None:
+        idx = np.flatnonzero(mask)
+        return idx if k is None else idx[:k]
+    return top_k(compile_expr(score).score(table, pairs), n if k is None else k, mask)
+
+
+def filter_pairs(table, pair_chunks, where):
+
+    r"""
+    Applies a pair filter to the chunks produced by residue_table.iter_pairs.
+    :param table: a ResidueTable
+    :param pair_chunks: an iterable of pair dictionaries
+    :param where: a filter expression (text or Expression)
+    :return: a generator of filtered pair dictionaries
+    """
+
+    expr = compile_expr(where)
+    for chunk in pair_chunks:
+        keep = expr.mask(table, chunk)
+        yield {key: np.asarray(values)[keep] for key, values in chunk.items()}
@@ -0,0 +1,549 @@
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pdb_cache import PDBCache
+from rate_governor import BATCH, INTERACTIVE, NORMAL, GovernedSession, priority
+from stages import list_stages, load_stage
+from workspace import Workspace
+
+r"""
+A long-running job service with a local HTTP/JSON API, so lab tools and notebooks can submit jobs without starting a new
+Python process, a new browser and a new set of connections for every protein.
+
+Endpoints:
+    POST /jobs                  {"pdb_id": "1abc", "chains": ["A"], "options": {...}} -> {"job_id": ...}
+    GET  /jobs                  all jobs with their status
+    GET  /jobs/{job_id}         status, per-stage progress and errors of one job
+    GET  /jobs/{job_id}/result  residues and candidate pairs (query: ?limit=N); provisional until all stages finish
+    GET  /stages                the registered pipeline stages
+    GET  /health
+
+Job options (all optional):
+    dssp            run DSSP through XSSP (default true)
+    topology        "local" (default) or "topcons"; all chains of a job are sent to TOPCONS in one submission
+    consurf         fetch one MSA per chain from MMseqs2 and run ConSurf for the chains (default false, needs "email")
+    email           email given to ConSurf
+    min_dist        smallest pair distance in Angstrom (default 20)
+    max_dist        largest pair distance in Angstrom (default 50)
+    filter          residue filter expression (see filter_expr.py), replacing the default criteria
+    pair_filter     pair filter expression, e.g. "25 <= dist <= 55 and cons_grade <= 4"
+    prefilter       residue filter on the burial columns (cn8, cn12, hse_up, hse_down, depth, see burial.py), e.g.
+                    "cn12 < 40 and depth < 8". It is added to the filter, and chains without any residue passing it
+                    skip the membrane and conservation stages
+    plan            skip TOPCONS and ConSurf for chains that cannot give candidate pairs once the cheap annotations are
+                    known (default true, see stage_planner.py)
+    priority        "interactive", "normal" (default) or "batch"; requests of interactive jobs are sent first when
+                    several jobs wait for the same remote host (see rate_governor.py)
+
+Usage:
+    python job_service.py --port 8350 --root jobs
+"""
+
+# The PDB ID and chain identifiers of a request become file and directory names, so only these shapes are accepted
+pdb_id_pattern = re.compile(r"^[0-9][A-Za-z0-9]{3}$")
+chain_id_pattern = re.compile(r"^[A-Za-z0-9]{1,4}$")
+
+
+class ServiceJob:
+
+    r"""
+    Class name: ServiceJob
+    Description: The state of one job submitted to the service.
+    Variables:
+        self.job_id: job id
+        self.pdb_id: PDB ID of the protein
+        self.chains: chain identifiers to annotate (all chains when empty)
+        self.options: the job options
+        self.status: "queued", "running", "done" or "failed"
+        self.stages: a list of [stage name, state] pairs, state being "pending", "running", "done" or "skipped"
+        self.error: the error message of a failed job
+        self.result: paths of the result files
+        self.plan: the chains each expensive stage ran for or skipped, and the estimated time saved (seconds)
+    """
+
+    def __init__(self, pdb_id: str, chains: list, options: dict):
+
+        r"""
+        Object constructor.
+        :param pdb_id: PDB ID of the protein
+        :param chains: chain identifiers to annotate
+        :param options: the job options
+        """
+
+        self.job_id = f"{time.strftime('%m_%d_%Y_%H_%M_%S')}_{pdb_id}_{uuid.uuid4().hex[:6]}"
+        self.pdb_id = pdb_id
+        self.chains = list(chains)
+        self.options = dict(options)
+        self.status = "queued"
+        self.stages = [[name, "pending"] for name in ("download", "parse", "burial", "dssp", "sasa",
+                                                     "membrane", "msa", "conservation", "pairs")]
+        self.error = ""
+        self.result = {}
+        self.plan = {}
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def set_stage(self, name: str, state: str):
+
+        r"""
+        Updates the state of one stage.
+        :param name: stage name
+        :param state: the new state
+        :return: N/A
+        """
+
+        for stage in self.stages:
+            if stage[0] == name:
+                stage[1] = state
+
+    def to_dict(self) -> dict:
+
+        r"""
+        Returns the job as a JSON-serializable dictionary.
+        :return: the dictionary
+        """
+
+        finished = sum(1 for _, state in self.stages if state in ("done", "skipped"))
+        return {"job_id": self.job_id, "pdb_id": self.pdb_id, "chains": self.chains, "options": self.options,
+                "status": self.status, "progress": finished / len(self.stages),
+                "stages": [{"name": n, "state": s} for n, s in self.stages], "error": self.error,
+                "result": self.result, "plan": self.plan, "created": self.created, "started": self.started,
+                "finished": self.finished}
+
+
+class JobService:
+
+    r"""
+    Class name: JobService
+    Description: Runs submitted jobs on a thread pool and keeps what is expensive to create warm between jobs: loaded
+                 stage modules, one HTTP session, downloaded PDB files and, when TOPCONS or ConSurf are used, one
+                 browser per worker thread.
+                 Every job gets its own Workspace, through which the runners and the Protein resolve their files, so
+                 the process never changes directory and jobs run concurrently on the worker threads.
+    Variables:
+        self.root: the directory that contains one sub-directory per job
+        self.jobs: a dictionary from job id to ServiceJob
+        self.pdb_cache: the PDBCache shared by all jobs
+    """
+
+    def __init__(self, root: str = "jobs", workers: int = 1, pdb_cache: str = None, offline: bool = False):
+
+        r"""
+        Object constructor.
+        :param root: the directory that contains one sub-directory per job
+        :param workers: the number of jobs run at the same time
+        :param pdb_cache: the PDB cache directory. Defaults to {root}/pdb_cache
+        :param offline: if True, PDB files are only read from the cache
+        """
+
+        self._root = os.path.abspath(root)
+        os.makedirs(self._root, exist_ok=True)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._session = GovernedSession()
+        self._pdb_cache = PDBCache(pdb_cache or os.path.join(self._root, "pdb_cache"), offline=offline,
+                                   session=self._session)
+        self._browsers = threading.local()
+        self._all_browsers = []
+
+    def submit(self, pdb_id: str, chains: list = (), options: dict = None) -> ServiceJob:
+
+        r"""
+        Queues a job.
+        :param pdb_id: PDB ID of the protein
+        :param chains: chain identifiers to annotate
+        :param options: the job options
+        :return: the ServiceJob
+        """
+
+        job = ServiceJob(pdb_id, chains, options or {})
+        with self._lock:
+            self._jobs[job.job_id] = job
+        self._pool.submit(self._run, job)
+        return job
+
+    def get_job(self, job_id: str) -> ServiceJob:
+
+        r"""
+        Looks up a job.
+        :param job_id: job id
+        :return: the ServiceJob, or None
+        """
+
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def get_jobs(self) -> list:
+
+        r"""
+        Returns all jobs.
+        :return: a list of ServiceJobs
+        """
+
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _browser(self):
+
+        r"""
+        Returns the browser of the current worker thread, starting it on first use.
+        :return: a selenium webdriver
+        """
+
+        driver = getattr(self._browsers, "driver", None)
+        if driver is None:
+            from selenium import webdriver
+            from webdriver_manager.chrome import ChromeDriverManager
+            driver = webdriver.Chrome(ChromeDriverManager().install())
+            self._browsers.driver = driver
+            with self._lock:
+                self._all_browsers.append(driver)
+        return driver
+
+    def _download(self, job: ServiceJob, workspace: Workspace):
+
+        r"""
+        Writes the PDB file into the job directory, from the cache when possible.
+        :param job: the ServiceJob
+        :param workspace: the Workspace of the job
+        :return: N/A
+        """
+
+        downloader = load_stage("download")(session=self._session, cache=self._pdb_cache, workspace=workspace)
+        if not downloader.is_valid(job.pdb_id):
+            raise ValueError(f"PDB ID {job.pdb_id} is invalid.")
+        downloader.set_pdb_id(job.pdb_id)
+        downloader.download_pdb()
+
+    def _run(self, job: ServiceJob):
+
+        r"""
+        Runs one job.
+        :param job: the ServiceJob
+        :return: N/A
+        """
+
+        workspace = Workspace(os.path.join(self._root, job.job_id))
+        job.status = "running"
+        job.started = time.time()
+        try:
+            level = {"interactive": INTERACTIVE, "batch": BATCH}.get(job.options.get("priority"), NORMAL)
+            with priority(level):
+                self._pipeline(job, workspace)
+            job.status = "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+            with open(workspace.path("error.txt"), "w") as out:
+                out.write(traceback.format_exc())
+        finally:
+            job.finished = time.time()
+        with open(workspace.path("status.json"), "w") as out:
+            json.dump(job.to_dict(), out)
+
+    def _pipeline(self, job: ServiceJob, workspace: Workspace):
+
+        r"""
+        Runs the stages of a job inside its directory.
+        :param job: the ServiceJob
+        :param workspace: the Workspace of the job
+        :return: N/A
+        """
+
+        options = job.options
+        pdb_id = job.pdb_id
+
+        job.set_stage("download", "running")
+        self._download(job, workspace)
+        job.set_stage("download", "done")
+
+        job.set_stage("parse", "running")
+        protein = load_stage("parse")(pdb_id=pdb_id, workspace=workspace)
+        chains = job.chains if job.chains else protein.get_chain_ids()
+        job.set_stage("parse", "done")
+
+        job.set_stage("burial", "running")
+        from burial import add_burial, pdb_burial
+        burial = pdb_burial(workspace.pdb(pdb_id))
+        where = options.get("filter")
+        prefilter = options.get("prefilter")
+        if prefilter:
+            from filter_expr import compile_expr
+            from protein_seq import default_filter
+            from residue_table import ResidueTable
+            # Buried chains are dropped before any remote stage runs
+            keep = compile_expr(prefilter).mask(ResidueTable(pdb_id, burial))
+            chains = [chainID for chainID in chains if keep[burial["chain"] == chainID].any()]
+            where = f"({where if where else default_filter}) and ({prefilter})"
+        job.set_stage("burial", "done")
+
+        if options.get("dssp", True):
+            job.set_stage("dssp", "running")
+            load_stage("dssp")(file_name=pdb_id, session=self._session, workspace=workspace).run_job()
+            protein.check_dssp()
+            job.set_stage("dssp", "done")
+        else:
+            job.set_stage("dssp", "skipped")
+
+        job.set_stage("sasa", "running")
+        # Keep the DSSP accessibility when DSSP ran; the local computation still provides rsa
+        protein.check_sasa(set_solex=not options.get("dssp", True))
+        job.set_stage("sasa", "done")
+
+        # Structure-only results are published right away and refined as the other annotations arrive
+        job.set_stage("pairs", "running")
+        from progressive import ProgressiveResults
+        table = protein.to_table()
+        add_burial(table, burial)
+        if options.get("dssp", True):
+            # Every DSSP field (phi/psi, H-bond energies, chain breaks, ...) can be used in the filters
+            from result_parsers import add_dssp, read_dssp
+            add_dssp(table, read_dssp(workspace.dssp(pdb_id)))
+        progress = ProgressiveResults(table, workspace.path(pdb_id), where=where,
+                                      pair_where=options.get("pair_filter"),
+                                      min_dist=float(options.get("min_dist", 20.0)),
+                                      max_dist=float(options.get("max_dist", 50.0)),
+                                      pending=["mem", "cons"] if options.get("consurf", False) else ["mem"])
+        self._publish(job, workspace, progress, "structure")
+
+        # Expensive stages only run for the chains that can still give candidate pairs
+        from stage_planner import StagePlanner
+        planner = StagePlanner(table, where=where, pair_where=options.get("pair_filter"),
+                               min_dist=float(options.get("min_dist", 20.0)),
+                               max_dist=float(options.get("max_dist", 50.0)),
+                               min_cost=60.0 if options.get("plan", True) else float("inf"))
+
+        job.set_stage("membrane", "running")
+        topology = "topcons_batch" if options.get("topology", "local") == "topcons" else "topology_local"
+        membrane_chains = planner.chains_for(topology, chains, pending=progress.get_pending())
+        if topology == "topcons_batch" and membrane_chains:
+            # All chains of the job go to TOPCONS in one submission
+            predicted = load_stage("topcons_batch")(protein.get_seqs(membrane_chains), driver=self._browser(),
+                                                    workspace=workspace)
+            for (_, chainID), mem in predicted.items():
+                if mem is not None:
+                    protein.check_mem(chainID)
+        else:
+            for chainID in membrane_chains:
+                load_stage("topology_local")(pdb_id, chainID, workspace=workspace)
+                protein.check_mem(chainID)
+        progress.update_from_protein(protein, "mem")
+        self._publish(job, workspace, progress, "membrane")
+        job.set_stage("membrane", "done" if membrane_chains else "skipped")
+
+        if options.get("consurf", False):
+            consurf_chains = planner.chains_for("consurf", chains, pending=progress.get_pending())
+            if consurf_chains:
+                # ConSurf uploads one alignment per chain: {pdb_id}_{chainID}_MSA.fasta, all fetched in one ticket
+                job.set_stage("msa", "running")
+                seqs = {f"{pdb_id}_{chainID}": protein.get_seq(chainID) for chainID in consurf_chains}
+                load_stage("msa_batch")(job=job.job_id, seqs=seqs, session=self._session,
+                                        workspace=workspace).run_job(convert=True)
+                job.set_stage("msa", "done")
+            else:
+                job.set_stage("msa", "skipped")
+            job.set_stage("conservation", "running")
+            for chainID in consurf_chains:
+                runner = load_stage("consurf")(pdb_id=pdb_id, email=options.get("email", ""), job_id=job.job_id,
+                                               chain_id=chainID, workspace=workspace, msa_name=f"{pdb_id}_{chainID}")
+                runner.run_job(driver=self._browser())
+                protein.check_cons(chainID)
+            if consurf_chains:
+                progress.update_from_protein(protein, "cons")
+            else:
+                progress.resolve("cons")
+            self._publish(job, workspace, progress, "conservation")
+            job.set_stage("conservation", "done" if consurf_chains else "skipped")
+        else:
+            job.set_stage("msa", "skipped")
+            job.set_stage("conservation", "skipped")
+        job.plan = {"stages": planner.get_decisions(), "saved": planner.get_saved()}
+
+        job.set_stage("pairs", "done")
+
+    def _publish(self, job: ServiceJob, workspace: Workspace, progress, stage: str):
+
+        r"""
+        Writes the current results of a job and points the job at them.
+        :param job: the ServiceJob
+        :param workspace: the Workspace of the job
+        :param progress: the ProgressiveResults of the job
+        :param stage: the stage that just finished
+        :return: N/A
+        """
+
+        info = progress.publish(stage)
+        job.result = {"residues": workspace.path(f"{job.pdb_id}_residues.tsv"),
+                      "pairs": workspace.path(f"{job.pdb_id}_pairs.tsv"), "n_pairs": info["n_pairs"],
+                      "provisional": info["provisional"], "version": info["version"], "stage": stage}
+
+    def result(self, job: ServiceJob, limit: int = 1000) -> dict:
+
+        r"""
+        Reads the latest results of a job. While later stages are still running, the results are provisional: they
+        come from the annotations available so far.
+        :param job: the ServiceJob
+        :param limit: the largest number of pairs returned
+        :return: a dictionary with "residues" and "pairs" lists
+        """
+
+        out = {"job_id": job.job_id, "status": job.status, "residues": [], "pairs": []}
+        result = job.result
+        if not result:
+            return out
+        out["provisional"] = result["provisional"] or job.status != "done"
+        out["version"] = result["version"]
+        for key in ("residues", "pairs"):
+            with open(result[key], "r") as file:
+                header = file.readline().rstrip("\n").split("\t")
+                for k, line in enumerate(file):
+                    if key == "pairs" and k >= limit:
+                        break
+                    out[key].append(dict(zip(header, line.rstrip("\n").split("\t"))))
+        return out
+
+    def shutdown(self):
+
+        r"""
+        Stops the worker threads and closes the browsers.
+        :return: N/A
+        """
+
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        for driver in self._all_browsers:
+            driver.quit()
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+
+    r"""
+    Class name: ServiceHandler
+    Description: Translates HTTP requests into JobService calls. The service is attached to the server object.
+    """
+
+    def _send(self, code: int, payload):
+
+        r"""
+        Sends a JSON response.
+        :param code: HTTP status code
+        :param payload: a JSON-serializable object
+        :return: N/A
+        """
+
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        service = self.server.service
+        path, _, query = self.path.partition("?")
+        params = dict(p.split("=", 1) for p in query.split("&") if "=" in p)
+        parts = [p for p in path.split("/") if p]
+        if parts == ["health"]:
+            self._send(200, {"status": "ok", "jobs": len(service.get_jobs())})
+        elif parts == ["stages"]:
+            self._send(200, [{"name": s.get_name(), "remote": s.is_remote(), "loaded": s.is_loaded(),
+                              "description": s.get_description()} for s in list_stages()])
+        elif parts == ["jobs"]:
+            self._send(200, [job.to_dict() for job in service.get_jobs()])
+        elif len(parts) in (2, 3) and parts[0] == "jobs":
+            job = service.get_job(parts[1])
+            if job is None:
+                self._send(404, {"error": f"Unknown job {parts[1]}"})
+            elif len(parts) == 2:
+                self._send(200, job.to_dict())
+            elif parts[2] == "result":
+                try:
+                    limit = int(params.get("limit", 1000))
+                except ValueError:
+                    self._send(400, {"error": "limit must be an integer."})
+                    return
+                self._send(200, service.result(job, limit=limit))
+            else:
+                self._send(404, {"error": "Not found"})
+        else:
+            self._send(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            self._send(404, {"error": "Not found"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            pdb_id = request["pdb_id"]
+        except (ValueError, KeyError, TypeError, IndexError):
+            # TypeError and IndexError: the body is valid JSON but not an object
+            self._send(400, {"error": "Expected a JSON body with a pdb_id."})
+            return
+        if not isinstance(pdb_id, str) or not pdb_id_pattern.match(pdb_id):
+            self._send(400, {"error": "pdb_id must be a four-character PDB ID, e.g. 1abc."})
+            return
+        chains = request.get("chains", [])
+        if not isinstance(chains, list) or not all(isinstance(c, str) and chain_id_pattern.match(c) for c in chains):
+            self._send(400, {"error": "chains must be a list of chain identifiers, e.g. [\"A\"]."})
+            return
+        options = request.get("options", {})
+        if not isinstance(options, dict):
+            self._send(400, {"error": "options must be a JSON object."})
+            return
+        job = self.server.service.submit(pdb_id, chains, options)
+        self._send(202, {"job_id": job.job_id, "status": job.status})
+
+
+def serve(host: str = "127.0.0.1", port: int = 8350, root: str = "jobs", workers: int = 1, pdb_cache: str = None,
+          offline: bool = False) -> ThreadingHTTPServer:
+
+    r"""
+    Creates the HTTP server of the service. Call serve_forever on the result to start it.
+    :param host: the address to listen on. Keep it local: the API has no authentication.
+    :param port: the port to listen on
+    :param root: the directory that contains one sub-directory per job
+    :param workers: the number of jobs run at the same time
+    :param pdb_cache: the PDB cache directory
+    :param offline: if True, PDB files are only read from the cache
+    :return: the server
+    """
+
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.service = JobService(root=root, workers=workers, pdb_cache=pdb_cache, offline=offline)
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Spin label locator job service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8350)
+    parser.add_argument("--root", default="jobs")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--pdb-cache", default=None)
+    parser.add_argument("--offline", action="store_true")
+    parser.add_argument("--governor-dir", default=None,
+                        help="share the per-host request limits with other processes through this directory")
+    args = parser.parse_args()
+    if args.governor_dir:
+        from rate_governor import configure
+        configure(lock_dir=args.governor_dir)
+    server = serve(args.host, args.port, args.root, args.workers, args.pdb_cache, args.offline)
+    print(f"Listening on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.service.shutdown()
+        server.server_close()
@@ -1,76 +1,176 @@
+import argparse
 import os
-from pdb_downloader import PDBDownloader
-from primary_sequence import get_seq
-from protein_seq import Protein
-from msa_converter import msa_convert
-# from seqret_runner import SeqretRunner
-from mmseqs_runner import MMSeqs2Runner
-from dssp_runner import DSSPRunner
 from datetime import datetime
-from topcons_runner import run_topcons
-from consurf_runner import ConsurfRunner
+from stages import get_stage, list_stages, load_stage
+from workspace import Workspace
 
 
 r"""
 Protein Spin Label Locator
 """
 
-email = input("Please provide your email address: ")
-now = datetime.now()
-dt = now.strftime("%m_%d_%Y_%H_%M_%S")
-
-# Ask the user for a PDB ID and then download the PDB file.
-pdbD = PDBDownloader()
-pdb_id = pdbD.get_user_input()
-job_id = f"{dt}_{pdb_id}"
-download_path = os.path.join(os.getcwd(), f"{job_id}")
-os.mkdir(download_path)
-os.chdir(download_path)
-PDB_path = pdbD.download_pdb()
-
-# Extract primary sequence from the PDB file
-seq = get_seq(PDB_path)
-
-# create AA sequence
-protein = Protein(pdb_id=pdb_id)
-
-print("Starting to convert the sequence into FASTA format...")
-
-# # get a fasta file of the sequence
-# getF = SeqretRunner(email=email, job_id=job_id, mode="fasta", seq=seq, out_name=f"{pdb_id}_SEQ")
-# fasta_path = getF.run_job()
-
-print("Starting to fetch MSA...")
-# get MSA file in a3m format and convert it into fasta format
-getMSA = MMSeqs2Runner(job=job_id, seq=seq)
-getMSA.run_job(pdb_id)
-print("MSA fetched. Starting to convert MSA into CLUSTAL format...")
-msa_convert(pdb_id)
-
-print("Predicting secondary structures and solvent exposure...")
-# Run DSSP
-getSecStruct = DSSPRunner(file_name=pdb_id)
-getSecStruct.run_job()
-
-protein.check_dssp()
-protein.display()
-
-print("Predicting membrane exposure...")
-# Run Topcons
-run_topcons(pdb_id)
-
-#print("Calculating conservation score...")
-# Run Consurf
-getCons = ConsurfRunner(pdb_id=pdb_id, email=email, job_id=job_id)
-chain_id = getCons.out_chain_id()
-getCons.run_job()
-
-# print("Analyzing results...")
-# # Read the results fetched by the above tools and modify the Protein object accordingly to record the properties of
-# # AminoAcids.
-#
-# print("Calculating distances between qualified residues...")
-# # # Calculate distance
-# # runDistance(file_path, protein)
-# #
-# # output_result(protein)
+# Stages run by default, in order. Each stage imports its own dependencies only when it is reached.
+pipeline = ["download", "sequence", "parse", "dssp", "topcons_batch", "msa_batch", "msa_convert", "consurf"]
+
+
+def parse_args():
+
+    r"""
+    Reads the command line options.
+    :return: the parsed options
+    """
+
+    parser = argparse.ArgumentParser(description="Protein Spin Label Locator")
+    parser.add_argument("--list-stages", action="store_true", help="list the available stages and exit")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="print the stages that would run and any missing packages, then exit")
+    parser.add_argument("--local-topology", action="store_true",
+                        help="estimate membrane topology locally instead of running TOPCONS")
+    parser.add_argument("--pdb-cache", default=None, metavar="DIR",
+                        help="read PDB files through a local cache shared between runs")
+    parser.add_argument("--offline", action="store_true", help="only use PDB files already in the cache")
+    return parser.parse_args()
+
+
+def plan(args) -> list:
+
+    r"""
+    Decides which stages run.
+    :param args: the parsed options
+    :return: a list of stage names
+    """
+
+    stages = list(pipeline)
+    if args.local_topology:
+        stages[stages.index("topcons_batch")] = "topology_local"
+    return stages
+
+
+def dry_run(stages: list):
+
+    r"""
+    Prints the stages that would run without importing any of them.
+    :param stages: a list of stage names
+    :return: N/A
+    """
+
+    for name in stages:
+        stage = get_stage(name)
+        missing = stage.missing_requirements()
+        note = f"  (missing: {', '.join(missing)})" if missing else ""
+        print(stage.describe() + note)
+
+
+def run(stages: list, pdb_cache: str = None, offline: bool = False):
+
+    r"""
+    Runs the pipeline.
+    :param stages: a list of stage names
+    :param pdb_cache: an optional PDB cache directory
+    :param offline: if True, PDB files are only read from the cache
+    :return: N/A
+    """
+
+    email = input("Please provide your email address: ")
+    now = datetime.now()
+    dt = now.strftime("%m_%d_%Y_%H_%M_%S")
+
+    # Ask the user for a PDB ID and then download the PDB file.
+    cache = None
+    if pdb_cache:
+        from pdb_cache import PDBCache
+        cache = PDBCache(pdb_cache, offline=offline)
+    pdb_id = load_stage("download")(cache=cache).get_user_input()
+    job_id = f"{dt}_{pdb_id}"
+    # Every file of the job is resolved in its own directory; the current directory is left alone
+    workspace = Workspace(os.path.abspath(job_id))
+    pdbD = load_stage("download")(cache=cache, workspace=workspace)
+    pdbD.set_pdb_id(pdb_id)
+    PDB_path = pdbD.download_pdb()
+
+    # Extract primary sequence from the PDB file
+    seq = load_stage("sequence")(PDB_path)
+
+    # create AA sequence
+    protein = load_stage("parse")(pdb_id=pdb_id, workspace=workspace)
+
+    print("Starting to convert the sequence into FASTA format...")
+
+    # # get a fasta file of the sequence
+    # getF = SeqretRunner(email=email, job_id=job_id, mode="fasta", seq=seq, out_name=f"{pdb_id}_SEQ")
+    # fasta_path = getF.run_job()
+
+    if "dssp" in stages:
+        print("Predicting secondary structures and solvent exposure...")
+        # Run DSSP
+        getSecStruct = load_stage("dssp")(file_name=pdb_id, workspace=workspace)
+        getSecStruct.run_job()
+
+        protein.check_dssp()
+        protein.display()
+
+    # The cheap annotations are known: the expensive stages only run for chains that can still give candidate pairs
+    from stage_planner import StagePlanner
+    planner = StagePlanner(protein.to_table())
+    pending = [column for name in ("topcons", "topcons_batch", "topology_local", "consurf") if name in stages
+               for column in get_stage(name).get_provides()]
+
+    print("Predicting membrane exposure...")
+    topology = next((name for name in ("topology_local", "topcons_batch", "topcons") if name in stages), None)
+    if topology:
+        chains = planner.chains_for(topology, protein.get_chain_ids(), pending)
+        if topology == "topcons_batch" and chains:
+            # Run Topcons once for all chains
+            predicted = load_stage("topcons_batch")(protein.get_seqs(chains), workspace=workspace)
+            chains = [chainID for (_, chainID), mem in predicted.items() if mem is not None]
+        for chainID in chains:
+            if topology == "topology_local":
+                load_stage("topology_local")(pdb_id, chainID, workspace=workspace)
+            elif topology == "topcons":
+                # Run Topcons
+                protein.get_seq_fasta(chainID)
+                load_stage("topcons")(pdb_id, chainID, workspace=workspace)
+            protein.check_mem(chainID)
+        pending.remove("mem")
+        planner.set_table(protein.to_table())
+
+    consurf_chains = planner.chains_for("consurf", protein.get_chain_ids(), pending) if "consurf" in stages else []
+
+    if "msa_batch" in stages and consurf_chains:
+        print("Starting to fetch MSA...")
+        # One MSA per chain, {pdb_id}_{chainID}.a3m, all fetched in one MMseqs2 ticket and converted into fasta format
+        seqs = {f"{pdb_id}_{chainID}": protein.get_seq(chainID) for chainID in consurf_chains}
+        getMSA = load_stage("msa_batch")(job=job_id, seqs=seqs, workspace=workspace)
+        getMSA.run_job(convert="msa_convert" in stages)
+
+    for chainID in consurf_chains:
+        # print("Calculating conservation score...")
+        # Run Consurf
+        getCons = load_stage("consurf")(pdb_id=pdb_id, email=email, job_id=job_id, chain_id=chainID,
+                                        workspace=workspace, msa_name=f"{pdb_id}_{chainID}")
+        getCons.run_job()
+
+    for name, decision in planner.get_decisions().items():
+        if decision["skip"]:
+            print(f"Skipped {name} for chains {', '.join(decision['skip'])}: no candidate pairs can involve them.")
+
+    # print("Analyzing results...")
+    # # Read the results fetched by the above tools and modify the Protein object accordingly to record the properties of
+    # # AminoAcids.
+    #
+    # print("Calculating distances between qualified residues...")
+    # # # Calculate distance
+    # # runDistance(file_path, protein)
+    # #
+    # # output_result(protein)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.list_stages:
+        for stage in list_stages():
+            print(stage.describe())
+    elif args.dry_run:
+        dry_run(plan(args))
+    else:
+        run(plan(args), args.pdb_cache, args.offline)
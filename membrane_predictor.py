@@ -0,0 +1,281 @@
+import numpy as np
+from pdb_coords import read_atoms, residue_info, residue_coords
+from workspace import get_workspace
+
+
+r"""
+Offline membrane topology estimation. An alternative to run_topcons that needs neither a browser nor a network
+connection. Two predictors are provided:
+    predict_topology_seq: sliding-window hydrophobicity over the primary sequence, for sequence-only cases.
+    predict_topology_struct: a hydrophobic slab fitted to the structure over a set of orientations (similar in spirit
+                             to OPM/PPM), for cases where the PDB file is available.
+Both return a string with one letter per residue, "i" (inside), "o" (outside) or "M" (membrane), which is the same
+format as the "TOPCONS predicted topology" line read by Protein.check_mem.
+
+Reference:
+Hessa T., Meindl-Beinker N.M., Bernsel A., Kim H., Sato Y., Lerch-Bader M., Nilsson I., White S.H. and von Heijne G. 2007
+Molecular code for transmembrane-helix recognition by the Sec61 translocon.
+Nature 450:1026-1030.
+
+Lomize A.L., Pogozheva I.D., Lomize M.A. and Mosberg H.I. 2006
+Positioning of proteins in membranes: a computational approach.
+Protein Sci. 15:1318-1333.
+"""
+
+# Apparent free energy of membrane insertion of each residue at the center of a TM segment (kcal/mol), Hessa et al.
+dg_scale = {'A': 0.11, 'C': -0.13, 'D': 3.49, 'E': 2.68, 'F': -0.32,
+            'G': 0.74, 'H': 2.06, 'I': -0.60, 'K': 2.71, 'L': -0.55,
+            'M': -0.10, 'N': 2.05, 'P': 2.23, 'Q': 2.36, 'R': 2.58,
+            'S': 0.84, 'T': 0.52, 'V': -0.31, 'W': 0.30, 'Y': 0.68}
+
+d3to1 = {'CYS': 'C', 'ASP': 'D', 'SER': 'S', 'GLN': 'Q', 'LYS': 'K',
+         'ILE': 'I', 'PRO': 'P', 'THR': 'T', 'PHE': 'F', 'ASN': 'N',
+         'GLY': 'G', 'HIS': 'H', 'LEU': 'L', 'ARG': 'R', 'TRP': 'W',
+         'ALA': 'A', 'VAL': 'V', 'GLU': 'E', 'TYR': 'Y', 'MET': 'M'}
+
+
+def _dg_values(seq: str) -> np.ndarray:
+
+    r"""
+    Converts a sequence into per-residue insertion free energies. Unknown letters are treated as neutral (0).
+    :param seq: one-letter amino acid sequence
+    :return: an array of free energies
+    """
+
+    return np.array([dg_scale.get(aa, 0.0) for aa in seq.upper()], dtype=np.float64)
+
+
+def _positive_inside(seq: str, topology: np.ndarray) -> np.ndarray:
+
+    r"""
+    Labels the non-membrane segments as inside or outside using the positive-inside rule. Segments alternate sides
+    across each membrane segment; the set of segments with more Lys/Arg is placed inside.
+    :param seq: one-letter amino acid sequence
+    :param topology: array of "M" and placeholder letters
+    :return: the topology array with loops labelled "i" or "o"
+    """
+
+    is_mem = topology == "M"
+    if not is_mem.any():
+        topology[:] = "o"
+        return topology
+
+    # Number the loops: each time a membrane segment ends, the side flips
+    seg_start = np.r_[True, is_mem[1:] != is_mem[:-1]]
+    crossings = np.cumsum(seg_start & is_mem)
+    side = crossings % 2
+    positive = np.array([aa in "KR" for aa in seq.upper()])
+    even_kr = np.count_nonzero(positive & ~is_mem & (side == 0))
+    odd_kr = np.count_nonzero(positive & ~is_mem & (side == 1))
+    inside_side = 0 if even_kr >= odd_kr else 1
+    topology[~is_mem] = np.where(side[~is_mem] == inside_side, "i", "o")
+    return topology
+
+
+def predict_topology_seq(
+        seq: str,
+        window: int = 19,
+        threshold: float = 1.0,
+        min_gap: int = 3
+                          ) -> str:
+
+    r"""
+    Predicts the membrane topology of a chain from its sequence alone. The insertion free energy is summed over every
+    window of the sequence at once; windows below the threshold are accepted as transmembrane segments, lowest energy
+    first, as long as they do not overlap an accepted segment.
+    :param seq: one-letter amino acid sequence
+    :param window: length of a transmembrane segment
+    :param threshold: the maximal summed free energy (kcal/mol) of a transmembrane window
+    :param min_gap: the minimal number of residues between two transmembrane segments
+    :return: a string of "i", "o" and "M", one letter per residue
+    """
+
+    n = len(seq)
+    topology = np.full(n, "-", dtype="U1")
+    if n < window:
+        return "".join(_positive_inside(seq, topology))
+
+    # Window sums via a cumulative sum: dg_window[k] covers seq[k:k + window]
+    csum = np.r_[0.0, np.cumsum(_dg_values(seq))]
+    dg_window = csum[window:] - csum[:-window]
+
+    taken = np.zeros(n, dtype=bool)
+    for k in np.argsort(dg_window, kind="stable"):
+        if dg_window[k] >= threshold:
+            break
+        lo, hi = max(0, k - min_gap), min(n, k + window + min_gap)
+        if taken[lo:hi].any():
+            continue
+        taken[k:k + window] = True
+    topology[taken] = "M"
+    return "".join(_positive_inside(seq, topology))
+
+
+def _fibonacci_hemisphere(n: int) -> np.ndarray:
+
+    r"""
+    Generates quasi-uniform unit vectors on the upper hemisphere. A membrane normal and its opposite describe the same
+    slab, so half of the sphere is enough.
+    :param n: the number of directions
+    :return: an (n, 3) array of unit vectors
+    """
+
+    k = np.arange(n) + 0.5
+    z = 1 - k / n
+    r = np.sqrt(1 - z * z)
+    phi = np.pi * (3 - np.sqrt(5)) * k
+    return np.column_stack((r * np.cos(phi), r * np.sin(phi), z))
+
+
+def fit_membrane_slab(
+        coords: np.ndarray,
+        seq: str,
+        thickness: float = 30.0,
+        n_directions: int = 600,
+        bin_width: float = 1.0,
+        weights: np.ndarray = None
+                      ) -> tuple:
+
+    r"""
+    Finds the hydrophobic slab that best explains a structure. Every residue contributes its insertion free energy when
+    it lies inside the slab; the slab (normal and center) with the lowest total is returned. All directions are
+    evaluated together: the projections are binned and the slab sums are read from cumulative sums, so the search costs
+    O(n_directions * (n_residues + n_bins)).
+    :param coords: (n, 3) array, one coordinate per residue (e.g. CA)
+    :param seq: one-letter amino acid sequence matching coords
+    :param thickness: hydrophobic thickness of the membrane in Angstrom
+    :param n_directions: the number of membrane normals tested
+    :param bin_width: the resolution of the slab center search in Angstrom
+    :param weights: optional per-residue weights, e.g. relative solvent accessibility, so buried residues count less
+    :return: (normal, center, energy) where center is the position of the slab mid-plane along normal
+    """
+
+    dg = _dg_values(seq)
+    if weights is not None:
+        dg = dg * weights
+    coords = coords - coords.mean(axis=0)
+    normals = _fibonacci_hemisphere(n_directions)
+
+    # Projections of every residue on every normal, shifted to start at bin 0
+    proj = normals @ coords.T
+    low = proj.min()
+    n_bins = int(np.ceil((proj.max() - low) / bin_width)) + 1
+    bins = ((proj - low) / bin_width).astype(np.int64)
+
+    # Energy histogram per direction, flattened so a single bincount fills all of them
+    offsets = (np.arange(n_directions) * n_bins)[:, None]
+    hist = np.bincount((bins + offsets).ravel(), weights=np.broadcast_to(dg, proj.shape).ravel(),
+                       minlength=n_directions * n_bins).reshape(n_directions, n_bins)
+    csum = np.concatenate((np.zeros((n_directions, 1)), np.cumsum(hist, axis=1)), axis=1)
+
+    width = max(1, int(round(thickness / bin_width)))
+    if width >= n_bins:
+        energy = csum[:, -1:]
+    else:
+        energy = csum[:, width:] - csum[:, :-width]
+    d, start = np.unravel_index(np.argmin(energy), energy.shape)
+    center = low + (start + width / 2) * bin_width
+    return normals[d], center, float(energy[d, start])
+
+
+def predict_topology_struct(
+        coords: np.ndarray,
+        seq: str,
+        thickness: float = 30.0,
+        min_run: int = 10,
+        max_energy: float = -5.0,
+        weights: np.ndarray = None
+                            ) -> str:
+
+    r"""
+    Predicts the membrane topology of a chain from its structure by fitting a hydrophobic slab. Residues inside the slab
+    are labelled "M" only when they form a run of at least min_run consecutive residues, so loops that merely touch the
+    slab are not counted. Residues on either side of the slab are labelled "i" or "o" with the positive-inside rule.
+    :param coords: (n, 3) array, one coordinate per residue (e.g. CA)
+    :param seq: one-letter amino acid sequence matching coords
+    :param thickness: hydrophobic thickness of the membrane in Angstrom
+    :param min_run: the minimal number of consecutive residues inside the slab that make a membrane segment
+    :param max_energy: the slab energy (kcal/mol) above which the chain is considered soluble
+    :param weights: optional per-residue weights passed to fit_membrane_slab
+    :return: a string of "i", "o" and "M", one letter per residue
+    """
+
+    n = len(seq)
+    topology = np.full(n, "o", dtype="U1")
+    if n == 0:
+        return ""
+    normal, center, energy = fit_membrane_slab(coords, seq, thickness=thickness, weights=weights)
+    if energy > max_energy:
+        return "".join(topology)
+
+    z = (coords - coords.mean(axis=0)) @ normal - center
+    inside = np.abs(z) <= thickness / 2
+
+    # Keep only long runs of residues inside the slab
+    edges = np.diff(np.r_[0, inside.astype(np.int8), 0])
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    is_mem = np.zeros(n, dtype=bool)
+    for s, e in zip(starts, ends):
+        if e - s >= min_run:
+            is_mem[s:e] = True
+    if not is_mem.any():
+        return "".join(topology)
+
+    # Sides are known geometrically; the positive-inside rule only decides which one is the cytoplasm
+    positive = np.array([aa in "KR" for aa in seq.upper()])
+    upper = (z > 0) & ~is_mem
+    lower = (z <= 0) & ~is_mem
+    inside_is_upper = np.count_nonzero(positive & upper) > np.count_nonzero(positive & lower)
+    topology[upper] = "i" if inside_is_upper else "o"
+    topology[lower] = "o" if inside_is_upper else "i"
+    topology[is_mem] = "M"
+    return "".join(topology)
+
+
+def write_topology(pdb_id: str, chainID: str, topology: str, workspace=None) -> str:
+
+    r"""
+    Writes a topology string into {pdb_id}_{chainID}_MEM.txt in the layout Protein.check_mem reads.
+    :param pdb_id: PDB ID of the protein
+    :param chainID: chain identifier
+    :param topology: string of "i", "o" and "M"
+    :param workspace: the Workspace of the job. Defaults to the current working directory
+    :return: the path of the file
+    """
+
+    out_name = get_workspace(workspace).mem(pdb_id, chainID)
+    with open(out_name, "w") as out:
+        out.write("Predicted locally (membrane_predictor)\n\n")
+        out.write("TOPCONS predicted topology:\n")
+        out.write(f"{topology}\n")
+    return out_name
+
+
+def run_local_topology(pdb_id: str, chainID: str, use_structure: bool = True, workspace=None) -> str:
+
+    r"""
+    Offline replacement for run_topcons. Predicts the membrane topology of one chain and writes
+    {pdb_id}_{chainID}_MEM.txt.
+    :param pdb_id: PDB ID of the protein
+    :param chainID: chain identifier
+    :param use_structure: fit a membrane slab to the structure when True, otherwise use the sequence only
+    :param workspace: the Workspace of the job. Defaults to the current working directory
+    :return: the topology string
+    """
+
+    workspace = get_workspace(workspace)
+    atoms = read_atoms(workspace.pdb(pdb_id))
+    info = residue_info(atoms)
+    sel = info["chain"] == chainID
+    seq = "".join(d3to1.get(name, "X") for name in info["resname"][sel])
+
+    if use_structure:
+        # Only exposed residues face the lipids, so weight the fit by relative accessibility
+        from sasa import residue_sasa
+        rsa = np.nan_to_num(residue_sasa(atoms)[1][sel])
+        topology = predict_topology_struct(residue_coords(atoms)[sel], seq, weights=np.clip(rsa, 0, 1))
+    else:
+        topology = predict_topology_seq(seq)
+    write_topology(pdb_id, chainID, topology, workspace)
+    print(f"{pdb_id}_{chainID}_MEM.txt has been successfully generated.")
+    return topology
@@ -8,6 +8,7 @@ import time
 
 from absl import logging
 from typing import NoReturn
+from workspace import get_workspace
 
 
 class MMSeqs2Runner:
@@ -32,8 +33,10 @@ class MMSeqs2Runner:
     self.host_url: URL address to ping for data
     self.t_url: URL address to ping for templates from PDB
     self.n_templates = Number of templates to fetch (default=20)
+    self.workspace: Workspace of the job; all outputs are written into it
     self.path: Path to use
     self.tarfile: Compressed file archive to download
+    self.session: Object used for HTTP requests
     """
 
     def __init__(
@@ -43,6 +46,8 @@ class MMSeqs2Runner:
         host_url: str = "https://a3m.mmseqs.com",
         t_url: str = "https://a3m-templates.mmseqs.com/template",
         n_templates: int = 20,
+        session=None,
+        workspace=None,
     ):
 
         r"""Initialize runner object
@@ -52,6 +57,8 @@ class MMSeqs2Runner:
         seq : Amino acid sequence
         host_url : Website to ping for sequence data
         t_url : Website to ping for template info
+        session : Object used for HTTP requests (defaults to the requests module), e.g. a GovernedSession
+        workspace : Workspace of the job (defaults to the current working directory)
         """
 
         # Clean up sequence
@@ -64,13 +71,12 @@ class MMSeqs2Runner:
         self.host_url = host_url
         self.t_url = t_url
         self.n_templates = n_templates
+        self.session = session if session is not None else requests
 
-        self.path = "mmseqs_result"
+        self.workspace = get_workspace(workspace)
+        self.path = self.workspace.makedirs("mmseqs_result")
 
-        if not os.path.isdir(self.path):
-            os.system(f"mkdir { self.path }")
-
-        self.tarfile = f"{ self.path }/out.tar.gz"
+        self.tarfile = os.path.join(self.path, "out.tar.gz")
 
     def _cleanseq(self, seq) -> str:
 
@@ -121,7 +127,7 @@ class MMSeqs2Runner:
 
         data = {"q": f">101\n{ self.seq }", "mode": "env"}
 
-        res = requests.post(f"{ self.host_url }/ticket/msa", data=data)
+        res = self.session.post(f"{ self.host_url }/ticket/msa", data=data)
 
         try:
             out = res.json()
@@ -142,7 +148,7 @@ class MMSeqs2Runner:
         None
         """
 
-        res = requests.get(f"{ self.host_url }/ticket/{ idx }")
+        res = self.session.get(f"{ self.host_url }/ticket/{ idx }")
 
         try:
             out = res.json()
@@ -154,7 +160,7 @@ class MMSeqs2Runner:
 
     def _download(self, idx: str, path: str) -> NoReturn:
 
-        r"""Download job outputs
+        r"""Download job outputs, streamed to disk in chunks
         Parameters
         ----------
         idx : Index assigned by MMSeqs2 server
@@ -164,44 +170,103 @@ class MMSeqs2Runner:
         None
         """
 
-        res = requests.get(f"{ self.host_url }/result/download/{ idx }")
+        with self.session.get(f"{ self.host_url }/result/download/{ idx }", stream=True) as res:
+            res.raise_for_status()
+            with open(path, "wb") as out:
+                for chunk in res.iter_content(chunk_size=1 << 20):
+                    out.write(chunk)
 
-        with open(path, "wb") as out:
-            out.write(res.content)
+    def _stream_member(self, fileobj, handler, member_name: str = "uniref.a3m"):
 
-    def _search_mmseqs2(self) -> NoReturn:
+        r"""Read one member of the result tarball without extracting the others
+        Parameters
+        ----------
+        fileobj : Binary stream of the gzip-compressed tarball (a file or an HTTP response)
+        handler : Called with an iterator over the lines of the member, as text
+        member_name : Name of the member to read
+        Returns
+        ----------
+        The return value of handler
+        """
 
-        r"""Run the search and download results
-        Heavily modified from ColabFold
+        # "r|gz" reads the archive front to back, so the response never has to be buffered or seekable
+        with tarfile.open(fileobj=fileobj, mode="r|gz") as tar:
+            for member in tar:
+                if os.path.basename(member.name) == member_name:
+                    with tar.extractfile(member) as member_file:
+                        return handler(line.decode("utf-8") for line in member_file)
+        raise RuntimeError(f"{ member_name } not found in the MMseqs2 result.")
+
+    def _submit_ticket(self) -> dict:
+
+        r"""Submit the job, resubmitting while the server is busy or rate limited
         Parameters
         ----------
         None
         Returns
         ----------
-        None
+        The response of the server, with the ticket ID
         """
 
-        if os.path.isfile(self.tarfile):
-            return
-
         out = self._submit()
 
         time.sleep(5 + np.random.randint(0, 5))
         while out["status"] in ["UNKNOWN", "RATELIMIT"]:
+            if out["status"] == "RATELIMIT":
+                # Hold back every request to this server from this process (and others sharing the governor)
+                from rate_governor import get_governor
+                get_governor(self.host_url).penalize(30)
             # resubmit
             time.sleep(5 + np.random.randint(0, 5))
             out = self._submit()
         print("MMSeqs job submitted...")
 
         logging.debug(f"ID: { out[ 'id' ] }")
+        return out
+
+    def submit(self, pdb_id):
+
+        r"""Submit the job without waiting for it
+        The returned handle can be saved in a remote_jobs.HandleStore and collected later by a remote_jobs.Collector,
+        which writes pdb_id.a3m.
+        Parameters
+        ----------
+        pdb_id : pdb id, names the output file
+        Returns
+        ----------
+        A remote_jobs.JobHandle
+        """
+
+        from remote_jobs import JobHandle, text_hash
+
+        out = self._submit_ticket()
+        return JobHandle("mmseqs", out["id"], result_url=f"{ self.host_url }/result/download/{ out['id'] }",
+                         output=self.workspace.a3m(pdb_id), status_url=f"{ self.host_url }/ticket/{ out['id'] }",
+                         inputs={"seq": text_hash(self.seq)})
+
+    def _search_mmseqs2(self) -> NoReturn:
+
+        r"""Run the search and download results
+        Heavily modified from ColabFold
+        Parameters
+        ----------
+        None
+        Returns
+        ----------
+        None
+        """
+
+        if os.path.isfile(self.tarfile):
+            return None
+
+        out = self._submit_ticket()
 
         while out["status"] in ["UNKNOWN", "RUNNING", "PENDING"]:
             time.sleep(5 + np.random.randint(0, 5))
             out = self._status(out["id"])
 
         if out["status"] == "COMPLETE":
-            print("Starting to download .a3m file...")
-            self._download(out["id"], self.tarfile)
+            return out["id"]
 
         elif out["status"] == "ERROR":
             raise RuntimeError(
@@ -215,10 +280,12 @@ class MMSeqs2Runner:
             )
 
     # Modifications here
-    def run_job(self, pdb_id):
+    def run_job(self, pdb_id, convert: bool = False, keep_tarball: bool = False, store=None):
 
         r"""
         Run sequence alignments using MMseqs2
+        The result is streamed from the server through a tar reader that only reads uniref.a3m, so neither the
+        tarball nor the other members are written to disk or held in memory.
         Parameters
         ----------
         use_templates: Whether to use templates
@@ -226,15 +293,192 @@ class MMSeqs2Runner:
         ----------
         Tuple with [0] string with alignment, and [1] path to template
         :param pdb_id: pdb id
+        :param convert: if True, feed the a3m straight into msa_convert and write only pdb_id_MSA.fasta
+        :param keep_tarball: if True, also keep the downloaded tarball in mmseqs_result/ so later runs skip the search
+        :param store: an optional MSAStore. The a3m is encoded into the store instead of being written to pdb_id.a3m, and
+                      pdb_id_MSA.fasta (with convert) is written from the store
+        :return: the path of the written file, or the store key when the a3m only went into the store
         """
 
-        self._search_mmseqs2()
+        from msa_converter import msa_convert
+
+        def handler(text):
+            if store is not None:
+                msa = store.add(text, overwrite=True)
+                if convert:
+                    return msa.write_fasta(self.workspace.msa_fasta(pdb_id))
+                return msa.get_key()
+            if convert:
+                msa_convert(pdb_id, text, self.workspace)
+                return self.workspace.msa_fasta(pdb_id)
+            with open(self.workspace.a3m(pdb_id), "w") as out:
+                out.writelines(text)
+            return self.workspace.a3m(pdb_id)
+
+        idx = self._search_mmseqs2()
+        if idx is not None and keep_tarball:
+            print("Starting to download .a3m file...")
+            self._download(idx, self.tarfile)
+            idx = None
+
+        if idx is None:
+            with open(self.tarfile, "rb") as fileobj:
+                return self._stream_member(fileobj, handler)
+
+        print("Starting to download .a3m file...")
+        with self.session.get(f"{ self.host_url }/result/download/{ idx }", stream=True) as res:
+            res.raise_for_status()
+            res.raw.decode_content = True
+            return self._stream_member(res.raw, handler)
+
+
+class MMSeqs2BatchRunner(MMSeqs2Runner):
+
+    r"""Runner object for many sequences
+    Packs many sequences into one MMSeqs2 ticket, so N chains or proteins cost one queue wait and one rate-limit slot
+    instead of N. Identical sequences are searched once. Queries are numbered >101, >102, ... in order of first
+    appearance, and the a3m returned by the server (one block per query, blocks separated by a NUL byte) is split back
+    into one file per name, with the query header renamed to >101 as in a single-query search.
+    Private variables
+    ----------
+    self.seqs: Dictionary from output name (e.g. "1abc_A") to sequence
+    self.query_ids: Dictionary from unique sequence to query ID
+    self.max_queries: Largest number of sequences per ticket
+    """
+
+    def __init__(
+        self,
+        job: str,
+        seqs: dict,
+        host_url: str = "https://a3m.mmseqs.com",
+        t_url: str = "https://a3m-templates.mmseqs.com/template",
+        n_templates: int = 20,
+        max_queries: int = 100,
+        session=None,
+        workspace=None,
+    ):
+
+        r"""Initialize runner object
+        Parameters
+        ----------
+        job : Job name
+        seqs : Dictionary from output name to amino acid sequence
+        host_url : Website to ping for sequence data
+        t_url : Website to ping for template info
+        max_queries : Largest number of sequences per ticket
+        session : Object used for HTTP requests (defaults to the requests module), e.g. a GovernedSession
+        workspace : Workspace of the job (defaults to the current working directory)
+        """
+
+        self.seqs = {name: self._cleanseq(seq.upper()) for name, seq in seqs.items()}
+        unique = list(dict.fromkeys(self.seqs.values()))
+        self.query_ids = {seq: 101 + k for k, seq in enumerate(unique)}
+        self.max_queries = max_queries
+
+        # The job name hashes all sequences, so the same batch maps to the same cached tarballs
+        super().__init__(job, "".join(unique), host_url=host_url, t_url=t_url, n_templates=n_templates,
+                         session=session, workspace=workspace)
+
+        self._batch = []
+
+    def _submit(self) -> dict:
+
+        r"""Submit the current batch to MMSeqs2 server
+        Parameters
+        ----------
+        None
+        Returns
+        ----------
+        The response of the server
+        """
+
+        query = "\n".join(f">{ self.query_ids[seq] }\n{ seq }" for seq in self._batch)
+        res = self.session.post(f"{ self.host_url }/ticket/msa", data={"q": query, "mode": "env"})
+
+        try:
+            out = res.json()
+
+        except ValueError:
+            out = {"status": "UNKNOWN"}
+
+        return out
+
+    def _demultiplex(self, lines, outputs: dict) -> set:
+
+        r"""Split a multi-query a3m into the files of each query
+        Parameters
+        ----------
+        lines : Iterator over the lines of uniref.a3m
+        outputs : Dictionary from query ID to a list of open files
+        Returns
+        ----------
+        The query IDs found
+        """
+
+        found = set()
+        current, new_block = None, True
+        for line in lines:
+            if "\x00" in line:
+                line = line.replace("\x00", "")
+                new_block = True
+            if not line:
+                continue
+            if new_block and line.startswith(">"):
+                # The first header of a block is the query itself. Every file gets the query name of a single-query
+                # search (101), which is what ConsurfRunner selects as the query sequence.
+                name = line[1:].split()[0]
+                current = int(name)
+                found.add(current)
+                new_block = False
+                line = ">101" + line[1 + len(name):]
+            for out in outputs.get(current, ()):
+                out.write(line)
+        return found
+
+    def run_job(self, convert: bool = False, keep_tarball: bool = False) -> dict:
+
+        r"""
+        Run sequence alignments for all sequences, max_queries sequences per ticket.
+        :param convert: if True, also convert every a3m with msa_convert into name_MSA.fasta
+        :param keep_tarball: if True, keep the downloaded tarballs in mmseqs_result/ so later runs skip the search
+        :return: a dictionary from output name to the path of the written file
+        """
 
-        # extract a3m files
-        if not os.path.isfile(os.path.join(self.path, "uniref.a3m")):
-            with tarfile.open(self.tarfile) as tar_gz:
-                tar_gz.extractall(self.path)
-                for member in tar_gz.getmembers():
-                    if "uniref.a3m" in member.name:
-                        tar_gz.extract(member)
-        os.rename("uniref.a3m", f"{pdb_id}.a3m")
\ No newline at end of file
+        from msa_converter import msa_convert
+
+        unique = list(self.query_ids)
+        for start in range(0, len(unique), self.max_queries):
+            self._batch = unique[start:start + self.max_queries]
+            self.tarfile = os.path.join(self.path, f"{ self.job }_{ start // self.max_queries }.tar.gz")
+            wanted = {self.query_ids[seq] for seq in self._batch}
+            names = [name for name, seq in self.seqs.items() if self.query_ids[seq] in wanted]
+
+            files = {name: open(self.workspace.a3m(name), "w") for name in names}
+            outputs = {}
+            for name in names:
+                outputs.setdefault(self.query_ids[self.seqs[name]], []).append(files[name])
+            try:
+                idx = self._search_mmseqs2()
+                if idx is not None and keep_tarball:
+                    self._download(idx, self.tarfile)
+                    idx = None
+                if idx is None:
+                    with open(self.tarfile, "rb") as fileobj:
+                        found = self._stream_member(fileobj, lambda lines: self._demultiplex(lines, outputs))
+                else:
+                    with self.session.get(f"{ self.host_url }/result/download/{ idx }", stream=True) as res:
+                        res.raise_for_status()
+                        res.raw.decode_content = True
+                        found = self._stream_member(res.raw, lambda lines: self._demultiplex(lines, outputs))
+            finally:
+                for out in files.values():
+                    out.close()
+            missing = wanted - found
+            if missing:
+                raise RuntimeError(f"MMseqs2 result has no alignment for queries { sorted(missing) }.")
+
+        if convert:
+            for name in self.seqs:
+                msa_convert(name, workspace=self.workspace)
+            return {name: self.workspace.msa_fasta(name) for name in self.seqs}
+        return {name: self.workspace.a3m(name) for name in self.seqs}
@@ -0,0 +1,634 @@
+import argparse
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import re
+import tarfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+r"""
+Local stand-ins for the remote services used by the runners, for load-testing orchestration offline.
+
+All services are served by one local HTTP server under their own prefix and answer with the request/response shapes the
+runners expect:
+    /rcsb/view/{id}.pdb                              PDBDownloader(host_url=.../rcsb/view/), with ETag revalidation
+    /rcsb/holdings                                   PDBCache.update_index(url=...)
+    /xssp/api/{create,status,result}/pdb_file/dssp/  DSSPRunner(server_url=.../xssp/)
+    /mmseqs/ticket/msa, /ticket/{id}, /result/download/{id}
+                                                     MMSeqs2Runner(host_url=.../mmseqs)
+    /seqret/run, /seqret/result/{id}/out             SeqretRunner(server_url=.../seqret/run)
+    /topcons/result/{id}.txt                         the TOPCONS result text read by Protein.check_mem (one block per
+                                                     sequence when the job was posted with a multi-sequence FASTA)
+    /consurf/results/{id}/consurf.grades             ConsurfRunner(host_url=.../consurf/) result download
+TOPCONS and ConSurf are driven through their web forms with Selenium; only their result downloads are reproduced here.
+
+Every service has a ServiceProfile with a latency distribution per request, a queue delay distribution per job, a rate
+limit, and injected errors (HTTP 500 responses and failed jobs).
+
+Usage:
+    python mock_servers.py --port 8800 --latency lognormal,0.2,0.5 --queue-delay uniform,5,30 --rate 2 --error-rate 0.05
+"""
+
+
+def sample(spec, rng: random.Random) -> float:
+
+    r"""
+    Draws a duration from a distribution specification.
+    :param spec: a number (fixed), or a tuple ("fixed", s), ("uniform", low, high), ("exponential", mean),
+                 ("lognormal", median, sigma)
+    :param rng: the random generator
+    :return: seconds
+    """
+
+    if spec is None:
+        return 0.0
+    if isinstance(spec, (int, float)):
+        return float(spec)
+    kind, *args = spec
+    if kind == "fixed":
+        return float(args[0])
+    if kind == "uniform":
+        return rng.uniform(args[0], args[1])
+    if kind == "exponential":
+        return rng.expovariate(1 / args[0]) if args[0] > 0 else 0.0
+    if kind == "lognormal":
+        return rng.lognormvariate(math.log(args[0]), args[1])
+    raise ValueError(f"Unknown distribution {kind}")
+
+
+class ServiceProfile:
+
+    r"""
+    Class name: ServiceProfile
+    Description: The simulated behaviour of one remote service.
+    Variables:
+        self.latency: distribution of the delay added to every request
+        self.queue_delay: distribution of the time a submitted job takes to finish
+        self.rate: the largest sustained number of requests per second (None for no limit)
+        self.burst: the number of requests allowed at once before the rate limit applies
+        self.error_rate: the fraction of requests answered with HTTP 500
+        self.failure_rate: the fraction of jobs that end in failure
+    """
+
+    def __init__(
+            self,
+            latency=None,
+            queue_delay=None,
+            rate: float = None,
+            burst: int = 5,
+            error_rate: float = 0.0,
+            failure_rate: float = 0.0
+                 ):
+
+        r"""
+        Object constructor.
+        :param latency: distribution of the delay added to every request (see sample)
+        :param queue_delay: distribution of the time a submitted job takes to finish
+        :param rate: the largest sustained number of requests per second
+        :param burst: the number of requests allowed at once before the rate limit applies
+        :param error_rate: the fraction of requests answered with HTTP 500
+        :param failure_rate: the fraction of jobs that end in failure
+        """
+
+        self.latency = latency
+        self.queue_delay = queue_delay
+        self.rate = rate
+        self.burst = burst
+        self.error_rate = error_rate
+        self.failure_rate = failure_rate
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+
+        r"""
+        Takes one token from the rate limiter.
+        :return: False if the request exceeds the rate limit
+        """
+
+        if self.rate is None:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class MockJob:
+
+    r"""
+    Class name: MockJob
+    Description: A job held by a mock service.
+    Variables:
+        self.ready_at: the time the job finishes
+        self.failed: whether the job ends in failure
+        self.payload: the data needed to build the result
+    """
+
+    def __init__(self, ready_at: float, failed: bool, payload):
+        self.ready_at = ready_at
+        self.failed = failed
+        self.payload = payload
+
+
+def fake_topology(length: int) -> str:
+
+    r"""
+    Builds a TOPCONS-like topology with a transmembrane helix every 75 residues.
+    :param length: sequence length
+    :return: a string of "i", "o" and "M"
+    """
+
+    return "".join("M" if (k // 25) % 3 == 1 else ("i" if (k // 25) % 6 < 3 else "o") for k in range(length))
+
+
+def fasta_records(text: str) -> list:
+
+    r"""
+    Splits FASTA text into its records.
+    :param text: FASTA text
+    :return: a list of (name, sequence)
+    """
+
+    records = []
+    for block in text.split(">")[1:]:
+        header, _, body = block.partition("\n")
+        records.append((header.strip(), "".join(body.split())))
+    return records
+
+
+def fake_dssp(pdb_text: str, rng: random.Random) -> str:
+
+    r"""
+    Builds a DSSP file with the fixed-width layout of real DSSP output for the residues of a PDB file. Secondary
+    structure and accessibility are random.
+    :param pdb_text: the uploaded PDB file
+    :param rng: the random generator
+    :return: the DSSP text
+    """
+
+    residues = []
+    for line in pdb_text.splitlines():
+        if line.startswith("ATOM") and line[12:16].strip() == "CA":
+            residues.append((line[21], int(line[22:26]), line[17:20]))
+    d3to1 = {'CYS': 'C', 'ASP': 'D', 'SER': 'S', 'GLN': 'Q', 'LYS': 'K', 'ILE': 'I', 'PRO': 'P', 'THR': 'T',
+             'PHE': 'F', 'ASN': 'N', 'GLY': 'G', 'HIS': 'H', 'LEU': 'L', 'ARG': 'R', 'TRP': 'W', 'ALA': 'A',
+             'VAL': 'V', 'GLU': 'E', 'TYR': 'Y', 'MET': 'M'}
+    lines = ["==== Secondary Structure Definition by the program DSSP (mock server) ====",
+             "  #  RESIDUE AA STRUCTURE BP1 BP2  ACC     N-H-->O    O-->H-N    N-H-->O    O-->H-N"
+             "    TCO  KAPPA ALPHA  PHI   PSI    X-CA   Y-CA   Z-CA"]
+    k = 0
+    previous = None
+    for chain, num, name in residues:
+        k += 1
+        if previous is not None and chain != previous:
+            lines.append(f"{k:5d}        !{' ' * 20}0   0    0")
+            k += 1
+        previous = chain
+        ss = rng.choice("HHHEEGTS ")
+        acc = rng.randint(0, 180)
+        lines.append(f"{k:5d}{num:5d} {chain} {d3to1.get(name, 'X')}  {ss}{' ' * 17}{acc:4d}"
+                     "      0, 0.0     0, 0.0     0, 0.0     0, 0.0   0.000 360.0 360.0 360.0 360.0"
+                     "    0.0    0.0    0.0")
+    return "\n".join(lines) + "\n"
+
+
+def fake_a3m_tar(queries: list, rng: random.Random, n_hits: int = 20) -> bytes:
+
+    r"""
+    Builds the tarball returned by the MMseqs2 server. uniref.a3m holds one block per query, blocks being separated by
+    a NUL byte as on the real server.
+    :param queries: a list of (name, sequence)
+    :param rng: the random generator
+    :param n_hits: the number of homologs per query
+    :return: the gzip-compressed tar archive
+    """
+
+    blocks = []
+    for name, seq in queries:
+        rows = [f">{name}\n{seq}\n"]
+        for h in range(n_hits):
+            hit = "".join(c if rng.random() < 0.7 else rng.choice("ACDEFGHIKLMNPQRSTVWY-") for c in seq)
+            rows.append(f">UniRef100_{name}_{h}\t{rng.randint(50, 300)}\n{hit}\n")
+        blocks.append("".join(rows))
+    members = {"uniref.a3m": "\x00".join(blocks) + "\x00",
+               "bfd.mgnify30.metaeuk30.smag30.a3m": "\x00".join(b.split("\n", 2)[0] + "\n" for b in blocks),
+               "pdb70.m8": ""}
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for member, text in members.items():
+            data = text.encode()
+            info = tarfile.TarInfo(member)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+class MockServices:
+
+    r"""
+    Class name: MockServices
+    Description: Runs all mock services on one local port.
+    Variables:
+        self.host: the address the server listens on
+        self.port: the port the server listens on
+        self.profiles: a dictionary from service name ("rcsb", "xssp", "mmseqs", "seqret", "topcons", "consurf") to
+                       ServiceProfile
+        self.pdb_dir: a directory of {id}.pdb files served by the rcsb mock; unknown IDs get a small generated file
+        self.stats: a dictionary from service name to request counters
+    """
+
+    services = ("rcsb", "xssp", "mmseqs", "seqret", "topcons", "consurf")
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, profiles: dict = None, pdb_dir: str = None,
+                 seed: int = 0):
+
+        r"""
+        Object constructor.
+        :param host: the address to listen on
+        :param port: the port to listen on (0 picks a free port)
+        :param profiles: a dictionary from service name to ServiceProfile; missing services get an ideal profile
+        :param pdb_dir: a directory of {id}.pdb files served by the rcsb mock
+        :param seed: seed of the random generator
+        """
+
+        self.profiles = {name: ServiceProfile() for name in self.services}
+        self.profiles.update(profiles or {})
+        self.pdb_dir = pdb_dir
+        self.stats = {name: {"requests": 0, "rate_limited": 0, "errors": 0, "jobs": 0} for name in self.services}
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._server = ThreadingHTTPServer((host, port), _MockHandler)
+        self._server.mock = self
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    def url(self, service: str) -> str:
+
+        r"""
+        Returns the base URL of a service in the form the matching runner expects.
+        :param service: service name
+        :return: the URL
+        """
+
+        base = f"http://{self.host}:{self.port}"
+        return {"rcsb": f"{base}/rcsb/view/", "xssp": f"{base}/xssp/", "mmseqs": f"{base}/mmseqs",
+                "seqret": f"{base}/seqret/run", "topcons": f"{base}/topcons/", "consurf": f"{base}/consurf/"}[service]
+
+    def start(self):
+
+        r"""
+        Starts serving in a background thread.
+        :return: the MockServices object
+        """
+
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+
+        r"""
+        Stops the server.
+        :return: N/A
+        """
+
+        self._server.shutdown()
+        self._server.server_close()
+
+    def random(self) -> random.Random:
+
+        r"""
+        Returns the shared random generator.
+        :return: the generator
+        """
+
+        return self._rng
+
+    def new_job(self, service: str, payload) -> str:
+
+        r"""
+        Creates a job whose completion time is drawn from the queue delay of the service.
+        :param service: service name
+        :param payload: the data needed to build the result
+        :return: the job id
+        """
+
+        profile = self.profiles[service]
+        with self._lock:
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = MockJob(time.time() + sample(profile.queue_delay, self._rng),
+                                         self._rng.random() < profile.failure_rate, payload)
+            self.stats[service]["jobs"] += 1
+        return job_id
+
+    def count(self, service: str, key: str):
+
+        r"""
+        Increments a request counter.
+        :param service: service name
+        :param key: counter name
+        :return: N/A
+        """
+
+        with self._lock:
+            self.stats[service][key] += 1
+
+    def get_job(self, job_id: str):
+
+        r"""
+        Looks up a job.
+        :param job_id: job id
+        :return: the MockJob, or None
+        """
+
+        with self._lock:
+            return self._jobs.get(job_id)
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+
+    r"""
+    Class name: _MockHandler
+    Description: Dispatches requests to the mock services.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, code: int, body, content_type: str = "application/json", headers: dict = None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _admit(self, service: str) -> bool:
+
+        r"""
+        Applies latency, rate limiting and error injection. Sends the error response itself when the request is
+        rejected.
+        :param service: service name
+        :return: True if the request should be served
+        """
+
+        mock = self.server.mock
+        profile = mock.profiles[service]
+        mock.count(service, "requests")
+        time.sleep(sample(profile.latency, mock.random()))
+        if not profile.allow():
+            mock.count(service, "rate_limited")
+            if service == "mmseqs" and self.command == "POST":
+                # The MMseqs2 server reports rate limiting in the ticket status
+                self._reply(200, {"status": "RATELIMIT"})
+            else:
+                self._reply(429, {"error": "Too Many Requests"})
+            return False
+        if mock.random().random() < profile.error_rate:
+            mock.count(service, "errors")
+            self._reply(500, "Internal Server Error", "text/plain")
+            return False
+        return True
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        if not parts or parts[0] not in self.server.mock.services:
+            self._reply(404, {"error": "Not found"})
+            return
+        if not self._admit(parts[0]):
+            return
+        getattr(self, f"_get_{parts[0]}")(parts[1:])
+
+    def do_POST(self):
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        if not parts or parts[0] not in self.server.mock.services:
+            self._reply(404, {"error": "Not found"})
+            return
+        body = self._body()
+        if not self._admit(parts[0]):
+            return
+        getattr(self, f"_post_{parts[0]}")(parts[1:], body)
+
+    # RCSB
+    def _get_rcsb(self, parts):
+        mock = self.server.mock
+        if parts == ["holdings"]:
+            names = os.listdir(mock.pdb_dir) if mock.pdb_dir else []
+            self._reply(200, [name[:-4].upper() for name in names if name.endswith(".pdb")])
+            return
+        pdb_id = parts[-1].split(".")[0] if parts else ""
+        path = os.path.join(mock.pdb_dir, f"{pdb_id}.pdb") if mock.pdb_dir else None
+        if path and os.path.isfile(path):
+            with open(path, "r") as file:
+                text = file.read()
+        elif re.fullmatch(r"[0-9][A-Za-z0-9]{3}", pdb_id) and not mock.pdb_dir:
+            text = _generated_pdb(pdb_id)
+        else:
+            self._reply(404, "<html><body>Not Found</body></html>", "text/html")
+            return
+        # Conditional requests as on files.rcsb.org
+        etag = f'"{hashlib.sha1(text.encode()).hexdigest()[:16]}"'
+        headers = {"ETag": etag, "Last-Modified": "Wed, 01 Jan 2020 00:00:00 GMT"}
+        if self.headers.get("If-None-Match") == etag:
+            self._reply(304, b"", "text/plain", headers)
+        else:
+            self._reply(200, text, "text/plain", headers)
+
+    def _post_rcsb(self, parts, body):
+        self._reply(405, {"error": "Method not allowed"})
+
+    # XSSP
+    def _post_xssp(self, parts, body):
+        mock = self.server.mock
+        text = body.decode(errors="ignore")
+        self._reply(200, {"id": mock.new_job("xssp", text)})
+
+    def _get_xssp(self, parts):
+        mock = self.server.mock
+        job = mock.get_job(parts[-1]) if len(parts) >= 5 else None
+        if job is None:
+            self._reply(404, {"error": "Unknown job"})
+        elif parts[1] == "status":
+            if time.time() < job.ready_at:
+                self._reply(200, {"status": "STARTED"})
+            elif job.failed:
+                self._reply(200, {"status": "FAILURE", "message": "Mock failure injected"})
+            else:
+                self._reply(200, {"status": "SUCCESS"})
+        elif parts[1] == "result" and time.time() >= job.ready_at and not job.failed:
+            self._reply(200, {"result": fake_dssp(job.payload, mock.random())})
+        else:
+            self._reply(404, {"error": "Result not available"})
+
+    # MMseqs2
+    def _post_mmseqs(self, parts, body):
+        mock = self.server.mock
+        form = parse_qs(body.decode())
+        text = form.get("q", [""])[0]
+        queries = re.findall(r">(\S+)\s*\n([A-Za-z\n]+?)(?=\n>|\Z)", text.strip() + "\n")
+        queries = [(name, seq.replace("\n", "")) for name, seq in queries]
+        if not queries:
+            self._reply(200, {"status": "ERROR"})
+            return
+        self._reply(200, {"id": mock.new_job("mmseqs", queries), "status": "PENDING"})
+
+    def _get_mmseqs(self, parts):
+        mock = self.server.mock
+        job = mock.get_job(parts[-1]) if parts else None
+        if job is None:
+            self._reply(404, {"status": "UNKNOWN"})
+        elif parts[0] == "ticket":
+            if time.time() < job.ready_at:
+                self._reply(200, {"id": parts[-1], "status": "RUNNING"})
+            else:
+                self._reply(200, {"id": parts[-1], "status": "ERROR" if job.failed else "COMPLETE"})
+        elif parts[0] == "result" and time.time() >= job.ready_at and not job.failed:
+            self._reply(200, fake_a3m_tar(job.payload, mock.random()), "application/octet-stream")
+        else:
+            self._reply(404, {"status": "UNKNOWN"})
+
+    # EBI seqret
+    def _post_seqret(self, parts, body):
+        mock = self.server.mock
+        form = parse_qs(body.decode())
+        payload = (form.get("sequence", [""])[0], form.get("outputformat", ["fasta"])[0])
+        self._reply(200, f"emboss_seqret-R{mock.new_job('seqret', payload)}", "text/plain")
+
+    def _get_seqret(self, parts):
+        mock = self.server.mock
+        job_id = parts[1].split("-R", 1)[-1] if len(parts) >= 2 else ""
+        job = mock.get_job(job_id)
+        if job is None or time.time() < job.ready_at or job.failed:
+            self._reply(400, "<error>Result not available</error>", "text/xml")
+            return
+        seq, fmt = job.payload
+        if fmt == "clustal":
+            self._reply(200, f"CLUSTAL W\n\nquery {seq}\n", "text/plain")
+        else:
+            self._reply(200, f">query\n{seq}\n", "text/plain")
+
+    # TOPCONS
+    def _get_topcons(self, parts):
+        mock = self.server.mock
+        job = mock.get_job(parts[-1].split(".")[0]) if parts else None
+        records = fasta_records(job.payload.decode(errors="replace")) if job is not None else []
+        if len(records) > 1:
+            # A multi-sequence submission gets one block per sequence, as in the TOPCONS result file
+            blocks = [f"Sequence number: {k + 1}\nSequence name: {name}\nSequence length: {len(seq)} aa.\n"
+                      f"Sequence:\n{seq}\n\n\nTOPCONS predicted topology:\n{fake_topology(len(seq))}\n\n"
+                      for k, (name, seq) in enumerate(records)]
+            self._reply(200, "#" * 78 + "\n" + ("#" * 78 + "\n").join(blocks), "text/plain")
+            return
+        self._reply(200, f"Mock TOPCONS result {parts[-1] if parts else ''}\n\nTOPCONS predicted topology:\n"
+                         f"{fake_topology(300)}\n", "text/plain")
+
+    def _post_topcons(self, parts, body):
+        self._reply(200, {"id": self.server.mock.new_job("topcons", body)})
+
+    # ConSurf
+    def _get_consurf(self, parts):
+        mock = self.server.mock
+        rng = mock.random()
+        rows = ["\t Amino Acid Conservation Scores", "\t=======================================", "",
+                " POS\t SEQ\t    3LATOM\tSCORE\t\tCOLOR\tCONFIDENCE INTERVAL\tCONFIDENCE INTERVAL COLORS\tMSA DATA"]
+        for k in range(1, 301):
+            rows.append(f"   {k}\t   A\t    ALA{k}:A\t {rng.uniform(-1.5, 2.5):.3f}\t\t  {rng.randint(1, 9)}"
+                        f"\t-0.500, 0.500\t\t\t    4,6\t\t\t   50/50\tA")
+        self._reply(200, "\n".join(rows) + "\n", "text/plain")
+
+    def _post_consurf(self, parts, body):
+        self._reply(200, {"id": self.server.mock.new_job("consurf", body)})
+
+
+def _generated_pdb(pdb_id: str, n_res: int = 120) -> str:
+
+    r"""
+    Generates a small single-chain PDB file (a straight helix-like CA trace) for IDs without a file on disk.
+    :param pdb_id: PDB ID
+    :param n_res: the number of residues
+    :return: the PDB text
+    """
+
+    names = ["ALA", "LEU", "LYS", "GLU", "SER", "VAL", "ILE", "ASP", "GLY", "PHE"]
+    lines = [f"HEADER    MOCK STRUCTURE                          01-JAN-00   {pdb_id.upper()}"]
+    seqres = [names[k % len(names)] for k in range(n_res)]
+    for row in range(0, n_res, 13):
+        lines.append(f"SEQRES {row // 13 + 1:3d} A {n_res:4d}  " + " ".join(seqres[row:row + 13]))
+    serial = 1
+    for k in range(n_res):
+        angle = k * 100 / 180 * math.pi
+        x, y, z = 2.3 * math.cos(angle), 2.3 * math.sin(angle), 1.5 * k
+        for atom, dx in (("N", -1.0), ("CA", 0.0), ("C", 1.0)):
+            lines.append(f"ATOM  {serial:5d}  {atom:<3s} {seqres[k]} A{k + 1:4d}    {x + dx:8.3f}{y:8.3f}{z:8.3f}"
+                         f"  1.00  0.00           {atom[0]}")
+            serial += 1
+    lines.append("TER")
+    lines.append("END")
+    return "\n".join(lines) + "\n"
+
+
+def _parse_spec(text: str):
+
+    r"""
+    Parses a distribution given on the command line, e.g. "lognormal,0.2,0.5" or "0.1".
+    :param text: the specification
+    :return: a number or a tuple accepted by sample
+    """
+
+    if text is None:
+        return None
+    parts = text.split(",")
+    if len(parts) == 1:
+        return float(parts[0])
+    return (parts[0],) + tuple(float(p) for p in parts[1:])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local mock servers for the remote services")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--pdb-dir", default=None)
+    parser.add_argument("--latency", default=None, help="per-request delay, e.g. lognormal,0.2,0.5")
+    parser.add_argument("--queue-delay", default=None, help="job duration, e.g. uniform,5,30")
+    parser.add_argument("--rate", type=float, default=None, help="requests per second per service")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    profiles = {name: ServiceProfile(latency=_parse_spec(args.latency), queue_delay=_parse_spec(args.queue_delay),
+                                     rate=args.rate, error_rate=args.error_rate, failure_rate=args.failure_rate)
+                for name in MockServices.services}
+    mock = MockServices(args.host, args.port, profiles, args.pdb_dir).start()
+    for name in MockServices.services:
+        print(f"{name:<8} {mock.url(name)}")
+    try:
+        while True:
+            time.sleep(60)
+            print(json.dumps(mock.stats))
+    except KeyboardInterrupt:
+        mock.stop()
@@ -1,34 +1,40 @@
 import re
+from workspace import get_workspace
 
 
-def msa_convert(pdb_id):
+def _is_entry(line: str) -> bool:
+    return line != "" and (line[0] == "-" or line[0] == ">" or line[0].isalpha())
+
+
+def msa_convert(pdb_id, stream=None, workspace=None):
 
     r"""
     Converts the MSA file generated by mmseqs2 from a3m format into fasta-like format. Deletes entries with same name.
     Generates a file named pdb_id_MSA.fasta
+    The a3m is read line by line in one pass, so it can come straight from a download or a tar member instead of a
+    file on disk.
     :param pdb_id: the PDB ID of the protein
+    :param stream: an optional text stream (or iterable of lines) holding the a3m. Defaults to the file pdb_id.a3m
+    :param workspace: the Workspace both files are resolved in. Defaults to the current working directory
     :return: N/A
     """
 
-    with open(f"{pdb_id}.a3m", "r") as a3:
-        lines = a3.readline()
-        emt_arr = []
-        seen = set()
-        while lines[0] == "-" or lines[0] == ">" or lines[0].isalpha():
-            if lines.split()[0] not in seen:
-                seen.add(lines.split()[0])
-                emt_arr.append(lines.split()[0])
-            lines = a3.readline()
-            lines = a3.readline()
-        a3.seek(0)
-        with open(f"{pdb_id}_MSA.fasta", "w") as fast:
-            line = a3.readline()
-            while line[0] == "-" or line[0] == ">" or line[0].isalpha():
-                if line.split()[0] in emt_arr:
-                    fast.write(line)
-                    emt_arr.remove(line.split()[0])
-                    line = a3.readline()
-                    string = line
-                    string = re.sub("[a-z]", "", string)
-                    fast.write(string)
-                line = a3.readline()
+    workspace = get_workspace(workspace)
+    if stream is None:
+        with open(workspace.a3m(pdb_id), "r") as a3:
+            return msa_convert(pdb_id, a3, workspace)
+
+    lines = iter(stream)
+    seen = set()
+    with open(workspace.msa_fasta(pdb_id), "w") as fast:
+        line = next(lines, "")
+        while _is_entry(line):
+            if line.split()[0] not in seen:
+                seen.add(line.split()[0])
+                fast.write(line)
+                string = next(lines, "")
+                string = re.sub("[a-z]", "", string)
+                fast.write(string)
+            else:
+                next(lines, "")
+            line = next(lines, "")
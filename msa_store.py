@@ -0,0 +1,438 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+import numpy as np
+from conservation import alphabet
+
+
+r"""
+A store of multiple sequence alignments converted once into integer matrices, so conservation scoring, FASTA
+conversion and any other consumer read the alignment from memory-mapped arrays instead of re-tokenizing the a3m text.
+
+An alignment with n sequences and a query of length L is kept as
+    matrix.bin      (n, L) uint8 codes of the match columns, indices into codes (gaps are alphabet.index("-"))
+    insertions.bin  (n, L) uint8 number of inserted residues (a3m lower case) before each column, capped at 255
+    headers.bin     the header lines, without ">" and without line breaks, one after another
+    offsets.bin     (n + 1) int64 start of every header in headers.bin
+    meta.json       query sequence, n, L and the source of the alignment
+under {root}/ab/{key}/, the key being the SHA-1 of the query sequence. The first sequence is the query.
+Rows are tokenized in chunks with NumPy, so converting a 500,000-sequence alignment costs a few passes over its bytes.
+"""
+
+# The first codes are conservation.alphabet, so the matrix can be scored directly; the rest keep the other letters
+codes = alphabet + b"XBZUOJ"
+gap = alphabet.index(b"-")
+
+
+def query_hash(query: str) -> str:
+
+    r"""
+    Computes the key of an alignment from its query sequence.
+    :param query: the query sequence
+    :return: the hex digest
+    """
+
+    return hashlib.sha1(query.upper().encode()).hexdigest()
+
+
+# a3m marks insertions with lower case letters and "."
+_inserted = b"abcdefghijklmnopqrstuvwxyz."
+_flags = bytes(1 if chr(c) in _inserted.decode() else 0 for c in range(256))
+
+
+def _lookup() -> np.ndarray:
+    table = np.full(256, gap, dtype=np.uint8)
+    for k, letter in enumerate(codes):
+        table[letter] = k
+    return table
+
+
+def _records(lines):
+
+    r"""
+    Splits a3m lines into records. Sequences may span several lines. The alignment ends at a NUL byte, which separates
+    the blocks of a multi-query a3m.
+    :param lines: an iterable of str or bytes lines
+    :return: a generator of (header, sequence) bytes, the header without ">"
+    """
+
+    header, seq = None, []
+    for line in lines:
+        if isinstance(line, str):
+            line = line.encode()
+        end = line.find(b"\x00")
+        if end >= 0:
+            line = line[:end]
+        line = line.rstrip(b"\r\n")
+        if line.startswith(b">"):
+            if header is not None:
+                yield header, b"".join(seq)
+            header, seq = line[1:], []
+        elif line and line[:1] != b"#" and header is not None:
+            seq.append(line.strip())
+        if end >= 0:
+            break
+    if header is not None:
+        yield header, b"".join(seq)
+
+
+class _Writer:
+
+    r"""
+    Class name: _Writer
+    Description: Appends records to the files of a new alignment, tokenizing them a chunk at a time.
+    """
+
+    def __init__(self, path: str, length: int, chunk: int = 8192):
+        self._path = path
+        self._length = length
+        self._chunk = chunk
+        self._lookup = _lookup()
+        self._headers, self._seqs = [], []
+        self._n = 0
+        self._offset = 0
+        self._files = {name: open(os.path.join(path, f"{name}.bin"), "wb")
+                       for name in ("matrix", "insertions", "headers", "offsets")}
+        self._files["offsets"].write(np.zeros(1, dtype=np.int64).tobytes())
+
+    def _fit(self, seq: bytes) -> bytes:
+        # Pads or cuts a row that does not have one match column per query residue
+        match = np.flatnonzero(np.frombuffer(seq.translate(_flags), dtype=np.uint8) == 0)
+        if len(match) > self._length:
+            return seq[:match[self._length]]
+        return seq + b"-" * (self._length - len(match))
+
+    def add(self, header: bytes, seq: bytes):
+        self._headers.append(header)
+        self._seqs.append(seq)
+        if len(self._seqs) >= self._chunk:
+            self.flush()
+
+    def flush(self):
+        if not self._seqs:
+            return
+        n, length = len(self._seqs), self._length
+        stripped = [seq.translate(None, _inserted) for seq in self._seqs]
+        if any(len(row) != length for row in stripped):
+            self._seqs = [self._fit(seq) for seq in self._seqs]
+            return self.flush()
+        matrix = self._lookup[np.frombuffer(b"".join(stripped), dtype=np.uint8)]
+
+        # Insertions are sparse, so they are located one by one: the column of an inserted residue is its position in
+        # the row minus the insertions before it
+        flags = np.frombuffer(b"".join(self._seqs).translate(_flags), dtype=np.uint8)
+        pos = np.flatnonzero(flags)
+        sizes = np.fromiter((len(seq) for seq in self._seqs), dtype=np.int64, count=n)
+        starts = np.cumsum(sizes) - sizes
+        row = np.searchsorted(starts, pos, side="right") - 1
+        first = np.searchsorted(row, np.arange(n))
+        column = pos - starts[row] - (np.arange(len(pos)) - first[row])
+        counts = np.bincount(row * (length + 1) + column, minlength=n * (length + 1)).reshape(n, length + 1)
+
+        self._files["matrix"].write(matrix.tobytes())
+        # Insertions after the last column are dropped
+        self._files["insertions"].write(np.minimum(counts[:, :length], 255).astype(np.uint8).tobytes())
+        self._files["headers"].write(b"".join(self._headers))
+        ends = self._offset + np.cumsum([len(h) for h in self._headers], dtype=np.int64)
+        self._files["offsets"].write(ends.tobytes())
+        self._offset = int(ends[-1])
+        self._n += n
+        self._headers, self._seqs = [], []
+
+    def close(self) -> int:
+        self.flush()
+        for file in self._files.values():
+            file.close()
+        return self._n
+
+
+class StoredMSA:
+
+    r"""
+    Class name: StoredMSA
+    Description: One alignment of an MSAStore. The matrices are memory-mapped read-only, so a column or a block of rows
+                 is a view into the page cache and is never copied unless the caller copies it.
+    Variables:
+        self.key: the query hash
+        self.query: the query sequence
+        self.n_rows: the number of sequences, the query included
+        self.length: the number of query columns
+        self.matrix: the (n_rows, length) code matrix
+        self.insertions: the (n_rows, length) insertion counts
+    """
+
+    def __init__(self, path: str):
+
+        r"""
+        Object constructor. Opens an alignment written by MSAStore.
+        :param path: the directory of the alignment
+        """
+
+        with open(os.path.join(path, "meta.json"), "r") as file:
+            meta = json.load(file)
+        self._path = path
+        self._key = meta["key"]
+        self._query = meta["query"]
+        self._source = meta.get("source")
+        self._n_rows = meta["n_rows"]
+        self._length = meta["length"]
+        shape = (self._n_rows, self._length)
+        self._matrix, self._insertions = (
+            np.memmap(os.path.join(path, f"{name}.bin"), dtype=np.uint8, mode="r", shape=shape)
+            if self._n_rows * self._length else np.zeros(shape, dtype=np.uint8)
+            for name in ("matrix", "insertions"))
+        self._offsets = np.fromfile(os.path.join(path, "offsets.bin"), dtype=np.int64)
+        self._headers = None
+
+    def get_key(self) -> str:
+
+        r"""
+        Returns key.
+        :return: the query hash
+        """
+
+        return self._key
+
+    def get_query(self) -> str:
+
+        r"""
+        Returns query.
+        :return: the query sequence
+        """
+
+        return self._query
+
+    def get_source(self) -> str:
+
+        r"""
+        Returns source.
+        :return: where the alignment was read from, if known
+        """
+
+        return self._source
+
+    def get_num_rows(self) -> int:
+
+        r"""
+        Returns the number of sequences.
+        :return: n_rows
+        """
+
+        return self._n_rows
+
+    def get_length(self) -> int:
+
+        r"""
+        Returns the number of query columns.
+        :return: length
+        """
+
+        return self._length
+
+    def get_matrix(self) -> np.ndarray:
+
+        r"""
+        Returns matrix.
+        :return: the (n_rows, length) uint8 code matrix
+        """
+
+        return self._matrix
+
+    def get_insertions(self) -> np.ndarray:
+
+        r"""
+        Returns insertions.
+        :return: the (n_rows, length) uint8 insertion counts
+        """
+
+        return self._insertions
+
+    def column(self, j: int) -> np.ndarray:
+
+        r"""
+        Returns one query column.
+        :param j: column index (0-based)
+        :return: a strided view of the codes of all sequences at the column
+        """
+
+        return self._matrix[:, j]
+
+    def header(self, i: int) -> str:
+
+        r"""
+        Returns the header of one sequence.
+        :param i: row index
+        :return: the header line without ">"
+        """
+
+        if self._headers is None:
+            self._headers = np.fromfile(os.path.join(self._path, "headers.bin"), dtype=np.uint8)
+        return self._headers[self._offsets[i]:self._offsets[i + 1]].tobytes().decode()
+
+    def rows(self, start: int = 0, stop: int = None, block: int = 65536):
+
+        r"""
+        Decodes sequences into aligned text, with insertions removed.
+        :param start: first row
+        :param stop: row after the last one. Defaults to all rows
+        :param block: the number of rows decoded at once
+        :return: a generator of str rows
+        """
+
+        letters = np.frombuffer(codes, dtype=np.uint8)
+        stop = self._n_rows if stop is None else stop
+        for first in range(start, stop, block):
+            text = letters[self._matrix[first:min(first + block, stop)]].tobytes().decode()
+            for k in range(0, len(text), self._length):
+                yield text[k:k + self._length]
+
+    def write_fasta(self, path: str) -> str:
+
+        r"""
+        Writes the alignment in the FASTA-like format of msa_converter.msa_convert: insertions removed and only the
+        first sequence of every name kept.
+        :param path: the output path, e.g. {pdb_id}_MSA.fasta
+        :return: path
+        """
+
+        seen = set()
+        with open(path, "w") as fast:
+            for i, row in enumerate(self.rows()):
+                header = self.header(i)
+                name = header.split()[0] if header.split() else ""
+                if name in seen:
+                    continue
+                seen.add(name)
+                fast.write(f">{header}\n{row}\n")
+        return path
+
+
+class MSAStore:
+
+    r"""
+    Class name: MSAStore
+    Description: A directory of integer-encoded alignments keyed by the hash of their query sequence.
+    Variables:
+        self.root: the directory of the store
+    """
+
+    def __init__(self, root: str = "msa_store"):
+
+        r"""
+        Object constructor.
+        :param root: the directory of the store
+        """
+
+        self._root = os.path.abspath(root)
+        os.makedirs(self._root, exist_ok=True)
+
+    def get_root(self) -> str:
+
+        r"""
+        Returns root.
+        :return: root
+        """
+
+        return self._root
+
+    def path(self, key: str) -> str:
+
+        r"""
+        Returns the directory of an alignment.
+        :param key: the query hash
+        :return: the path
+        """
+
+        return os.path.join(self._root, key[:2], key)
+
+    def has(self, key: str) -> bool:
+
+        r"""
+        Checks whether an alignment is in the store.
+        :param key: the query hash
+        :return: True if it exists
+        """
+
+        return os.path.exists(os.path.join(self.path(key), "meta.json"))
+
+    def open(self, key: str) -> StoredMSA:
+
+        r"""
+        Opens an alignment by its key.
+        :param key: the query hash
+        :return: a StoredMSA
+        """
+
+        if not self.has(key):
+            raise KeyError(key)
+        return StoredMSA(self.path(key))
+
+    def get(self, query: str):
+
+        r"""
+        Looks up the alignment of a query sequence.
+        :param query: the query sequence
+        :return: a StoredMSA, or None
+        """
+
+        key = query_hash(query)
+        return self.open(key) if self.has(key) else None
+
+    def add(self, source, overwrite: bool = False) -> StoredMSA:
+
+        r"""
+        Converts an a3m alignment and adds it to the store. If an alignment of the same query is already stored, the
+        source is read no further than its first record and the stored alignment is returned.
+        :param source: the path of an a3m file, or an iterable of its lines (e.g. a stream from a tar member)
+        :param overwrite: if True, replace an alignment of the same query
+        :return: the StoredMSA
+        """
+
+        if isinstance(source, str):
+            with open(source, "rb") as file:
+                return self._add(file, source, overwrite)
+        return self._add(source, None, overwrite)
+
+    def _add(self, lines, name: str, overwrite: bool) -> StoredMSA:
+        records = _records(lines)
+        first = next(records, None)
+        if first is None:
+            raise ValueError("The alignment has no sequences.")
+        query = first[1].translate(None, _inserted).decode().upper()
+        key = query_hash(query)
+        if self.has(key) and not overwrite:
+            return self.open(key)
+
+        tmp = os.path.join(self._root, f".{key}.{uuid.uuid4().hex}.tmp")
+        os.makedirs(tmp)
+        try:
+            writer = _Writer(tmp, len(query))
+            writer.add(*first)
+            for header, seq in records:
+                writer.add(header, seq)
+            n_rows = writer.close()
+            with open(os.path.join(tmp, "meta.json"), "w") as out:
+                json.dump({"key": key, "query": query, "n_rows": n_rows, "length": len(query), "source": name}, out)
+            os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+            if overwrite:
+                shutil.rmtree(self.path(key), ignore_errors=True)
+            try:
+                os.rename(tmp, self.path(key))
+            except OSError:
+                # Another process stored the same query first
+                pass
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        return self.open(key)
+
+    def keys(self) -> list:
+
+        r"""
+        Lists the alignments in the store.
+        :return: a list of query hashes
+        """
+
+        return sorted(key for prefix in os.listdir(self._root) if len(prefix) == 2
+                      for key in os.listdir(os.path.join(self._root, prefix)) if self.has(key))
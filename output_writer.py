@@ -0,0 +1,305 @@
+import gzip
+import io
+import json
+import numpy as np
+
+
+r"""
+Chunked output of residue and pair tables.
+Rows are never written one by one: every chunk is formatted column by column with NumPy and handed to a buffered file
+in one call, so a pair table with millions of rows is written at disk speed without being held in memory.
+Supported formats, chosen from the file name:
+    .tsv / .txt   tab separated text
+    .csv          comma separated text
+    .pslb         compact binary: a one-line JSON header followed by packed fixed-size records
+Adding .gz to any of them compresses the output.
+"""
+
+binary_magic = b"PSLB1\n"
+
+pair_columns = ("chain_1", "num_1", "aa_1", "chain_2", "num_2", "aa_2", "dist")
+
+
+class TableWriter:
+
+    r"""
+    Class name: TableWriter
+    Description: Streams a table to disk chunk by chunk. Every chunk is a dictionary from column name to array.
+    Variables:
+        self.path: the output file
+        self.columns: the column names, in output order
+        self.fmt: "tsv", "csv" or "bin"
+        self.float_format: printf-style format of floating point columns in text output
+        self.dtypes: declared binary field types, from column name to a NumPy type (e.g. "S4" for text of up to 4
+                     characters); other fields take the type of the first chunk
+        self.rows: the number of rows written so far
+    """
+
+    def __init__(
+            self,
+            path,
+            columns: list,
+            fmt: str = None,
+            float_format: str = "%.2f",
+            buffer_size: int = 1 << 20,
+            dtypes: dict = None
+                 ):
+
+        r"""
+        Object constructor. Opens the file and writes the header.
+        :param path: the output file name, or an already open text file object (e.g. sys.stdout) for text output
+        :param columns: the column names, in output order
+        :param fmt: "tsv", "csv" or "bin". Inferred from the file name when not given.
+        :param float_format: printf-style format of floating point columns in text output
+        :param buffer_size: the size of the write buffer in bytes
+        :param dtypes: declared binary field types, from column name to a NumPy type. Text fields are otherwise as wide
+                       as in the first chunk, and a later chunk with longer text raises ValueError.
+        """
+
+        self._path = path
+        self._columns = list(columns)
+        self._fmt = fmt if fmt else self._infer_format(path)
+        self._float_format = float_format
+        self._rows = 0
+        self._dtype = None
+        self._dtypes = dict(dtypes) if dtypes else {}
+        self._own_file = isinstance(path, str)
+
+        if not self._own_file:
+            self._file = path
+        elif path.endswith(".gz"):
+            # Chunks are already large, so the compressor is fed in big blocks
+            self._file = gzip.open(path, "wb", compresslevel=6)
+        else:
+            self._file = open(path, "wb", buffering=buffer_size)
+
+        if self._fmt != "bin":
+            self._sep = "," if self._fmt == "csv" else "\t"
+            self._write_bytes((self._sep.join(self._columns) + "\n").encode())
+
+    @staticmethod
+    def _infer_format(path) -> str:
+
+        r"""
+        Infers the output format from the file name.
+        :param path: the output file name
+        :return: "tsv", "csv" or "bin"
+        """
+
+        if not isinstance(path, str):
+            return "tsv"
+        name = path[:-3] if path.endswith(".gz") else path
+        if name.endswith(".csv"):
+            return "csv"
+        if name.endswith(".pslb"):
+            return "bin"
+        return "tsv"
+
+    def _write_bytes(self, data: bytes):
+
+        r"""
+        Writes raw bytes, or text when the target is a text stream.
+        :param data: the bytes to write
+        :return: N/A
+        """
+
+        if isinstance(self._file, io.TextIOBase):
+            self._file.write(data.decode())
+        else:
+            self._file.write(data)
+
+    def _format_column(self, values: np.ndarray) -> np.ndarray:
+
+        r"""
+        Converts one column of a chunk into strings.
+        :param values: the column
+        :return: an array of strings
+        """
+
+        if values.dtype.kind == "f":
+            return np.char.mod(self._float_format, values)
+        return values.astype(str)
+
+    def write_chunk(self, chunk: dict):
+
+        r"""
+        Writes one chunk of rows.
+        :param chunk: a dictionary from column name to array; every column of the writer must be present
+        :return: N/A
+        """
+
+        n = len(chunk[self._columns[0]])
+        if n == 0:
+            return
+        if self._fmt == "bin":
+            if self._dtype is None:
+                self._start_binary(chunk)
+            records = np.empty(n, dtype=self._dtype)
+            for name in self._columns:
+                values = np.asarray(chunk[name])
+                field = self._dtype[name]
+                chars = values.dtype.itemsize // 4 if values.dtype.kind == "U" else values.dtype.itemsize
+                # The dtype width is an upper bound of the text length, so most chunks need no counting
+                if field.kind == "S" and values.dtype.kind in "SU" and chars > field.itemsize \
+                        and _text_width(values) > field.itemsize:
+                    # astype would cut the text silently
+                    raise ValueError(f"Column {name} has text longer than its {field.itemsize}-character field; "
+                                     f"declare a wider field with dtypes={{{name!r}: 'S{_text_width(values)}'}}.")
+                records[name] = values.astype(field)
+            self._file.write(records.tobytes())
+        else:
+            line = self._format_column(np.asarray(chunk[self._columns[0]]))
+            for name in self._columns[1:]:
+                line = np.char.add(np.char.add(line, self._sep), self._format_column(np.asarray(chunk[name])))
+            self._write_bytes(("\n".join(line.tolist()) + "\n").encode())
+        self._rows += n
+
+    def _start_binary(self, chunk: dict):
+
+        r"""
+        Fixes the record layout from the first chunk and writes the binary header.
+        :param chunk: the first chunk
+        :return: N/A
+        """
+
+        fields = []
+        for name in self._columns:
+            if name in self._dtypes:
+                fields.append((name, np.dtype(self._dtypes[name]).str))
+                continue
+            dtype = np.asarray(chunk[name]).dtype
+            # Text columns are stored as bytes, a quarter of the size of NumPy unicode
+            fields.append((name, f"S{max(dtype.itemsize // 4, 1)}" if dtype.kind == "U" else dtype.str))
+        self._dtype = np.dtype(fields)
+        header = json.dumps({"columns": self._columns, "dtype": self._dtype.descr})
+        self._file.write(binary_magic + header.encode() + b"\n")
+
+    def get_rows(self) -> int:
+
+        r"""
+        Returns the number of rows written so far.
+        :return: rows
+        """
+
+        return self._rows
+
+    def close(self):
+
+        r"""
+        Flushes and closes the file. Files passed in as objects are only flushed.
+        :return: N/A
+        """
+
+        if self._fmt == "bin" and self._dtype is None and self._own_file:
+            # Empty table: still write a header so the file can be read back
+            self._dtype = np.dtype([(name, "f4") for name in self._columns])
+            header = json.dumps({"columns": self._columns, "dtype": self._dtype.descr})
+            self._file.write(binary_magic + header.encode() + b"\n")
+        if self._own_file:
+            self._file.close()
+        else:
+            self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _text_width(values: np.ndarray) -> int:
+
+    r"""
+    Returns the length of the longest string of a text column.
+    :param values: an array of str or bytes
+    :return: the number of characters
+    """
+
+    return int(np.char.str_len(values).max()) if len(values) else 0
+
+
+def _binary_header(file) -> np.dtype:
+
+    r"""
+    Reads the header of a binary table.
+    :param file: a binary file object positioned at the start
+    :return: the record dtype
+    """
+
+    if file.readline() != binary_magic:
+        raise ValueError("Not a binary spin label table.")
+    header = json.loads(file.readline())
+    return np.dtype([tuple(field) for field in header["dtype"]])
+
+
+def read_binary(path: str, chunk_rows: int = 1 << 16):
+
+    r"""
+    Reads a binary table chunk by chunk.
+    :param path: the file written by TableWriter
+    :param chunk_rows: the number of rows per chunk
+    :return: a generator of structured arrays
+    """
+
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as file:
+        dtype = _binary_header(file)
+        while True:
+            data = file.read(dtype.itemsize * chunk_rows)
+            if not data:
+                break
+            yield np.frombuffer(data, dtype=dtype)
+
+
+def open_binary(path: str) -> np.memmap:
+
+    r"""
+    Memory-maps an uncompressed binary table.
+    :param path: the file written by TableWriter
+    :return: a structured memmap with one record per row
+    """
+
+    with open(path, "rb") as file:
+        dtype = _binary_header(file)
+        offset = file.tell()
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset)
+
+
+def write_residues(path, table, columns: list = None) -> int:
+
+    r"""
+    Writes a residue table.
+    :param path: the output file name or text file object
+    :param table: a ResidueTable
+    :param columns: the columns to write. Defaults to the annotation columns.
+    :return: the number of rows written
+    """
+
+    if columns is None:
+        columns = [c for c in ("chain", "num", "aa", "mem", "solex", "rsa", "cons", "secstruct")
+                   if table.has_column(c)]
+    with TableWriter(path, columns) as writer:
+        writer.write_chunk({name: table.get_column(name) for name in columns})
+    return writer.get_rows()
+
+
+def write_pairs(path, table, pair_chunks, extra: list = ()) -> int:
+
+    r"""
+    Writes a pair table from a stream of pair chunks (e.g. residue_table.iter_pairs), one chunk at a time.
+    :param path: the output file name or text file object
+    :param table: the ResidueTable the pair indices refer to
+    :param pair_chunks: an iterable of dictionaries with columns "i", "j" and "dist"
+    :param extra: more residue columns to write for both residues, e.g. ["secstruct", "solex"]
+    :return: the number of rows written
+    """
+
+    columns = list(pair_columns) + [f"{name}_{k}" for name in extra for k in (1, 2)]
+    with TableWriter(path, columns) as writer:
+        for pairs in pair_chunks:
+            chunk = {"dist": pairs["dist"]}
+            for k, side in ((1, pairs["i"]), (2, pairs["j"])):
+                for name in ("chain", "num", "aa") + tuple(extra):
+                    chunk[f"{name}_{k}"] = table.get_column(name)[side]
+            writer.write_chunk(chunk)
+    return writer.get_rows()
@@ -0,0 +1,261 @@
+import heapq
+import numpy as np
+
+
+r"""
+Chooses a small set of spin-label pairs from a candidate pair table. A good set measures large distance changes,
+spreads over different secondary structure elements, and does not label the same residue more often than the
+experiment allows. The value of a set S is
+    sum of pair scores + segment_bonus * (number of segments touched) - redundancy_penalty * (number of chosen pairs
+    that join the same two segments as an earlier chosen pair)
+and no residue may appear in more than max_reuse chosen pairs. The marginal gain of a pair only decreases as the set
+grows, so greedy selection can re-evaluate lazily: a pair is rescored only when it reaches the top of the heap.
+"""
+
+
+def segment_ids(table) -> np.ndarray:
+
+    r"""
+    Labels every residue with the secondary structure element it belongs to: a run of the same DSSP letter in one
+    chain without gaps in residue numbering. Residues outside secondary structure get their own segment each.
+    :param table: a ResidueTable
+    :return: an integer array of segment ids, one per residue
+    """
+
+    chain = table.get_column("chain")
+    num = table.get_column("num").astype(np.int64)
+    ss = table.get_column("secstruct")
+    n = len(chain)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    new = np.ones(n, dtype=bool)
+    new[1:] = (chain[1:] != chain[:-1]) | (ss[1:] != ss[:-1]) | (num[1:] != num[:-1] + 1)
+    new |= ~np.isin(ss, list("HGIE"))
+    return np.cumsum(new) - 1
+
+
+def distance_change(table, other, pairs: dict) -> np.ndarray:
+
+    r"""
+    Computes how much the distance of every pair changes between two conformations of the protein, e.g. the inward-
+    and outward-facing structures of a transporter. Residues are matched by (chain, residue number).
+    :param table: the ResidueTable the pairs refer to
+    :param other: a ResidueTable of the other conformation
+    :param pairs: pair columns "i", "j" and "dist"
+    :return: the absolute change of distance in Angstrom (NaN where a residue is missing from the other structure)
+    """
+
+    lookup = {(c, int(n)): k for k, (c, n) in enumerate(zip(other.get_column("chain"), other.get_column("num")))}
+    where = np.array([lookup.get((c, int(n)), -1) for c, n in zip(table.get_column("chain"), table.get_column("num"))])
+    coords = np.vstack((other.get_coords().astype(np.float64), np.full((1, 3), np.nan)))
+    a, b = coords[where[pairs["i"]]], coords[where[pairs["j"]]]
+    return np.abs(np.sqrt(((a - b) ** 2).sum(axis=1)) - pairs["dist"])
+
+
+class PairSelector:
+
+    r"""
+    Class name: PairSelector
+    Description: Selects a set of pairs from a candidate table with lazy greedy search, or exactly for small
+                 instances.
+    Variables:
+        self.pairs: pair columns "i", "j" and "dist"
+        self.scores: the score of every pair, e.g. the expected distance change
+        self.segments: the segment of every residue (see segment_ids)
+        self.segment_bonus: the value of touching a new segment
+        self.redundancy_penalty: the cost of joining two segments that are already joined by a chosen pair
+        self.max_reuse: the largest number of chosen pairs a residue may be part of
+    """
+
+    def __init__(
+            self,
+            table,
+            pairs: dict,
+            scores=None,
+            other=None,
+            segment_bonus: float = 1.0,
+            redundancy_penalty: float = 0.5,
+            max_reuse: int = 1
+                 ):
+
+        r"""
+        Object constructor.
+        :param table: the ResidueTable the pairs refer to
+        :param pairs: pair columns "i", "j" and "dist"
+        :param scores: an array with one score per pair, or a score expression (see filter_expr.py). Defaults to the
+                       distance change between the two conformations when other is given
+        :param other: a ResidueTable of a second conformation, for scoring pairs by distance_change
+        :param segment_bonus: the value of touching a new segment
+        :param redundancy_penalty: the cost of joining two segments that are already joined by a chosen pair
+        :param max_reuse: the largest number of chosen pairs a residue may be part of
+        """
+
+        if scores is None:
+            if other is None:
+                raise ValueError("Give the pair scores, or a second conformation (other) to score the distance change.")
+            scores = distance_change(table, other, pairs)
+        elif isinstance(scores, str) or hasattr(scores, "score"):
+            from filter_expr import compile_expr
+            scores = compile_expr(scores).score(table, pairs)
+        self._pairs = pairs
+        self._scores = np.nan_to_num(np.asarray(scores, dtype=np.float64), nan=-np.inf)
+        self._segments = segment_ids(table)
+        self._segment_bonus = segment_bonus
+        self._redundancy_penalty = redundancy_penalty
+        self._max_reuse = max_reuse
+        self._n_residues = table.get_length()
+
+        seg_i, seg_j = self._segments[pairs["i"]], self._segments[pairs["j"]]
+        self._seg_lo, self._seg_hi = np.minimum(seg_i, seg_j), np.maximum(seg_i, seg_j)
+        # One id per unordered segment pair, for counting redundant pairs
+        n_seg = int(self._segments.max()) + 1 if len(self._segments) else 1
+        self._link = self._seg_lo.astype(np.int64) * n_seg + self._seg_hi
+
+    def get_scores(self) -> np.ndarray:
+
+        r"""
+        Returns scores.
+        :return: the score of every pair
+        """
+
+        return self._scores
+
+    def get_segments(self) -> np.ndarray:
+
+        r"""
+        Returns segments.
+        :return: the segment of every residue
+        """
+
+        return self._segments
+
+    def _new_state(self) -> dict:
+        return {"covered": {}, "links": {}, "use": np.zeros(self._n_residues, dtype=np.int32)}
+
+    def _gain(self, p: int, state: dict) -> float:
+
+        r"""
+        Computes the marginal gain of adding a pair to the current selection.
+        :param p: pair index
+        :param state: the selection state
+        :return: the gain
+        """
+
+        lo, hi = int(self._seg_lo[p]), int(self._seg_hi[p])
+        covered = state["covered"]
+        new = (covered.get(lo, 0) == 0) + (hi != lo and covered.get(hi, 0) == 0)
+        return (self._scores[p] + self._segment_bonus * new
+                - self._redundancy_penalty * state["links"].get(int(self._link[p]), 0))
+
+    def _feasible(self, p: int, state: dict) -> bool:
+        i, j = self._pairs["i"][p], self._pairs["j"][p]
+        return state["use"][i] < self._max_reuse and state["use"][j] < self._max_reuse
+
+    def _add(self, p: int, state: dict):
+        for seg in {int(self._seg_lo[p]), int(self._seg_hi[p])}:
+            state["covered"][seg] = state["covered"].get(seg, 0) + 1
+        link = int(self._link[p])
+        state["links"][link] = state["links"].get(link, 0) + 1
+        state["use"][self._pairs["i"][p]] += 1
+        state["use"][self._pairs["j"][p]] += 1
+
+    def _remove(self, p: int, state: dict):
+        for seg in {int(self._seg_lo[p]), int(self._seg_hi[p])}:
+            state["covered"][seg] -= 1
+        link = int(self._link[p])
+        state["links"][link] -= 1
+        state["use"][self._pairs["i"][p]] -= 1
+        state["use"][self._pairs["j"][p]] -= 1
+
+    def value(self, chosen) -> float:
+
+        r"""
+        Computes the value of a set of pairs.
+        :param chosen: pair indices
+        :return: the value, or -inf if the set reuses a residue too often
+        """
+
+        state = self._new_state()
+        total = 0.0
+        for p in chosen:
+            if not self._feasible(p, state):
+                return -np.inf
+            total += self._gain(p, state)
+            self._add(p, state)
+        return total
+
+    def greedy(self, k: int) -> list:
+
+        r"""
+        Selects up to k pairs greedily, taking the pair with the largest marginal gain each time. Gains are kept in a
+        heap as upper bounds and a pair is only rescored when it comes to the top, so most of a large candidate table
+        is never looked at again after the first pass.
+        :param k: the number of pairs
+        :return: the chosen pair indices, in order of selection
+        """
+
+        # Every pair starts with its largest possible gain: score plus the bonus for its segments
+        seg_new = 1 + (self._seg_hi != self._seg_lo)
+        bound = self._scores + self._segment_bonus * seg_new
+        order = np.flatnonzero(np.isfinite(bound))
+        heap = list(zip((-bound[order]).tolist(), order.tolist()))
+        heapq.heapify(heap)
+
+        state = self._new_state()
+        chosen = []
+        fresh = {}
+        while heap and len(chosen) < k:
+            neg, p = heapq.heappop(heap)
+            if not self._feasible(p, state):
+                continue
+            if fresh.get(p) == len(chosen):
+                # The gain was computed for the current selection, so it is the true maximum. If even that does not
+                # add value, no other pair does either (like exact, which never takes a set worth less than nothing).
+                if -neg <= 0:
+                    break
+                chosen.append(p)
+                self._add(p, state)
+                continue
+            fresh[p] = len(chosen)
+            heapq.heappush(heap, (-self._gain(p, state), p))
+        return chosen
+
+    def exact(self, k: int, max_candidates: int = 40) -> list:
+
+        r"""
+        Finds the best set of at most k pairs by branch and bound, for small instances. Only the max_candidates pairs with the
+        largest initial gain are considered, so on large tables this is exact over a shortlist.
+        :param k: the number of pairs
+        :param max_candidates: the number of pairs searched
+        :return: the chosen pair indices
+        """
+
+        seg_new = 1 + (self._seg_hi != self._seg_lo)
+        bound = self._scores + self._segment_bonus * seg_new
+        candidates = [int(p) for p in np.argsort(-bound, kind="stable")[:max_candidates] if np.isfinite(bound[p])]
+        bounds = [float(bound[p]) for p in candidates]
+        best = {"value": 0.0, "set": []}
+        state = self._new_state()
+        chosen = []
+
+        def search(start: int, value: float):
+            if value > best["value"]:
+                best["value"], best["set"] = value, list(chosen)
+            if len(chosen) == k:
+                return
+            for q in range(start, len(candidates)):
+                # Candidates are sorted by bound, so the next ones give the best possible completion
+                if value + sum(b for b in bounds[q:q + k - len(chosen)] if b > 0) <= best["value"]:
+                    break
+                p = candidates[q]
+                if not self._feasible(p, state):
+                    continue
+                gain = self._gain(p, state)
+                chosen.append(p)
+                self._add(p, state)
+                search(q + 1, value + gain)
+                chosen.pop()
+                self._remove(p, state)
+
+        search(0, 0.0)
+        return best["set"]
@@ -0,0 +1,255 @@
+import gzip
+import json
+import os
+import threading
+import time
+import requests
+
+
+class PDBCache:
+
+    r"""
+    Class name: PDBCache
+    Description: A local store of PDB files shared by all jobs. Files are kept gzip-compressed in a two-level layout
+                 ({root}/ab/1abc.pdb.gz, next to 1abc.json holding the ETag and Last-Modified of the download) and
+                 revalidated with conditional requests, so an unchanged entry costs one 304 response instead of a full
+                 download. In offline mode the network is never used.
+                 A local index of valid IDs (index.txt) lets IDs be validated without a request. It can be filled from
+                 the RCSB holdings list with update_index, and every successful download is added to it.
+    Variables:
+        self.root: the cache directory
+        self.host_url: the url the files are downloaded from
+        self.offline: if True, only cached files are used
+        self.max_age: cached files younger than this (seconds) are used without revalidation. None means always
+                      revalidate, unless offline
+        self.session: the object used for HTTP requests (the requests module or a requests.Session)
+    """
+
+    holdings_url = "https://data.rcsb.org/rest/v1/holdings/current/entry_ids"
+
+    def __init__(
+            self,
+            root: str = "pdb_cache",
+            host_url: str = "https://files.rcsb.org/view/",
+            offline: bool = False,
+            max_age: float = None,
+            session=None
+                 ):
+
+        r"""
+        Object constructor.
+        :param root: the cache directory
+        :param host_url: the url the files are downloaded from
+        :param offline: if True, only cached files are used
+        :param max_age: cached files younger than this (seconds) are used without revalidation
+        :param session: an optional requests.Session shared with other runners
+        """
+
+        self._root = os.path.abspath(root)
+        self._host_url = host_url
+        self._offline = offline
+        self._max_age = max_age
+        self._session = session if session is not None else requests
+        self._index = None
+        self._lock = threading.Lock()
+        os.makedirs(self._root, exist_ok=True)
+
+    def get_root(self) -> str:
+
+        r"""
+        Returns root.
+        :return: root
+        """
+
+        return self._root
+
+    def is_offline(self) -> bool:
+
+        r"""
+        Returns offline.
+        :return: offline
+        """
+
+        return self._offline
+
+    def path(self, pdb_id: str) -> str:
+
+        r"""
+        Returns where an entry is stored. The sub-directory is named after the middle two characters of the ID, as in
+        the wwPDB archive.
+        :param pdb_id: PDB ID
+        :return: the path of the compressed file
+        """
+
+        pdb_id = pdb_id.lower()
+        return os.path.join(self._root, pdb_id[1:3], f"{pdb_id}.pdb.gz")
+
+    def has(self, pdb_id: str) -> bool:
+
+        r"""
+        Checks whether an entry is cached.
+        :param pdb_id: PDB ID
+        :return: True if the file is in the cache
+        """
+
+        return os.path.isfile(self.path(pdb_id))
+
+    def _meta_path(self, pdb_id: str) -> str:
+        return self.path(pdb_id)[:-len(".pdb.gz")] + ".json"
+
+    def _read_meta(self, pdb_id: str) -> dict:
+        try:
+            with open(self._meta_path(pdb_id), "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self, pdb_id: str, meta: dict):
+        tmp = f"{self._meta_path(pdb_id)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as file:
+            json.dump(meta, file)
+        os.replace(tmp, self._meta_path(pdb_id))
+
+    def _store(self, pdb_id: str, text: str, headers):
+
+        r"""
+        Writes a downloaded file into the cache. The file is written under a temporary name and renamed, so readers in
+        other processes never see a partial file.
+        :param pdb_id: PDB ID
+        :param text: the PDB file
+        :param headers: the response headers
+        :return: N/A
+        """
+
+        path = self.path(pdb_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp, "wt") as out:
+            out.write(text)
+        os.replace(tmp, path)
+        self._write_meta(pdb_id, {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified"),
+                                  "checked": time.time()})
+        self._add_to_index(pdb_id)
+
+    def _fresh(self, pdb_id: str) -> bool:
+        if self._offline:
+            return True
+        if self._max_age is None:
+            return False
+        return time.time() - self._read_meta(pdb_id).get("checked", 0) < self._max_age
+
+    def read_text(self, pdb_id: str) -> str:
+
+        r"""
+        Returns the PDB file of an entry, downloading or revalidating it when needed. When the server cannot be
+        reached, a cached copy is returned even if it could not be revalidated.
+        :param pdb_id: PDB ID
+        :return: the text of the PDB file
+        """
+
+        pdb_id = pdb_id.lower()
+        cached = self.has(pdb_id)
+        if cached and self._fresh(pdb_id):
+            return self._read_cached(pdb_id)
+        if self._offline:
+            raise FileNotFoundError(f"{pdb_id} is not in the PDB cache and the cache is offline.")
+
+        headers = {}
+        meta = self._read_meta(pdb_id) if cached else {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            r = self._session.get(f"{self._host_url}{pdb_id}.pdb", headers=headers)
+        except requests.RequestException:
+            if cached:
+                return self._read_cached(pdb_id)
+            raise
+
+        if r.status_code == 304 and cached:
+            meta["checked"] = time.time()
+            self._write_meta(pdb_id, meta)
+            return self._read_cached(pdb_id)
+        if r.status_code == 200 and r.text.startswith("HEADER"):
+            self._store(pdb_id, r.text, r.headers)
+            return r.text
+        if cached and r.status_code >= 500:
+            return self._read_cached(pdb_id)
+        raise ValueError(f"PDB ID {pdb_id} is invalid.")
+
+    def _read_cached(self, pdb_id: str) -> str:
+        with gzip.open(self.path(pdb_id), "rt") as file:
+            return file.read()
+
+    def fetch(self, pdb_id: str, dest: str) -> str:
+
+        r"""
+        Writes the uncompressed PDB file of an entry to a path, for runners that read {pdb_id}.pdb.
+        :param pdb_id: PDB ID
+        :param dest: the output path
+        :return: dest
+        """
+
+        text = self.read_text(pdb_id)
+        with open(dest, "w") as out:
+            out.write(text)
+        return dest
+
+    def _load_index(self) -> set:
+        with self._lock:
+            if self._index is None:
+                self._index = set()
+                index_path = os.path.join(self._root, "index.txt")
+                if os.path.isfile(index_path):
+                    with open(index_path, "r") as file:
+                        self._index = {line.strip().lower() for line in file if line.strip()}
+            return self._index
+
+    def _add_to_index(self, pdb_id: str):
+        index = self._load_index()
+        with self._lock:
+            if pdb_id in index:
+                return
+            index.add(pdb_id)
+            with open(os.path.join(self._root, "index.txt"), "a") as file:
+                file.write(f"{pdb_id}\n")
+
+    def update_index(self, url: str = None) -> int:
+
+        r"""
+        Replaces the index of valid IDs with the current RCSB holdings list.
+        :param url: the url of the holdings list (a JSON list of IDs)
+        :return: the number of IDs in the index
+        """
+
+        ids = {pdb_id.lower() for pdb_id in self._session.get(url or self.holdings_url).json()}
+        ids |= self._load_index()
+        index_path = os.path.join(self._root, "index.txt")
+        tmp = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as file:
+            file.write("".join(f"{pdb_id}\n" for pdb_id in sorted(ids)))
+        os.replace(tmp, index_path)
+        with self._lock:
+            self._index = ids
+        return len(ids)
+
+    def is_valid(self, pdb_id: str) -> bool:
+
+        r"""
+        Checks whether a PDB ID exists. IDs in the index or in the cache need no request; other IDs are downloaded
+        (and so cached) unless the cache is offline.
+        :param pdb_id: PDB ID
+        :return: True if the ID exists
+        """
+
+        pdb_id = pdb_id.lower()
+        if pdb_id in self._load_index() or self.has(pdb_id):
+            return True
+        if self._offline:
+            return False
+        try:
+            self.read_text(pdb_id)
+        except (ValueError, requests.RequestException):
+            return False
+        return True
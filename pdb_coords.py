@@ -0,0 +1,106 @@
+import gzip
+import numpy as np
+
+
+def read_atoms(PDB_path: str) -> dict:
+
+    r"""
+    Reads the ATOM records of the first model of a PDB file into NumPy arrays. Fixed-width columns are used, so residue
+    numbers above 999 and blank fields do not shift the values.
+    :param PDB_path: The path that contains the PDB file (may be gzip-compressed, e.g. a mirror .ent.gz file)
+    :return: a dictionary of arrays with keys "chain", "resnum", "icode", "resname", "name", "element", "xyz" and
+             "res_idx" (the index of the residue each atom belongs to, in the order residues appear in the file)
+    """
+
+    chain, resnum, icode, resname, name, element, xyz = [], [], [], [], [], [], []
+    opener = gzip.open if PDB_path.endswith(".gz") else open
+    with opener(PDB_path, "rt") as file:
+        for line in file:
+            if line.startswith("ENDMDL"):
+                break
+            if not line.startswith("ATOM"):
+                continue
+            # Keep only the first alternate location of each atom
+            if line[16] not in " A":
+                continue
+            name.append(line[12:16].strip())
+            resname.append(line[17:20].strip())
+            chain.append(line[21])
+            resnum.append(int(line[22:26]))
+            icode.append(line[26].strip())
+            xyz.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+            elem = line[76:78].strip() if len(line) > 76 else ""
+            element.append(elem if elem else name[-1][0])
+
+    atoms = {
+        "chain": np.array(chain, dtype="U1"),
+        "resnum": np.array(resnum, dtype=np.int32),
+        "icode": np.array(icode, dtype="U1"),
+        "resname": np.array(resname, dtype="U3"),
+        "name": np.array(name, dtype="U4"),
+        "element": np.array(element, dtype="U2"),
+        "xyz": np.array(xyz, dtype=np.float64).reshape(-1, 3),
+    }
+
+    # A new residue starts wherever chain, number or insertion code changes
+    n = len(name)
+    new_res = np.ones(n, dtype=bool)
+    if n > 1:
+        new_res[1:] = ((atoms["chain"][1:] != atoms["chain"][:-1])
+                       | (atoms["resnum"][1:] != atoms["resnum"][:-1])
+                       | (atoms["icode"][1:] != atoms["icode"][:-1]))
+    atoms["res_idx"] = np.cumsum(new_res) - 1
+    return atoms
+
+
+def residue_info(atoms: dict) -> dict:
+
+    r"""
+    Collapses an atom dictionary from read_atoms into one entry per residue.
+    :param atoms: the dictionary returned by read_atoms
+    :return: a dictionary of arrays with keys "chain", "resnum", "icode" and "resname", indexed by res_idx
+    """
+
+    first = np.flatnonzero(np.r_[True, np.diff(atoms["res_idx"]) != 0]) if len(atoms["res_idx"]) else np.array([], int)
+    return {
+        "chain": atoms["chain"][first],
+        "resnum": atoms["resnum"][first],
+        "icode": atoms["icode"][first],
+        "resname": atoms["resname"][first],
+    }
+
+
+def residue_coords(atoms: dict, atom_name: str = "CA", fallback: str = "CA") -> np.ndarray:
+
+    r"""
+    Gets one coordinate per residue.
+    :param atoms: the dictionary returned by read_atoms
+    :param atom_name: the atom used to represent each residue, e.g. "CA" or "CB"
+    :param fallback: the atom used when a residue lacks atom_name (e.g. CA for glycine when atom_name is "CB")
+    :return: an (n_residues, 3) array. Residues that have neither atom are filled with the mean of their atoms.
+    """
+
+    n_res = int(atoms["res_idx"][-1]) + 1 if len(atoms["res_idx"]) else 0
+    coords = np.full((n_res, 3), np.nan)
+
+    # Mean of all atoms as the last resort
+    counts = np.bincount(atoms["res_idx"], minlength=n_res).astype(np.float64)
+    for k in range(3):
+        coords[:, k] = np.bincount(atoms["res_idx"], weights=atoms["xyz"][:, k], minlength=n_res) / np.maximum(counts, 1)
+
+    for name in (fallback, atom_name):
+        sel = atoms["name"] == name
+        coords[atoms["res_idx"][sel]] = atoms["xyz"][sel]
+    return coords
+
+
+def chain_mask(atoms: dict, chainID: str) -> np.ndarray:
+
+    r"""
+    Gets a per-residue boolean mask selecting one chain.
+    :param atoms: the dictionary returned by read_atoms
+    :param chainID: chain identifier
+    :return: a boolean array indexed by res_idx
+    """
+
+    return residue_info(atoms)["chain"] == chainID
@@ -1,5 +1,5 @@
 import requests
-import os
+from workspace import get_workspace
 
 
 class PDBDownloader:
@@ -10,20 +10,53 @@ class PDBDownloader:
     Variables:
         self._host_url: the url of Protein Data Bank
         self._pdb_id: PDB ID
+        self._cache: an optional PDBCache. When given, IDs are validated and files are read through it
+        self._workspace: the Workspace the PDB file is written into
     """
 
     def __init__(
             self,
             host_url: str = "https://files.rcsb.org/view/",
+            session=None,
+            cache=None,
+            workspace=None
     ):
 
         r"""
         Object constructor.
         :param host_url: the url of Protein Data Bank
+        :param session: an optional requests.Session, so connections are reused across downloads
+        :param cache: an optional PDBCache shared across jobs
+        :param workspace: the Workspace of the job. Defaults to the current working directory
         """
 
         self._host_url = host_url
         self._pdb_id = ""
+        self._session = session if session is not None else requests
+        self._cache = cache
+        self._workspace = get_workspace(workspace)
+
+    def is_valid(self, pdbid: str) -> bool:
+
+        r"""
+        Checks whether a PDB ID exists without asking the user.
+        :param pdbid: PDB ID
+        :return: True if the PDB file can be downloaded
+        """
+
+        if self._cache is not None:
+            return self._cache.is_valid(pdbid)
+        return self._session.get(f"{self._host_url}{pdbid}.pdb").text.startswith("HEADER")
+
+    def set_pdb_id(self, pdbid: str):
+
+        r"""
+        Sets the PDB ID without asking the user.
+        :param pdbid: PDB ID
+        :return: N/A
+        """
+
+        self._pdb_id = pdbid
 
     def get_user_input(self) -> str:
 
@@ -33,10 +66,8 @@ class PDBDownloader:
         """
 
         pdbid = input("Please give your PDB ID: ")
-        url = f"{self._host_url}{pdbid}.pdb"
-        while not requests.get(url).text.startswith("HEADER"):
+        while not self.is_valid(pdbid):
             pdbid = input("PDB ID invalid. Please try again: ")
-            url = f"{self._host_url}{pdbid}.pdb"
         self._pdb_id = pdbid
         return pdbid
 
@@ -47,7 +78,10 @@ class PDBDownloader:
         :return: The path to which the PDB file is stored
         """
 
-        current_dir = os.getcwd()
-        with open(self._pdb_id + ".pdb", "w") as out:
-            out.write(requests.get(f"{self._host_url}{self._pdb_id}.pdb").text)
-        return os.path.join(current_dir, f"{self._pdb_id}.pdb")
\ No newline at end of file
+        PDB_path = self._workspace.pdb(self._pdb_id)
+        if self._cache is not None:
+            self._cache.fetch(self._pdb_id, PDB_path)
+            return PDB_path
+        with open(PDB_path, "w") as out:
+            out.write(self._session.get(f"{self._host_url}{self._pdb_id}.pdb").text)
+        return PDB_path
\ No newline at end of file
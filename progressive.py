@@ -0,0 +1,253 @@
+import json
+import os
+import time
+import numpy as np
+from filter_expr import compile_expr
+from output_writer import write_pairs, write_residues
+from residue_table import ResidueTable, iter_pairs
+
+
+class ProgressiveResults:
+
+    r"""
+    Class name: ProgressiveResults
+    Description: Publishes the candidate pairs of a job as soon as the structure-only annotations (DSSP, accessibility,
+                 coordinates) are known, and updates them as membrane topology and conservation arrive. Annotations
+                 that are not known yet keep their neutral defaults (mem "-", cons 0), which pass the filters, so the
+                 first list is a provisional superset of the final one.
+                 An update only re-evaluates the filter on the residues whose values changed and on the pairs that
+                 touch them. Residues that qualify for the first time are paired against the residues seen so far,
+                 so distances are never recomputed for the whole table.
+                 Every publication rewrites {prefix}_pairs.tsv and {prefix}_residues.tsv (through a temporary file, so
+                 readers never see a partial file) and {prefix}_progress.json with the stage, the version, whether
+                 the list is provisional and the annotations still pending.
+    Variables:
+        self.table: the ResidueTable being annotated
+        self.where: the residue filter expression
+        self.pair_where: an optional pair filter expression
+        self.prefix: path prefix of the published files
+        self.pending: the names of the annotations that have not arrived yet
+        self.version: the number of publications so far
+    """
+
+    def __init__(
+            self,
+            table: ResidueTable,
+            prefix: str,
+            where: str = None,
+            pair_where: str = None,
+            min_dist: float = 20.0,
+            max_dist: float = 50.0,
+            pending: list = ("mem", "cons")
+                 ):
+
+        r"""
+        Object constructor. Computes the initial residue mask and the candidate pairs.
+        :param table: the ResidueTable with the structure-only columns filled in
+        :param prefix: path prefix of the published files, e.g. "1abc"
+        :param where: the residue filter expression. Defaults to protein_seq.default_filter
+        :param pair_where: an optional pair filter expression
+        :param min_dist: smallest pair distance in Angstrom
+        :param max_dist: largest pair distance in Angstrom
+        :param pending: the annotations that will arrive later
+        """
+
+        if where is None:
+            from protein_seq import default_filter
+            where = default_filter
+        self._table = table
+        self._prefix = prefix
+        self._where = compile_expr(where)
+        self._pair_where = compile_expr(pair_where) if pair_where else None
+        self._min_dist = min_dist
+        self._max_dist = max_dist
+        self._pending = list(pending)
+        self._version = 0
+
+        self._mask = self._where.mask(table).copy()
+        # Residues that have been paired: candidate pairs exist for every pair of seen residues in the distance window
+        self._seen = self._mask.copy()
+        chunks = list(iter_pairs(table, mask=self._seen, min_dist=min_dist, max_dist=max_dist))
+        self._pairs = {key: np.concatenate([c[key] for c in chunks]) if chunks else np.zeros(0, dtype=dtype)
+                       for key, dtype in (("i", np.int64), ("j", np.int64), ("dist", np.float32))}
+        self._keep = self._pair_mask(np.arange(len(self._pairs["i"])))
+
+    def get_table(self) -> ResidueTable:
+
+        r"""
+        Returns table.
+        :return: table
+        """
+
+        return self._table
+
+    def get_pending(self) -> list:
+
+        r"""
+        Returns pending.
+        :return: the annotations that have not arrived yet
+        """
+
+        return list(self._pending)
+
+    def get_version(self) -> int:
+
+        r"""
+        Returns version.
+        :return: the number of publications so far
+        """
+
+        return self._version
+
+    def is_provisional(self) -> bool:
+
+        r"""
+        Checks whether annotations are still pending.
+        :return: True if the pair list may still shrink or grow
+        """
+
+        return bool(self._pending)
+
+    def get_pairs(self) -> dict:
+
+        r"""
+        Returns the current candidate pairs.
+        :return: a dictionary with columns "i", "j" and "dist"
+        """
+
+        return {key: values[self._keep] for key, values in self._pairs.items()}
+
+    def _pair_mask(self, idx: np.ndarray) -> np.ndarray:
+
+        r"""
+        Evaluates the residue mask of both ends and the pair filter for some of the candidate pairs.
+        :param idx: indices into the candidate pairs
+        :return: a boolean array, one value per index
+        """
+
+        i, j = self._pairs["i"][idx], self._pairs["j"][idx]
+        keep = self._mask[i] & self._mask[j]
+        if self._pair_where is not None and len(idx):
+            keep &= self._pair_where.mask(self._table, {"i": i, "j": j, "dist": self._pairs["dist"][idx]})
+        return keep
+
+    def _add_rows(self, rows: np.ndarray):
+
+        r"""
+        Adds the candidate pairs of residues that qualify for the first time, pairing them with every residue seen so
+        far and with each other.
+        :param rows: row indices of the new residues
+        :return: N/A
+        """
+
+        coords = self._table.get_coords().astype(np.float64)
+        self._seen[rows] = True
+        others = np.flatnonzero(self._seen)
+        lo2, hi2 = self._min_dist ** 2, self._max_dist ** 2
+        new_i, new_j, new_d = [], [], []
+        for start in range(0, len(rows), 1024):
+            block = rows[start:start + 1024]
+            diff = coords[block, None, :] - coords[None, others, :]
+            d2 = np.einsum("abk,abk->ab", diff, diff)
+            keep = (d2 >= lo2) & (d2 <= hi2)
+            # A pair of two new residues is found twice; keep it once
+            keep &= ~(np.isin(others, rows)[None, :] & (others[None, :] <= block[:, None]))
+            a, b = np.nonzero(keep)
+            new_i.append(np.minimum(block[a], others[b]))
+            new_j.append(np.maximum(block[a], others[b]))
+            new_d.append(np.sqrt(d2[a, b]).astype(np.float32))
+        first = len(self._pairs["i"])
+        for key, values in (("i", new_i), ("j", new_j), ("dist", new_d)):
+            self._pairs[key] = np.concatenate([self._pairs[key]] + values)
+        self._keep = np.concatenate((self._keep, self._pair_mask(np.arange(first, len(self._pairs["i"])))))
+
+    def update(self, name: str, values, stage: str = None) -> int:
+
+        r"""
+        Sets an annotation column and updates the residue mask and the candidate pairs for the changed residues only.
+        :param name: column name, e.g. "mem" or "cons"
+        :param values: the new column, one value per residue
+        :param stage: the annotation this update completes, removed from pending. Defaults to name
+        :return: the number of residues whose value changed
+        """
+
+        values = np.asarray(values)
+        old = self._table.get_column(name) if self._table.has_column(name) else None
+        if old is None or old.shape != values.shape:
+            changed = np.arange(len(values))
+        else:
+            same = old == values
+            if values.dtype.kind == "f":
+                same |= np.isnan(old) & np.isnan(values)
+            changed = np.flatnonzero(~same)
+        self._table.set_column(name, values.astype(old.dtype) if old is not None else values)
+        pending = stage if stage is not None else name
+        if pending in self._pending:
+            self._pending.remove(pending)
+        if len(changed) == 0:
+            return 0
+
+        sub = ResidueTable(self._table.get_pdb_id(), self._table.take(changed))
+        self._mask[changed] = self._where.mask(sub)
+
+        touched = np.zeros(self._table.get_length(), dtype=bool)
+        touched[changed] = True
+        affected = np.flatnonzero(touched[self._pairs["i"]] | touched[self._pairs["j"]])
+        self._keep[affected] = self._pair_mask(affected)
+
+        new_rows = changed[self._mask[changed] & ~self._seen[changed]]
+        if len(new_rows):
+            self._add_rows(new_rows)
+        return len(changed)
+
+    def resolve(self, stage: str):
+
+        r"""
+        Marks a pending annotation as no longer expected, e.g. when its stage was skipped because no candidate pair can
+        depend on it.
+        :param stage: the name of the annotation
+        :return: N/A
+        """
+
+        if stage in self._pending:
+            self._pending.remove(stage)
+
+    def update_from_protein(self, protein, name: str, stage: str = None) -> int:
+
+        r"""
+        Copies an annotation from a Protein object, whose residues are in the order of the table built by
+        ResidueTable.from_protein.
+        :param protein: the Protein
+        :param name: "mem", "cons", "solex", "rsa" or "secstruct"
+        :param stage: the annotation this update completes. Defaults to name
+        :return: the number of residues whose value changed
+        """
+
+        getter = f"get_{name}"
+        values = [getattr(aa, getter)() for chainID in protein.get_chain_ids() for aa in protein.get_chain(chainID)]
+        if name in ("mem", "secstruct"):
+            values = [v or "-" for v in values]
+        return self.update(name, values, stage)
+
+    def publish(self, stage: str) -> dict:
+
+        r"""
+        Writes the current residues and pairs and the progress file.
+        :param stage: the name of the stage that just finished
+        :return: the progress information
+        """
+
+        self._version += 1
+        pairs = self.get_pairs()
+        for suffix, write in (("residues", lambda path: write_residues(path, self._table)),
+                              ("pairs", lambda path: write_pairs(path, self._table, [pairs]))):
+            path = f"{self._prefix}_{suffix}.tsv"
+            write(f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+        progress = {"stage": stage, "version": self._version, "provisional": self.is_provisional(),
+                    "pending": self.get_pending(), "n_pairs": int(len(pairs["i"])),
+                    "n_residues": int(self._mask.sum()), "updated": time.time()}
+        with open(f"{self._prefix}_progress.json.tmp", "w") as out:
+            json.dump(progress, out)
+        os.replace(f"{self._prefix}_progress.json.tmp", f"{self._prefix}_progress.json")
+        return progress
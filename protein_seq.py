@@ -1,5 +1,10 @@
+import os
+import sys
 from amino_acid import AminoAcid
-from Bio import PDB
+from workspace import get_workspace
+
+# The residue criteria used when no filter expression is given (see filter_expr.py)
+default_filter = 'secstruct in "HBEGITS" and mem != "M" and cons < 7'
 
 
 class Protein:
@@ -10,18 +15,21 @@ class Protein:
     Variables:
         self.pdb_id: PDB ID of the protein
         self.seqdict: A dictionary with keys being chain ids and values being lists of AminoAcids.
+        self.workspace: the Workspace the input and output files of the protein are resolved in
     """
 
-    def __init__(self, pdb_id: str):
+    def __init__(self, pdb_id: str, workspace=None):
 
         r"""
         Object constructor.
         :param pdb_id: PDB ID of the protein
+        :param workspace: the Workspace of the job. Defaults to the current working directory
         """
 
         self._pdb_id = pdb_id
         self._seqdict = {}
-        with open(f"{self._pdb_id}.pdb", "r") as file:
+        self._workspace = get_workspace(workspace)
+        with open(self._workspace.pdb(self._pdb_id), "r") as file:
             line = file.readline()
             while not line.startswith("ATOM"):
                 line = file.readline()
@@ -37,6 +45,43 @@ class Protein:
                 if line.startswith("TER"):
                     line = file.readline()
 
+    def get_pdb_id(self) -> str:
+
+        r"""
+        Returns pdb_id.
+        :return: pdb_id
+        """
+
+        return self._pdb_id
+
+    def get_workspace(self):
+
+        r"""
+        Returns workspace.
+        :return: workspace
+        """
+
+        return self._workspace
+
+    def get_chain_ids(self) -> list:
+
+        r"""
+        Returns the chain identifiers in the order they appear in the PDB file.
+        :return: a list of chain identifiers
+        """
+
+        return list(self._seqdict)
+
+    def get_chain(self, chainID: str) -> list:
+
+        r"""
+        Returns the AminoAcids of one chain.
+        :param chainID: chain identifier
+        :return: a list of AminoAcids
+        """
+
+        return self._seqdict[chainID]
+
     def get_seq(self, chainID: str):
         str = ""
         for i in self._seqdict[chainID]:
@@ -47,21 +92,33 @@ class Protein:
         seq = ""
         for i in self._seqdict[chainID]:
             seq += i.get_aa()
-        with open(f"{self._pdb_id}_{chainID}_SEQ.fasta", "w") as f:
+        with open(self._workspace.seq_fasta(self._pdb_id, chainID), "w") as f:
             f.write(f">{self._pdb_id}\n")
             f.write(seq)
 
+    def get_seqs(self, chains: list = None) -> dict:
+
+        r"""
+        Returns the sequences of some chains, keyed the way topcons_runner.run_topcons_batch expects.
+        :param chains: chain identifiers. Defaults to all chains
+        :return: a dictionary from (pdb_id, chainID) to the amino acid sequence
+        """
+
+        return {(self._pdb_id, chainID): self.get_seq(chainID)
+                for chainID in (chains if chains is not None else self._seqdict)}
+
     def display(self):
 
         r"""
         Print the Protein object
         :return: N/A
         """
-        print("ORDER | CHAINID | NAME | MEM | SOLEX | CONS | SECSTRUCT")
-
+        lines = ["ORDER | CHAINID | NAME | MEM | SOLEX | CONS | SECSTRUCT"]
         for i in self._seqdict:
-            for j in self._seqdict[i]:
-                j.aa_display()
+            lines.extend(j.aa_str() for j in self._seqdict[i])
+
+        # One write for the whole table instead of one print per residue
+        sys.stdout.write("\n".join(lines) + "\n")
 
     def get_length(self) -> int:
 
@@ -88,65 +145,138 @@ class Protein:
     def check_dssp(self):
 
         r"""
-        Reads the .dssp file and sets secondary structures for each AminoAcid.
+        Reads the .dssp file and sets secondary structures and accessibility for each AminoAcid. The other DSSP fields
+        (phi/psi, H-bond partners, chain breaks, ...) are joined onto a ResidueTable with result_parsers.add_dssp.
         :return: N/A
         """
 
-        with open(f"{self._pdb_id}.dssp", "r") as file:
-            line = file.readline()
-            while not line.startswith("  #  RESIDUE AA STRUCTURE"):
-                line = file.readline()
-            line = file.readline()
-            while line != "":
-                chainID = line.split()[2]
-                idx = 0
-                while line != "" and line.split()[2] == chainID:
-                    self._seqdict[line.split()[2]][idx].set_solex(int(line[35:38].replace(" ", "")))
-                    if line.split()[4] in "HBEGITS":
-                        self._seqdict[line.split()[2]][idx].set_secstruct(line.split()[4])
-                    else:
-                        self._seqdict[line.split()[2]][idx].set_secstruct("n")
-                    idx += 1
-                    line = file.readline()
-                if line != "":
-                    line = file.readline()
-                else:
-                    break
+        import numpy as np
+        from result_parsers import match_rows, read_dssp
 
-    def check_mem(self, chainID: str):
+        dssp = read_dssp(self._workspace.dssp(self._pdb_id))
+        residues = [aa for chainID in self._seqdict for aa in self._seqdict[chainID]]
+        # Residues are matched by chain and number, so missing residues and chain breaks cannot shift the others
+        rows = match_rows([aa.get_chain_id() for aa in residues], [aa.get_num() for aa in residues],
+                          dssp["chain"], dssp["num"])
+        solex, secstruct = np.nan_to_num(dssp["solex"]).astype(int).tolist(), dssp["secstruct"].tolist()
+        for aa, k in zip(residues, rows.tolist()):
+            if k >= 0:
+                aa.set_solex(solex[k])
+                aa.set_secstruct(secstruct[k])
+
+    def check_sasa(self, processes: int = None, set_solex: bool = True):
 
         r"""
-        TO BE COMPLETED
-        Sets membrane affiliation for each AminoAcid
+        Computes solvent accessibility locally from the PDB file and sets solex (Angstrom^2, rounded like the DSSP ACC
+        column) and rsa for each AminoAcid. Can be used instead of the ACC values read by check_dssp.
+        :param processes: the number of worker processes, passed to sasa.atom_sasa
+        :param set_solex: also overwrite solex; set to False to keep the values read by check_dssp
         :return: N/A
         """
 
-        with open(f"{self._pdb_id}_{chainID}_MEM.txt", "r") as file:
-            line = file.readline()
-            while not line.startswith("TOPCONS predicted topology"):
-                line = file.readline()
-            line = file.readline().strip()
-            for i in range(len(line)):
-                self._seqdict[chainID][i].set_mem(line[i])
+        from sasa import pdb_sasa
+
+        accessibility = pdb_sasa(self._workspace.pdb(self._pdb_id), processes=processes)
+        for i in self._seqdict:
+            for j in self._seqdict[i]:
+                absolute, relative = accessibility.get((i, j.get_num()), (0.0, 0.0))
+                if set_solex:
+                    j.set_solex(int(round(absolute)))
+                j.set_rsa(relative)
 
-    def check_cons(self, chianID: str):
+    def check_mem(self, chainID: str):
 
         r"""
-        TO BE COMPLETED
-        Sets conservation scores for each AminoAcid
+        Reads the TOPCONS result of a chain and sets membrane affiliation for each AminoAcid.
+        :param chainID: chain identifier
         :return: N/A
         """
 
-        return 0
+        from result_parsers import read_topcons
 
-    def result(self) -> str:
+        topology = read_topcons(self._workspace.mem(self._pdb_id, chainID))[0]["topology"] or ""
+        for aa, mem in zip(self._seqdict[chainID], topology):
+            aa.set_mem(mem)
+
+    def check_cons(self, chainID: str):
 
         r"""
-        Display all information in the Protein in a text file.
+        Reads the consurf.grades file downloaded by ConsurfRunner and sets the conservation grade (1 variable to
+        9 conserved) of each AminoAcid. Residues are matched through the 3LATOM column (e.g. ALA12:A); positions
+        without a structure residue are skipped, and grades flagged with * (too little data) are kept as they are.
+        :param chainID: chain identifier
+        :return: the number of residues that received a grade
+        """
+
+        import re
+
+        file_name = self._workspace.cons(self._pdb_id, chainID)
+        if not os.path.isfile(file_name):
+            file_name = self._workspace.cons(self._pdb_id)
+        residues = {aa.get_num(): aa for aa in self._seqdict[chainID]}
+        atom = re.compile(r"[A-Z]{3}(-?\d+)[A-Z]?:(\S)")
+        count = 0
+        with open(file_name, "r") as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) < 5 or not fields[0].isdigit():
+                    continue
+                m = atom.fullmatch(fields[2])
+                if m is None or m.group(2) != chainID:
+                    continue
+                aa = residues.get(int(m.group(1)))
+                if aa is not None:
+                    aa.set_cons(int(fields[4].rstrip("*")))
+                    count += 1
+        return count
+
+    def to_table(self):
+
+        r"""
+        Builds a column-oriented ResidueTable of the Protein, with coordinates read from the PDB file.
+        :return: a ResidueTable
+        """
+
+        from residue_table import ResidueTable
+        return ResidueTable.from_protein(self)
+
+    def qualified_mask(self, table, where: str = None):
+
+        r"""
+        Selects the residues that satisfy the criteria: found on secondary structure, not affiliated to membrane and not
+        conserved (ConSurf grade below 7). Annotations that have not been read yet keep their defaults, which pass.
+        :param table: the ResidueTable of the Protein
+        :param where: an optional filter expression (see filter_expr.py) replacing the default criteria
+        :return: a boolean array with one value per residue
+        """
+
+        from filter_expr import compile_expr
+        return compile_expr(where if where is not None else default_filter).mask(table)
+
+    def result(self, store=None, job_id: str = None, min_dist: float = 20.0, max_dist: float = 50.0) -> str:
+
+        r"""
+        Display all information in the Protein in a text file. Optionally also records the residues and the candidate
+        pairs in a ResultStore, so they can be queried together with other jobs.
+        :param store: an optional ResultStore
+        :param job_id: job id used in the store. Defaults to the PDB ID.
+        :param min_dist: smallest distance of a candidate pair in Angstrom
+        :param max_dist: largest distance of a candidate pair in Angstrom
         :return: the path to which the file is stored
         """
 
-        with open(f"{self._pdb_id}_SUMMARY.txt", "w") as out:
-            out.write("")
+        out_name = self._workspace.summary(self._pdb_id)
+        with open(out_name, "w") as out:
+            out.write("ORDER\tCHAINID\tNAME\tMEM\tSOLEX\tCONS\tSECSTRUCT\n")
+            for i in self._seqdict:
+                for j in self._seqdict[i]:
+                    out.write(f"{j.get_num()}\t{i}\t{j.get_aa()}\t{j.get_mem()}\t{j.get_solex()}\t"
+                              f"{j.get_cons()}\t{j.get_secstruct()}\n")
+
+        if store is not None:
+            from residue_table import find_pairs
+            table = self.to_table()
+            pairs = find_pairs(table, mask=self.qualified_mask(table), min_dist=min_dist, max_dist=max_dist)
+            store.add_job(job_id if job_id else self._pdb_id, table, pairs)
 
-        return ""
+        return out_name
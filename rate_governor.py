@@ -0,0 +1,376 @@
+import contextlib
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import weakref
+from urllib.parse import urlparse
+import requests
+
+
+r"""
+Per-host rate governor. Every remote host gets one HostGovernor per process: a token bucket that caps requests per
+second, a cap on requests in flight, and a waiting line ordered by priority, so interactive jobs are served before
+batch jobs when both wait for the same host. With a lock directory the bucket lives in a file guarded by fcntl.flock
+and is shared by every process on the machine.
+
+Requests made through a GovernedSession are governed automatically; runners accept it as their session. The priority
+of the current thread is set with
+    with priority(INTERACTIVE):
+        ...
+"""
+
+INTERACTIVE = 0
+NORMAL = 5
+BATCH = 10
+
+# Limits per host: requests per second, burst size and requests in flight. Other hosts get the "default" entry.
+host_limits = {
+    "default": {"rate": 5.0, "burst": 10, "max_in_flight": 8},
+    "files.rcsb.org": {"rate": 10.0, "burst": 20, "max_in_flight": 8},
+    "data.rcsb.org": {"rate": 5.0, "burst": 10, "max_in_flight": 4},
+    "a3m.mmseqs.com": {"rate": 0.5, "burst": 2, "max_in_flight": 2},
+    "www3.cmbi.umcn.nl": {"rate": 2.0, "burst": 4, "max_in_flight": 4},
+    "www.ebi.ac.uk": {"rate": 5.0, "burst": 10, "max_in_flight": 10},
+    "topcons.cbr.su.se": {"rate": 0.5, "burst": 2, "max_in_flight": 2},
+    "consurf.tau.ac.il": {"rate": 0.5, "burst": 2, "max_in_flight": 2},
+}
+
+_priority = contextvars.ContextVar("priority", default=NORMAL)
+_governors = {}
+_registry_lock = threading.Lock()
+_lock_dir = None
+
+
+@contextlib.contextmanager
+def priority(level: int):
+
+    r"""
+    Sets the priority of the requests made by the current thread (lower is served first).
+    :param level: INTERACTIVE, NORMAL, BATCH or any integer
+    :return: a context manager
+    """
+
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def get_priority() -> int:
+
+    r"""
+    Returns the priority of the current thread.
+    :return: the priority
+    """
+
+    return _priority.get()
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class HostGovernor:
+
+    r"""
+    Class name: HostGovernor
+    Description: Admits requests to one host. A request is admitted when it is first in the local waiting line, no
+                 waiter of another process has a better priority, fewer than max_in_flight requests are running and a
+                 token is available. Tokens refill at rate per second up to burst.
+    Variables:
+        self.host: the host name
+        self.rate: tokens added per second
+        self.burst: the largest number of tokens
+        self.max_in_flight: the largest number of requests running at the same time
+        self.lock_path: the state file shared between processes, or None for a process-local bucket
+    """
+
+    def __init__(self, host: str, rate: float = 5.0, burst: int = 10, max_in_flight: int = 8, lock_dir: str = None):
+
+        r"""
+        Object constructor.
+        :param host: the host name
+        :param rate: tokens added per second
+        :param burst: the largest number of tokens
+        :param max_in_flight: the largest number of requests running at the same time
+        :param lock_dir: a directory for the shared state file; None keeps the state in this process
+        """
+
+        self._host = host
+        self._rate = rate
+        self._burst = burst
+        self._max_in_flight = max_in_flight
+        self._lock_path = os.path.join(lock_dir, f"{host}.governor") if lock_dir else None
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+        self._state = self._new_state()
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._counter = itertools.count()
+
+    def get_host(self) -> str:
+
+        r"""
+        Returns host.
+        :return: host
+        """
+
+        return self._host
+
+    def _new_state(self) -> dict:
+        return {"tokens": float(self._burst), "last": time.time(), "blocked_until": 0.0, "in_flight": {},
+                "waiting": {}}
+
+    def _update(self, change):
+
+        r"""
+        Applies a change to the bucket state, under an exclusive file lock when the state is shared.
+        :param change: a function that modifies the state dictionary and returns a value
+        :return: the value returned by change
+        """
+
+        if self._lock_path is None:
+            return change(self._state)
+        import fcntl
+        with open(self._lock_path, "a+") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                file.seek(0)
+                try:
+                    state = json.loads(file.read())
+                except ValueError:
+                    state = self._new_state()
+                # Forget processes that exited without releasing
+                for key in ("in_flight", "waiting"):
+                    state[key] = {pid: v for pid, v in state[key].items() if _alive(int(pid))}
+                result = change(state)
+                file.seek(0)
+                file.truncate()
+                file.write(json.dumps(state))
+                file.flush()
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+        return result
+
+    def _try_grant(self, level: int):
+
+        r"""
+        Tries to admit one request.
+        :param level: the priority of the request
+        :return: (True, 0) if admitted, otherwise (False, seconds to wait before trying again)
+        """
+
+        pid = str(os.getpid())
+
+        def change(state):
+            now = time.time()
+            state["tokens"] = min(self._burst, state["tokens"] + (now - state["last"]) * self._rate)
+            state["last"] = now
+            others = [v for p, v in state["waiting"].items() if p != pid]
+            wait = None
+            if now < state["blocked_until"]:
+                wait = state["blocked_until"] - now
+            elif sum(state["in_flight"].values()) >= self._max_in_flight:
+                wait = 0.05
+            elif others and min(others) < level:
+                wait = 0.05
+            elif state["tokens"] < 1:
+                wait = (1 - state["tokens"]) / self._rate
+            if wait is not None:
+                state["waiting"][pid] = level
+                return False, wait
+            state["tokens"] -= 1
+            state["in_flight"][pid] = state["in_flight"].get(pid, 0) + 1
+            state["waiting"].pop(pid, None)
+            return True, 0.0
+
+        return self._update(change)
+
+    def acquire(self, level: int = None):
+
+        r"""
+        Waits until a request to the host is admitted. Call release when the request has finished.
+        :param level: the priority; defaults to the priority of the current thread
+        :return: N/A
+        """
+
+        level = get_priority() if level is None else level
+        ticket = (level, next(self._counter))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    if self._waiting[0] == ticket:
+                        granted, wait = self._try_grant(level)
+                        if granted:
+                            return
+                    else:
+                        wait = 0.05
+                    self._cond.wait(timeout=min(max(wait, 0.005), 1.0))
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def release(self):
+
+        r"""
+        Marks one admitted request as finished.
+        :return: N/A
+        """
+
+        pid = str(os.getpid())
+
+        def change(state):
+            state["in_flight"][pid] = max(0, state["in_flight"].get(pid, 0) - 1)
+            if not state["in_flight"][pid]:
+                del state["in_flight"][pid]
+
+        with self._cond:
+            self._update(change)
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, level: int = None):
+
+        r"""
+        Holds an admitted request for the duration of a with block.
+        :param level: the priority; defaults to the priority of the current thread
+        :return: a context manager
+        """
+
+        self.acquire(level)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def penalize(self, seconds: float):
+
+        r"""
+        Stops admitting requests for a while, e.g. after the host answered 429 or RATELIMIT.
+        :param seconds: the pause
+        :return: N/A
+        """
+
+        def change(state):
+            state["blocked_until"] = max(state["blocked_until"], time.time() + seconds)
+            state["tokens"] = 0.0
+
+        self._update(change)
+
+
+def configure(lock_dir: str = None, **limits):
+
+    r"""
+    Sets the lock directory used by governors created from now on, and overrides the limits of some hosts.
+    :param lock_dir: a directory for state files shared between processes, or None for process-local governors
+    :param limits: host name to a dictionary with any of rate, burst, max_in_flight
+    :return: N/A
+    """
+
+    global _lock_dir
+    with _registry_lock:
+        _lock_dir = lock_dir
+        for host, values in limits.items():
+            host_limits[host] = {**host_limits.get(host, host_limits["default"]), **values}
+            _governors.pop(host, None)
+
+
+def get_governor(url: str) -> HostGovernor:
+
+    r"""
+    Returns the governor of the host of a URL, creating it on first use.
+    :param url: a URL or a host name
+    :return: the HostGovernor
+    """
+
+    host = urlparse(url).netloc if "://" in url else url
+    host = host.split("@")[-1]
+    with _registry_lock:
+        if host not in _governors:
+            limits = host_limits.get(host.split(":")[0], host_limits["default"])
+            _governors[host] = HostGovernor(host, lock_dir=_lock_dir, **limits)
+        return _governors[host]
+
+
+def _release_on_close(response, governor):
+
+    r"""
+    Releases the governor slot of a streamed response once, when the response is closed or garbage collected.
+    :param response: a requests.Response
+    :param governor: the HostGovernor the slot was taken from
+    :return: N/A
+    """
+
+    released = threading.Lock()
+
+    def release():
+        if released.acquire(blocking=False):
+            governor.release()
+
+    # The wrapper lives on the response, so it must not hold the response (or its bound close) strongly: that would
+    # be a reference cycle and the finalizer would wait for the cyclic garbage collector
+    ref = weakref.ref(response)
+
+    def close_and_release():
+        try:
+            owner = ref()
+            if owner is not None:
+                type(owner).close(owner)
+        finally:
+            release()
+
+    response.close = close_and_release
+    weakref.finalize(response, release)
+
+
+class GovernedSession(requests.Session):
+
+    r"""
+    Class name: GovernedSession
+    Description: A requests.Session that waits for the governor of the host before every request and pauses the host
+                 when it answers 429. Streamed responses (stream=True) keep their slot until they are closed.
+    Variables:
+        self.default_pause: seconds a host is paused after a 429 without a Retry-After header
+    """
+
+    def __init__(self, default_pause: float = 30.0):
+
+        r"""
+        Object constructor.
+        :param default_pause: seconds a host is paused after a 429 without a Retry-After header
+        """
+
+        super().__init__()
+        self.default_pause = default_pause
+
+    def request(self, method, url, *args, **kwargs):
+        governor = get_governor(url)
+        governor.acquire()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except BaseException:
+            governor.release()
+            raise
+        if kwargs.get("stream"):
+            # The body of a streamed response is read after this returns: the slot is held until the response is
+            # closed (or garbage collected), so max_in_flight also limits long downloads
+            _release_on_close(response, governor)
+        else:
+            governor.release()
+        if response.status_code == 429:
+            retry_after = response.headers.get("Retry-After", "")
+            governor.penalize(float(retry_after) if retry_after.isdigit() else self.default_pause)
+        return response
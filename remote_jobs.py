@@ -0,0 +1,419 @@
+import argparse
+import hashlib
+import json
+import os
+import tarfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+
+r"""
+Detached remote jobs. Instead of blocking until a server finishes, a runner can submit its job and return a JobHandle:
+a small JSON-serializable record of the service, the remote job id, where to ask for the status and the result, where
+the result should be written and hashes of the inputs. Handles are saved in a HandleStore on disk, and a separate
+Collector polls every outstanding handle and downloads results when they are ready, so one process can keep hundreds
+of remote jobs in flight and nothing is lost when the submitting process exits.
+
+Usage:
+    python remote_jobs.py list --root remote_jobs
+    python remote_jobs.py collect --root remote_jobs --interval 60
+"""
+
+
+def file_hash(path: str) -> str:
+
+    r"""
+    Computes the SHA-1 of a file, used to recognise inputs that were already submitted.
+    :param path: the file
+    :return: the hex digest
+    """
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_hash(text: str) -> str:
+
+    r"""
+    Computes the SHA-1 of a string.
+    :param text: the string
+    :return: the hex digest
+    """
+
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class JobHandle:
+
+    r"""
+    Class name: JobHandle
+    Description: A serializable record of one job submitted to a remote server.
+    Variables:
+        self.handle_id: local id of the handle
+        self.service: "xssp", "mmseqs" or "consurf"; selects how the Collector checks and fetches the job
+        self.remote_id: the id given by the server
+        self.status_url: where the status is asked for (None if the service has no status endpoint)
+        self.result_url: where the result is downloaded from
+        self.output: the absolute path the result is written to
+        self.inputs: a dictionary from input name to SHA-1 of the input
+        self.state: "pending", "done" or "failed"
+        self.submitted: submission time
+        self.checks: the number of status checks so far
+        self.last_checked: time of the last status check
+        self.finished: the time the result was written or the job failed
+        self.error: the reason of a failure
+    """
+
+    def __init__(
+            self,
+            service: str,
+            remote_id: str,
+            result_url: str,
+            output: str,
+            status_url: str = None,
+            inputs: dict = None
+                 ):
+
+        r"""
+        Object constructor.
+        :param service: "xssp", "mmseqs" or "consurf"
+        :param remote_id: the id given by the server
+        :param result_url: where the result is downloaded from
+        :param output: the path the result is written to
+        :param status_url: where the status is asked for
+        :param inputs: a dictionary from input name to SHA-1 of the input
+        """
+
+        self.handle_id = uuid.uuid4().hex
+        self.service = service
+        self.remote_id = remote_id
+        self.status_url = status_url
+        self.result_url = result_url
+        self.output = os.path.abspath(output)
+        self.inputs = dict(inputs or {})
+        self.state = "pending"
+        self.submitted = time.time()
+        self.checks = 0
+        self.last_checked = None
+        self.finished = None
+        self.error = None
+
+    def to_dict(self) -> dict:
+
+        r"""
+        Converts the handle into a JSON-serializable dictionary.
+        :return: the dictionary
+        """
+
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data: dict):
+
+        r"""
+        Rebuilds a handle saved with to_dict.
+        :param data: the dictionary
+        :return: a JobHandle
+        """
+
+        handle = cls.__new__(cls)
+        handle.__dict__.update(data)
+        return handle
+
+
+class HandleStore:
+
+    r"""
+    Class name: HandleStore
+    Description: Keeps job handles on disk, one JSON file per handle in pending/, done/ or failed/. Files are replaced
+                 atomically, so a collector and submitting processes can share the directory.
+    Variables:
+        self.root: the directory of the store
+    """
+
+    states = ("pending", "done", "failed")
+
+    def __init__(self, root: str = "remote_jobs"):
+
+        r"""
+        Object constructor.
+        :param root: the directory of the store
+        """
+
+        self._root = os.path.abspath(root)
+        for state in self.states:
+            os.makedirs(os.path.join(self._root, state), exist_ok=True)
+
+    def get_root(self) -> str:
+
+        r"""
+        Returns root.
+        :return: root
+        """
+
+        return self._root
+
+    def _path(self, state: str, handle_id: str) -> str:
+        return os.path.join(self._root, state, f"{handle_id}.json")
+
+    def save(self, handle: JobHandle) -> JobHandle:
+
+        r"""
+        Writes a handle into the directory of its state and removes it from the others.
+        :param handle: the JobHandle
+        :return: the handle
+        """
+
+        path = self._path(handle.state, handle.handle_id)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as out:
+            json.dump(handle.to_dict(), out)
+        os.replace(tmp, path)
+        for state in self.states:
+            if state != handle.state:
+                try:
+                    os.remove(self._path(state, handle.handle_id))
+                except FileNotFoundError:
+                    pass
+        return handle
+
+    def load(self, state: str = "pending") -> list:
+
+        r"""
+        Reads all handles in one state.
+        :param state: "pending", "done" or "failed"
+        :return: a list of JobHandles, oldest first
+        """
+
+        handles = []
+        directory = os.path.join(self._root, state)
+        for name in os.listdir(directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, name), "r") as file:
+                    handles.append(JobHandle.from_dict(json.load(file)))
+            except (OSError, ValueError):
+                # Moved or being replaced by another process
+                continue
+        return sorted(handles, key=lambda h: h.submitted)
+
+    def find(self, service: str, inputs: dict):
+
+        r"""
+        Looks for a pending or finished handle of the same service with the same inputs, so a job is not submitted
+        twice.
+        :param service: service name
+        :param inputs: a dictionary from input name to SHA-1
+        :return: the JobHandle, or None
+        """
+
+        for state in ("done", "pending"):
+            for handle in self.load(state):
+                if handle.service == service and handle.inputs == inputs:
+                    return handle
+        return None
+
+
+class Collector:
+
+    r"""
+    Class name: Collector
+    Description: Polls all pending handles of a HandleStore and downloads the results of finished jobs. Status checks
+                 run concurrently on a small thread pool, so one polling round over hundreds of handles takes about as
+                 long as the slowest server answer.
+    Variables:
+        self.store: the HandleStore
+        self.session: the requests.Session used for all requests
+        self.max_workers: the number of concurrent requests
+        self.max_age: handles older than this (seconds) are marked failed
+    """
+
+    def __init__(self, store: HandleStore, session=None, max_workers: int = 8, max_age: float = 7 * 86400):
+
+        r"""
+        Object constructor.
+        :param store: the HandleStore
+        :param session: an optional requests.Session. Defaults to a rate_governor.GovernedSession, so polling many
+                        handles stays within the limits of each host
+        :param max_workers: the number of concurrent requests
+        :param max_age: handles older than this (seconds) are marked failed
+        """
+
+        self._store = store
+        if session is None:
+            from rate_governor import GovernedSession
+            session = GovernedSession()
+        self._session = session
+        self._max_workers = max_workers
+        self._max_age = max_age
+
+    def _check_xssp(self, handle: JobHandle) -> str:
+        r = self._session.get(handle.status_url)
+        r.raise_for_status()
+        try:
+            status = r.json()
+        except ValueError:
+            # An error page instead of the status: ask again next round
+            return "pending"
+        if status["status"] in ("FAILURE", "REVOKED"):
+            raise RuntimeError(status.get("message", status["status"]))
+        return "ready" if status["status"] == "SUCCESS" else "pending"
+
+    def _fetch_xssp(self, handle: JobHandle, out):
+        r = self._session.get(handle.result_url)
+        r.raise_for_status()
+        out.write(r.json()["result"].encode())
+
+    def _check_mmseqs(self, handle: JobHandle) -> str:
+        r = self._session.get(handle.status_url)
+        r.raise_for_status()
+        try:
+            status = r.json().get("status", "UNKNOWN")
+        except ValueError:
+            # An error page instead of the status: ask again next round
+            return "pending"
+        if status == "ERROR":
+            raise RuntimeError("MMseqs2 job failed.")
+        return "ready" if status == "COMPLETE" else "pending"
+
+    def _fetch_mmseqs(self, handle: JobHandle, out):
+        with self._session.get(handle.result_url, stream=True) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            with tarfile.open(fileobj=r.raw, mode="r|gz") as tar:
+                for member in tar:
+                    if os.path.basename(member.name) == "uniref.a3m":
+                        with tar.extractfile(member) as a3m:
+                            for block in iter(lambda: a3m.read(1 << 20), b""):
+                                out.write(block)
+                        return
+        raise RuntimeError("uniref.a3m not found in the MMseqs2 result.")
+
+    def _check_consurf(self, handle: JobHandle) -> str:
+        # ConSurf has no status endpoint; the grades file appears when the job is done. Its certificate does not
+        # verify, so the result is fetched with verify=False as in ConsurfRunner.run_job.
+        r = self._session.get(handle.result_url, verify=False)
+        return "ready" if r.status_code == 200 and "SEQ" in r.text and "SCORE" in r.text else "pending"
+
+    def _fetch_consurf(self, handle: JobHandle, out):
+        r = self._session.get(handle.result_url, verify=False)
+        r.raise_for_status()
+        out.write(r.content)
+
+    def _retry(self, handle: JobHandle, error: str) -> str:
+
+        r"""
+        Leaves a handle pending for the next round, or marks it failed once it is older than max_age.
+        :param handle: the JobHandle
+        :param error: the error recorded if the handle fails
+        :return: the new state of the handle
+        """
+
+        if time.time() - handle.submitted > self._max_age:
+            handle.state = "failed"
+            handle.error = error
+            handle.finished = time.time()
+        self._store.save(handle)
+        return handle.state
+
+    def _collect(self, handle: JobHandle) -> str:
+
+        r"""
+        Checks one handle and downloads its result when ready.
+        :param handle: the JobHandle
+        :return: the new state of the handle
+        """
+
+        handle.checks += 1
+        handle.last_checked = time.time()
+        try:
+            if getattr(self, f"_check_{handle.service}")(handle) != "ready":
+                return self._retry(handle, "Job did not finish in time.")
+            tmp = f"{handle.output}.{os.getpid()}.tmp"
+            try:
+                with open(tmp, "wb") as out:
+                    getattr(self, f"_fetch_{handle.service}")(handle, out)
+                os.replace(tmp, handle.output)
+            finally:
+                # A failed download leaves no partial file behind
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            handle.state = "done"
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code >= 500 or e.response.status_code == 429:
+                return self._retry(handle, f"Job did not finish in time; last error: {e}")
+            handle.state = "failed"
+            handle.error = f"HTTP {e.response.status_code} from {e.response.url}"
+        except requests.RequestException as e:
+            # Network trouble or server overload: try again next round
+            return self._retry(handle, f"Job did not finish in time; last error: {type(e).__name__}: {e}")
+        except Exception as e:
+            handle.state = "failed"
+            handle.error = f"{type(e).__name__}: {e}"
+        handle.finished = time.time()
+        self._store.save(handle)
+        return handle.state
+
+    def poll_once(self) -> dict:
+
+        r"""
+        Runs one round over all pending handles.
+        :return: a dictionary from state to the number of handles that ended the round in it
+        """
+
+        handles = self._store.load("pending")
+        counts = {"pending": 0, "done": 0, "failed": 0}
+        if not handles:
+            return counts
+        with ThreadPoolExecutor(max_workers=self._max_workers) as pool:
+            for state in pool.map(self._collect, handles):
+                counts[state] += 1
+        return counts
+
+    def run(self, interval: float = 60, max_rounds: int = None) -> dict:
+
+        r"""
+        Polls until no handle is pending.
+        :param interval: seconds between two rounds
+        :param max_rounds: stop after this many rounds
+        :return: the totals of done and failed handles
+        """
+
+        totals = {"done": 0, "failed": 0}
+        rounds = 0
+        while max_rounds is None or rounds < max_rounds:
+            counts = self.poll_once()
+            rounds += 1
+            totals["done"] += counts["done"]
+            totals["failed"] += counts["failed"]
+            if counts["pending"] == 0:
+                break
+            time.sleep(interval)
+        return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect detached remote jobs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    listing = sub.add_parser("list")
+    listing.add_argument("--root", default="remote_jobs")
+    collect = sub.add_parser("collect")
+    collect.add_argument("--root", default="remote_jobs")
+    collect.add_argument("--interval", type=float, default=60)
+    collect.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    store = HandleStore(args.root)
+    if args.command == "list":
+        for state in HandleStore.states:
+            for handle in store.load(state):
+                print(f"{state:<8} {handle.service:<8} {handle.remote_id:<36} {handle.output}"
+                      + (f"  ({handle.error})" if handle.error else ""))
+    else:
+        print(json.dumps(Collector(store, max_workers=args.workers).run(interval=args.interval)))
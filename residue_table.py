@@ -0,0 +1,244 @@
+import numpy as np
+from amino_acid import AminoAcid
+from pdb_coords import read_atoms, residue_info, residue_coords
+
+
+class ResidueTable:
+
+    r"""
+    Class name: ResidueTable
+    Description: A column-oriented view of a Protein. Every column is a NumPy array with one row per residue, in the
+                 order of the chains and residues of the Protein object, so a whole column can be filtered or compared
+                 at once instead of looping over AminoAcid objects.
+    Variables:
+        self.pdb_id: PDB ID of the protein
+        self.columns: a dictionary from column name to NumPy array. The standard columns are
+                      chain, num, aa, mem, solex, rsa, cons, secstruct and x, y, z (coordinates of the CA atom).
+    """
+
+    def __init__(self, pdb_id: str, columns: dict):
+
+        r"""
+        Object constructor.
+        :param pdb_id: PDB ID of the protein
+        :param columns: a dictionary from column name to array, all of the same length
+        """
+
+        self._pdb_id = pdb_id
+        self._columns = {}
+        for name, values in columns.items():
+            self.set_column(name, values)
+
+    @classmethod
+    def from_protein(cls, protein, PDB_path: str = None, atom_name: str = "CA"):
+
+        r"""
+        Builds a table from a Protein object. Coordinates are read from the PDB file.
+        :param protein: a Protein object
+        :param PDB_path: the PDB file. Defaults to {pdb_id}.pdb in the workspace of the Protein
+        :param atom_name: the atom whose coordinates represent each residue
+        :return: a ResidueTable
+        """
+
+        pdb_id = protein.get_pdb_id()
+        residues = [aa for chainID in protein.get_chain_ids() for aa in protein.get_chain(chainID)]
+        columns = {
+            "chain": np.array([aa.get_chain_id() for aa in residues], dtype="U1"),
+            "num": np.array([aa.get_num() for aa in residues], dtype=np.int32),
+            "aa": np.array([aa.get_aa() for aa in residues], dtype="U1"),
+            "mem": np.array([aa.get_mem() or "-" for aa in residues], dtype="U1"),
+            "solex": np.array([aa.get_solex() for aa in residues], dtype=np.float32),
+            "rsa": np.array([aa.get_rsa() for aa in residues], dtype=np.float32),
+            "cons": np.array([aa.get_cons() for aa in residues], dtype=np.float32),
+            "secstruct": np.array([aa.get_secstruct() or "-" for aa in residues], dtype="U1"),
+        }
+
+        # Match coordinates by (chain, residue number)
+        atoms = read_atoms(PDB_path if PDB_path else protein.get_workspace().pdb(pdb_id))
+        info = residue_info(atoms)
+        coords = residue_coords(atoms, atom_name=atom_name)
+        lookup = {(c, int(n)): k for k, (c, n) in enumerate(zip(info["chain"], info["resnum"]))}
+        xyz = np.full((len(residues), 3), np.nan, dtype=np.float32)
+        for k, (c, n) in enumerate(zip(columns["chain"], columns["num"])):
+            idx = lookup.get((c, int(n)))
+            if idx is not None:
+                xyz[k] = coords[idx]
+        columns["x"], columns["y"], columns["z"] = xyz[:, 0], xyz[:, 1], xyz[:, 2]
+        return cls(pdb_id, columns)
+
+    @classmethod
+    def from_pdb(cls, PDB_path: str, pdb_id: str, atom_name: str = "CA"):
+
+        r"""
+        Builds a table straight from a PDB file, without a Protein object. Annotation columns start empty.
+        :param PDB_path: the PDB file (may be gzip-compressed)
+        :param pdb_id: PDB ID of the protein
+        :param atom_name: the atom whose coordinates represent each residue
+        :return: a ResidueTable
+        """
+
+        return cls.from_atoms(read_atoms(PDB_path), pdb_id, atom_name=atom_name)
+
+    @classmethod
+    def from_atoms(cls, atoms: dict, pdb_id: str, atom_name: str = "CA"):
+
+        r"""
+        Builds a table from the atom arrays returned by pdb_coords.read_atoms. Rows follow res_idx, so per-residue
+        arrays computed from the same atoms (e.g. sasa.residue_sasa) can be added as columns directly.
+        :param atoms: the dictionary returned by read_atoms
+        :param pdb_id: PDB ID of the protein
+        :param atom_name: the atom whose coordinates represent each residue
+        :return: a ResidueTable
+        """
+
+        info = residue_info(atoms)
+        d3to1 = AminoAcid.d3to1
+        n = len(info["chain"])
+        xyz = residue_coords(atoms, atom_name=atom_name).astype(np.float32)
+        columns = {
+            "chain": info["chain"],
+            "num": info["resnum"],
+            "aa": np.array([d3to1.get(name, "X") for name in info["resname"]], dtype="U1"),
+            "mem": np.full(n, "-", dtype="U1"),
+            "solex": np.zeros(n, dtype=np.float32),
+            "rsa": np.zeros(n, dtype=np.float32),
+            "cons": np.zeros(n, dtype=np.float32),
+            "secstruct": np.full(n, "-", dtype="U1"),
+            "x": xyz[:, 0], "y": xyz[:, 1], "z": xyz[:, 2],
+        }
+        return cls(pdb_id, columns)
+
+    def get_pdb_id(self) -> str:
+
+        r"""
+        Returns pdb_id.
+        :return: pdb_id
+        """
+
+        return self._pdb_id
+
+    def get_length(self) -> int:
+
+        r"""
+        Get the number of residues stored in the table.
+        :return: the number of rows
+        """
+
+        if not self._columns:
+            return 0
+        return len(next(iter(self._columns.values())))
+
+    def get_column(self, name: str) -> np.ndarray:
+
+        r"""
+        Returns one column.
+        :param name: column name
+        :return: the column
+        """
+
+        return self._columns[name]
+
+    def get_column_names(self) -> list:
+
+        r"""
+        Returns the names of all columns.
+        :return: a list of column names
+        """
+
+        return list(self._columns)
+
+    def has_column(self, name: str) -> bool:
+
+        r"""
+        Checks whether a column exists.
+        :param name: column name
+        :return: True if the column exists
+        """
+
+        return name in self._columns
+
+    def set_column(self, name: str, values):
+
+        r"""
+        Adds or replaces a column.
+        :param name: column name
+        :param values: an array with one value per residue
+        :return: N/A
+        """
+
+        values = np.asarray(values)
+        if self._columns and len(values) != self.get_length():
+            raise ValueError(f"Column {name} has {len(values)} rows, expected {self.get_length()}.")
+        self._columns[name] = values
+
+    def get_coords(self) -> np.ndarray:
+
+        r"""
+        Returns the residue coordinates.
+        :return: an (n, 3) array
+        """
+
+        return np.column_stack((self._columns["x"], self._columns["y"], self._columns["z"]))
+
+    def take(self, idx: np.ndarray) -> dict:
+
+        r"""
+        Gathers rows of every column.
+        :param idx: row indices
+        :return: a dictionary from column name to the selected values
+        """
+
+        return {name: values[idx] for name, values in self._columns.items()}
+
+
+def iter_pairs(
+        table: ResidueTable,
+        mask: np.ndarray = None,
+        min_dist: float = 20.0,
+        max_dist: float = 50.0,
+        block: int = 2048
+               ):
+
+    r"""
+    Enumerates residue pairs whose distance lies in [min_dist, max_dist], one block of rows at a time, so the full
+    distance matrix never has to be held in memory.
+    :param table: a ResidueTable
+    :param mask: optional boolean array selecting the residues that qualify
+    :param min_dist: smallest distance in Angstrom
+    :param max_dist: largest distance in Angstrom
+    :param block: the number of rows of the distance matrix computed at once
+    :return: a generator of dictionaries with columns "i", "j" (row indices into the table, i < j) and "dist"
+    """
+
+    idx = np.arange(table.get_length()) if mask is None else np.flatnonzero(mask)
+    coords = table.get_coords()[idx].astype(np.float64)
+    valid = ~np.isnan(coords).any(axis=1)
+    idx, coords = idx[valid], coords[valid]
+    lo2, hi2 = min_dist ** 2, max_dist ** 2
+
+    for start in range(0, len(idx), block):
+        stop = min(start + block, len(idx))
+        # Only the upper triangle: rows start:stop against columns from start on
+        diff = coords[start:stop, None, :] - coords[None, start:, :]
+        d2 = np.einsum("abk,abk->ab", diff, diff)
+        keep = (d2 >= lo2) & (d2 <= hi2)
+        keep &= np.arange(start, stop)[:, None] < np.arange(start, len(idx))[None, :]
+        a, b = np.nonzero(keep)
+        yield {"i": idx[a + start], "j": idx[b + start], "dist": np.sqrt(d2[a, b]).astype(np.float32)}
+
+
+def find_pairs(table: ResidueTable, mask: np.ndarray = None, min_dist: float = 20.0, max_dist: float = 50.0) -> dict:
+
+    r"""
+    Collects all residue pairs whose distance lies in [min_dist, max_dist].
+    :param table: a ResidueTable
+    :param mask: optional boolean array selecting the residues that qualify
+    :param min_dist: smallest distance in Angstrom
+    :param max_dist: largest distance in Angstrom
+    :return: a dictionary with columns "i", "j" and "dist"
+    """
+
+    chunks = list(iter_pairs(table, mask=mask, min_dist=min_dist, max_dist=max_dist))
+    if not chunks:
+        return {"i": np.zeros(0, dtype=np.int64), "j": np.zeros(0, dtype=np.int64), "dist": np.zeros(0, np.float32)}
+    return {key: np.concatenate([c[key] for c in chunks]) for key in ("i", "j", "dist")}
@@ -0,0 +1,269 @@
+import re
+import numpy as np
+
+
+r"""
+Whole-file parsers for the results of DSSP and TOPCONS. A DSSP file is cut into a character matrix, one row per
+residue line, and every field is read with one fixed-width slice of that matrix, so blank structure codes and wide
+residue numbers cannot shift the fields (as they do with line.split()). All DSSP fields are kept:
+    secstruct   H, B, E, G, I, T, S or n (none)
+    bend        True where DSSP marks a geometrical bend
+    bp1, bp2    the DSSP numbers of the bridge partners (0 for none)
+    sheet       the sheet label
+    solex       the ACC column (accessible surface in Angstrom^2)
+    nho1, nho1_e, ohn1, ohn1_e, nho2, nho2_e, ohn2, ohn2_e
+                the offsets and energies (kcal/mol) of the N-H-->O and O-->H-N hydrogen bonds
+    tco, kappa, alpha, phi, psi
+                the backbone geometry; 360 means undefined
+    chain_break True for the first residue after a break ("!" line) in the chain
+add_dssp joins them onto a ResidueTable by chain and residue number, so every field can be used in filter expressions.
+
+TOPCONS result files hold one block per query sequence ("Sequence number: 1", ...); read_topcons returns the name,
+sequence and predicted topology of every block. Files with a single topology and no block headers, such as those of
+membrane_predictor.write_topology, are read as one block.
+
+Reference:
+Kabsch W, Sander C. 1983
+Dictionary of protein secondary structure: pattern recognition of hydrogen-bonded and geometrical features.
+Biopolymers 22:2577-2637.
+"""
+
+_dssp_header = b"  #  RESIDUE AA STRUCTURE"
+
+# Columns of a DSSP residue line: (name, start, stop, dtype)
+dssp_fields = [
+    ("dssp_num", 0, 5, np.int32),
+    ("num", 5, 10, np.int32),
+    ("bp1", 25, 29, np.int32),
+    ("bp2", 29, 33, np.int32),
+    ("solex", 34, 38, np.float32),
+    ("tco", 85, 91, np.float32),
+    ("kappa", 91, 97, np.float32),
+    ("alpha", 97, 103, np.float32),
+    ("phi", 103, 109, np.float32),
+    ("psi", 109, 115, np.float32),
+]
+
+# The four hydrogen bond fields, each "offset,energy" right-aligned in 11 characters
+dssp_hbonds = [("nho1", 39), ("ohn1", 50), ("nho2", 61), ("ohn2", 72)]
+
+
+def _char_matrix(lines: list) -> np.ndarray:
+
+    r"""
+    Stacks lines into a matrix of characters, padding short lines with spaces.
+    :param lines: a list of bytes
+    :return: an (n_lines, width) uint8 array
+    """
+
+    width = max((len(line) for line in lines), default=1)
+    matrix = np.array(lines, dtype=f"S{width}").view(np.uint8).reshape(len(lines), width).copy()
+    matrix[matrix == 0] = ord(" ")
+    return matrix
+
+
+def _field(matrix: np.ndarray, start: int, stop: int) -> np.ndarray:
+
+    r"""
+    Cuts one fixed-width field out of a character matrix.
+    :param matrix: the character matrix
+    :param start: the first column
+    :param stop: the column after the last
+    :return: an array of bytes, one per row
+    """
+
+    if matrix.shape[1] < stop:
+        matrix = np.pad(matrix, ((0, 0), (0, stop - matrix.shape[1])), constant_values=ord(" "))
+    return np.ascontiguousarray(matrix[:, start:stop]).view(f"S{stop - start}").ravel()
+
+
+def _number(matrix: np.ndarray, start: int, stop: int, dtype) -> np.ndarray:
+
+    r"""
+    Reads one fixed-width numeric field. Blank fields, which some DSSP writers leave for absent values, become 0 for
+    integers and NaN for floats.
+    :param matrix: the character matrix
+    :param start: the first column
+    :param stop: the column after the last
+    :param dtype: the numpy type of the values
+    :return: an array with one value per row
+    """
+
+    raw = _field(matrix, start, stop)
+    blank = np.char.strip(raw) == b""
+    values = np.where(blank, b"0", raw).astype(dtype)
+    if np.dtype(dtype).kind == "f":
+        values[blank] = np.nan
+    return values
+
+
+def _letters(matrix: np.ndarray, column: int) -> np.ndarray:
+    return matrix[:, column].view("S1").astype("U1")
+
+
+def read_dssp(dssp_path: str) -> dict:
+
+    r"""
+    Reads every residue of a DSSP file.
+    :param dssp_path: the .dssp file
+    :return: a dictionary of arrays with one row per residue (break lines are left out): "chain", "num", "icode", "aa"
+             and the fields listed at the top of this module
+    """
+
+    with open(dssp_path, "rb") as file:
+        data = file.read()
+    start = data.find(_dssp_header)
+    if start < 0:
+        raise ValueError(f"{dssp_path} has no DSSP residue table.")
+    lines = [line for line in data[data.find(b"\n", start) + 1:].splitlines() if line.strip()]
+    matrix = _char_matrix(lines) if lines else np.zeros((0, 136), dtype=np.uint8)
+
+    # A "!" in the amino acid column marks a chain break; the next residue starts a new segment
+    is_break = matrix[:, 13] == ord("!")
+    after_break = np.zeros(len(matrix), dtype=bool)
+    after_break[1:] = is_break[:-1]
+    matrix, after_break = matrix[~is_break], after_break[~is_break]
+
+    out = {"chain": _letters(matrix, 11), "icode": _letters(matrix, 10)}
+    for name, begin, end, dtype in dssp_fields:
+        out[name] = _number(matrix, begin, end, dtype)
+    aa = _letters(matrix, 13)
+    # Lowercase letters are cysteines that form a disulfide bridge
+    out["aa"] = np.where(np.char.islower(aa), "C", aa)
+    structure = _letters(matrix, 16)
+    out["secstruct"] = np.where(np.isin(structure, list("HBEGITS")), structure, "n")
+    out["bend"] = matrix[:, 21] == ord("S")
+    out["sheet"] = _letters(matrix, 33)
+
+    position = np.arange(11)
+    for name, begin in dssp_hbonds:
+        hbond = matrix[:, begin:begin + 11]
+        comma = np.argmax(hbond == ord(","), axis=1)[:, None]
+        blank = np.uint8(ord(" "))
+        offset = np.where(position[None, :] < comma, hbond, blank)
+        energy = np.where(position[None, :] > comma, hbond, blank)
+        out[name] = _number(offset, 0, 11, np.int32)
+        out[f"{name}_e"] = _number(energy, 0, 11, np.float32)
+    out["chain_break"] = after_break
+    return out
+
+
+def _keys(chain: np.ndarray, num: np.ndarray) -> np.ndarray:
+
+    r"""
+    Combines chain identifiers and residue numbers into integer keys.
+    :param chain: single-letter chain identifiers
+    :param num: residue numbers
+    :return: an int64 array
+    """
+
+    codes = np.asarray(chain, dtype="U1").view(np.uint32).astype(np.int64)
+    return (codes << 32) + (np.asarray(num, dtype=np.int64) + (1 << 31))
+
+
+def match_rows(chain: np.ndarray, num: np.ndarray, other_chain: np.ndarray, other_num: np.ndarray) -> np.ndarray:
+
+    r"""
+    Finds, for every residue, the first row of another set of residues with the same chain and residue number.
+    :param chain: chain identifiers of the residues
+    :param num: residue numbers of the residues
+    :param other_chain: chain identifiers of the other set
+    :param other_num: residue numbers of the other set
+    :return: an array of row indices into the other set, -1 where there is no match
+    """
+
+    keys, other = _keys(chain, num), _keys(other_chain, other_num)
+    if len(other) == 0:
+        return np.full(len(keys), -1, dtype=np.int64)
+    # A stable sort keeps the first of duplicate keys (e.g. residues with insertion codes) in front
+    order = np.argsort(other, kind="stable")
+    pos = np.minimum(np.searchsorted(other[order], keys), len(order) - 1)
+    return np.where(other[order][pos] == keys, order[pos], -1)
+
+
+def add_dssp(table, dssp: dict, columns=None) -> list:
+
+    r"""
+    Joins DSSP fields onto a ResidueTable, matching residues by chain and residue number. Residues that DSSP does not
+    list keep their secondary structure and accessibility and get NaN (or 0, False) in the other columns.
+    :param table: a ResidueTable
+    :param dssp: the dictionary returned by read_dssp
+    :param columns: the fields to add. Defaults to all of them except chain, num, icode, aa and dssp_num
+    :return: the names of the columns set
+    """
+
+    if columns is None:
+        columns = [name for name in dssp if name not in ("chain", "num", "icode", "aa", "dssp_num")]
+    rows = match_rows(table.get_column("chain"), table.get_column("num"), dssp["chain"], dssp["num"])
+    found = rows >= 0
+    for name in columns:
+        values = dssp[name]
+        if table.has_column(name):
+            column = table.get_column(name).copy()
+            column[found] = values[rows[found]].astype(column.dtype)
+        elif values.dtype.kind == "f":
+            column = np.full(len(rows), np.nan, dtype=values.dtype)
+            column[found] = values[rows[found]]
+        else:
+            column = np.zeros(len(rows), dtype=values.dtype)
+            column[found] = values[rows[found]]
+        table.set_column(name, column)
+    return list(columns)
+
+
+_topcons_block = re.compile(r"^Sequence number:\s*(\d+)", re.MULTILINE)
+_topcons_name = re.compile(r"^Sequence name:\s*(.*?)\s*$", re.MULTILINE)
+_topcons_sequence = re.compile(r"^Sequence:\s*\n\s*([A-Za-z]+)", re.MULTILINE)
+_topcons_topology = re.compile(r"^TOPCONS predicted topology:[ \t]*\n[ \t]*([ioMS]+)[ \t]*$", re.MULTILINE)
+
+
+def parse_topcons(text: str) -> list:
+
+    r"""
+    Splits a TOPCONS result into its sequence blocks.
+    :param text: the result text
+    :return: a list of dictionaries with "number", "name", "sequence" and "topology" (None when TOPCONS gave no
+             prediction), in the order of the file
+    """
+
+    starts = [m.start() for m in _topcons_block.finditer(text)] or [0]
+    records = []
+    for k, start in enumerate(starts):
+        block = text[start:starts[k + 1] if k + 1 < len(starts) else len(text)]
+        number, name = _topcons_block.search(block), _topcons_name.search(block)
+        sequence, topology = _topcons_sequence.search(block), _topcons_topology.search(block)
+        records.append({"number": int(number.group(1)) if number else k + 1,
+                        "name": name.group(1) if name else "",
+                        "sequence": sequence.group(1) if sequence else "",
+                        "topology": topology.group(1) if topology else None})
+    return records
+
+
+def read_topcons(path: str) -> list:
+
+    r"""
+    Reads a TOPCONS result file.
+    :param path: the result file, e.g. {pdb_id}_{chainID}_MEM.txt
+    :return: the list returned by parse_topcons
+    """
+
+    with open(path, "r") as file:
+        return parse_topcons(file.read())
+
+
+def add_topology(table, chainID: str, topology: str):
+
+    r"""
+    Sets the mem column of one chain from a topology string, residue by residue in table order. Residues beyond the
+    end of the string are left as they are.
+    :param table: a ResidueTable
+    :param chainID: chain identifier
+    :param topology: string of "i", "o", "M" (and "S" for signal peptides)
+    :return: the number of residues set
+    """
+
+    rows = np.flatnonzero(table.get_column("chain") == chainID)[:len(topology)]
+    mem = table.get_column("mem").copy()
+    mem[rows] = np.array(list(topology[:len(rows)]), dtype=mem.dtype)
+    table.set_column("mem", mem)
+    return len(rows)
@@ -0,0 +1,287 @@
+import os
+import sqlite3
+import numpy as np
+from datetime import datetime
+
+
+class ResultStore:
+
+    r"""
+    Class name: ResultStore
+    Description: A local, indexed store for the results of many jobs, so questions across proteins can be answered with
+                 one query instead of reading every job directory.
+                 Per-residue annotations and candidate pairs are kept in a SQLite database with indexes on chain,
+                 secondary structure, conservation grade, accessibility and distance. Every pair table is also written
+                 as a columnar sidecar (one .npy file per column under pairs/{job_id}/), which can be memory-mapped and
+                 scanned with NumPy when a query touches most of the rows.
+    Variables:
+        self.root: the directory of the store
+        self.db_path: the path of the SQLite database
+        self.conn: the database connection
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            pdb_id TEXT NOT NULL,
+            created TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS protein_sets (
+            set_name TEXT NOT NULL,
+            pdb_id TEXT NOT NULL,
+            PRIMARY KEY (set_name, pdb_id)
+        );
+        CREATE TABLE IF NOT EXISTS residues (
+            res_id INTEGER PRIMARY KEY,
+            job_id TEXT NOT NULL,
+            pdb_id TEXT NOT NULL,
+            row INTEGER NOT NULL,
+            chain TEXT NOT NULL,
+            num INTEGER NOT NULL,
+            aa TEXT,
+            mem TEXT,
+            solex REAL,
+            rsa REAL,
+            cons REAL,
+            secstruct TEXT
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS residues_job_row ON residues (job_id, row);
+        CREATE INDEX IF NOT EXISTS residues_pdb_chain ON residues (pdb_id, chain, num);
+        CREATE INDEX IF NOT EXISTS residues_secstruct ON residues (secstruct);
+        CREATE INDEX IF NOT EXISTS residues_cons ON residues (cons);
+        CREATE INDEX IF NOT EXISTS residues_solex ON residues (solex);
+        CREATE TABLE IF NOT EXISTS pairs (
+            job_id TEXT NOT NULL,
+            res_1 INTEGER NOT NULL REFERENCES residues (res_id),
+            res_2 INTEGER NOT NULL REFERENCES residues (res_id),
+            dist REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS pairs_dist ON pairs (dist);
+        CREATE INDEX IF NOT EXISTS pairs_job ON pairs (job_id);
+        CREATE INDEX IF NOT EXISTS pairs_res_1 ON pairs (res_1);
+        CREATE INDEX IF NOT EXISTS pairs_res_2 ON pairs (res_2);
+    """
+
+    residue_columns = ("chain", "num", "aa", "mem", "solex", "rsa", "cons", "secstruct")
+
+    def __init__(self, root: str = "spin_label_results"):
+
+        r"""
+        Object constructor. Creates the store if it does not exist.
+        :param root: the directory of the store
+        """
+
+        self._root = root
+        os.makedirs(os.path.join(root, "pairs"), exist_ok=True)
+        self._db_path = os.path.join(root, "results.sqlite")
+        self._conn = sqlite3.connect(self._db_path)
+        self._conn.executescript(self.schema)
+
+    def close(self):
+
+        r"""
+        Closes the database connection.
+        :return: N/A
+        """
+
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_job(self, job_id: str, table, pairs: dict = None):
+
+        r"""
+        Stores the residue table and candidate pairs of one job. Storing the same job again replaces it.
+        :param job_id: job id
+        :param table: a ResidueTable
+        :param pairs: optional dictionary with columns "i", "j" (row indices into table) and "dist"
+        :return: N/A
+        """
+
+        pdb_id = table.get_pdb_id()
+        with self._conn:
+            self.remove_job(job_id, commit=False)
+            self._conn.execute("INSERT INTO jobs VALUES (?, ?, ?)",
+                               (job_id, pdb_id, datetime.now().isoformat(timespec="seconds")))
+            columns = [table.get_column(name).tolist() if table.has_column(name) else [None] * table.get_length()
+                       for name in self.residue_columns]
+            self._conn.executemany(
+                "INSERT INTO residues (job_id, pdb_id, row, chain, num, aa, mem, solex, rsa, cons, secstruct) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((job_id, pdb_id, row, *values) for row, values in enumerate(zip(*columns))))
+
+            if pairs is not None and len(pairs["i"]):
+                # Row numbers of this job map to res_id through one lookup array
+                res_ids = np.array([r for (r,) in self._conn.execute(
+                    "SELECT res_id FROM residues WHERE job_id = ? ORDER BY row", (job_id,))], dtype=np.int64)
+                self._conn.executemany(
+                    "INSERT INTO pairs VALUES (?, ?, ?, ?)",
+                    zip([job_id] * len(pairs["i"]), res_ids[pairs["i"]].tolist(), res_ids[pairs["j"]].tolist(),
+                        np.asarray(pairs["dist"], dtype=np.float64).tolist()))
+        if pairs is not None:
+            self._write_sidecar(job_id, table, pairs)
+
+    def remove_job(self, job_id: str, commit: bool = True):
+
+        r"""
+        Deletes one job from the store.
+        :param job_id: job id
+        :param commit: commit right away
+        :return: N/A
+        """
+
+        self._conn.execute("DELETE FROM pairs WHERE job_id = ?", (job_id,))
+        self._conn.execute("DELETE FROM residues WHERE job_id = ?", (job_id,))
+        self._conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        if commit:
+            self._conn.commit()
+
+    def _sidecar_dir(self, job_id: str) -> str:
+
+        r"""
+        Returns the sidecar directory of a job.
+        :param job_id: job id
+        :return: the directory path
+        """
+
+        return os.path.join(self._root, "pairs", job_id)
+
+    def _write_sidecar(self, job_id: str, table, pairs: dict):
+
+        r"""
+        Writes the pair table of a job as one .npy file per column, together with the per-residue columns needed to
+        filter pairs without the database.
+        :param job_id: job id
+        :param table: a ResidueTable
+        :param pairs: dictionary with columns "i", "j" and "dist"
+        :return: N/A
+        """
+
+        path = self._sidecar_dir(job_id)
+        os.makedirs(path, exist_ok=True)
+        for name in ("i", "j", "dist"):
+            np.save(os.path.join(path, f"{name}.npy"), np.asarray(pairs[name]))
+        for name in self.residue_columns:
+            if table.has_column(name):
+                np.save(os.path.join(path, f"res_{name}.npy"), table.get_column(name))
+
+    def load_pairs(self, job_id: str, mmap: bool = True) -> dict:
+
+        r"""
+        Loads the columnar pair table of a job.
+        :param job_id: job id
+        :param mmap: memory-map the arrays instead of reading them
+        :return: a dictionary from column name to array. Residue columns are prefixed with "res_".
+        """
+
+        path = self._sidecar_dir(job_id)
+        mode = "r" if mmap else None
+        return {f[:-4]: np.load(os.path.join(path, f), mmap_mode=mode) for f in sorted(os.listdir(path))
+                if f.endswith(".npy")}
+
+    def add_to_set(self, set_name: str, pdb_ids: list):
+
+        r"""
+        Adds proteins to a named set, e.g. "transporters", so queries can be restricted to it.
+        :param set_name: name of the set
+        :param pdb_ids: PDB IDs to add
+        :return: N/A
+        """
+
+        with self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO protein_sets VALUES (?, ?)",
+                                   ((set_name, pdb_id) for pdb_id in pdb_ids))
+
+    def query_pairs(
+            self,
+            secstruct: str = None,
+            min_solex: float = None,
+            max_cons: float = None,
+            exclude_mem: str = None,
+            min_dist: float = None,
+            max_dist: float = None,
+            protein_set: str = None,
+            pdb_ids: list = None,
+            limit: int = None
+                    ) -> list:
+
+        r"""
+        Finds candidate pairs across all stored jobs. Every residue condition must hold for both residues of a pair.
+        For example, "helical, exposed, non-conserved pairs 20-50 A across the transporter set" is
+        query_pairs(secstruct="H", min_solex=40, max_cons=4, min_dist=20, max_dist=50, protein_set="transporters").
+        :param secstruct: allowed DSSP letters, e.g. "HGI"
+        :param min_solex: the smallest solvent accessibility
+        :param max_cons: the largest conservation grade
+        :param exclude_mem: membrane letters to exclude, e.g. "M"
+        :param min_dist: the smallest distance in Angstrom
+        :param max_dist: the largest distance in Angstrom
+        :param protein_set: restrict to a set created with add_to_set
+        :param pdb_ids: restrict to these PDB IDs
+        :param limit: the largest number of rows returned
+        :return: a list of tuples (pdb_id, chain_1, num_1, aa_1, chain_2, num_2, aa_2, dist, job_id)
+        """
+
+        where, params = [], []
+        if min_dist is not None:
+            where.append("p.dist >= ?")
+            params.append(min_dist)
+        if max_dist is not None:
+            where.append("p.dist <= ?")
+            params.append(max_dist)
+        for r in ("r1", "r2"):
+            if secstruct is not None:
+                where.append(f"{r}.secstruct IN ({', '.join('?' * len(secstruct))})")
+                params.extend(secstruct)
+            if min_solex is not None:
+                where.append(f"{r}.solex >= ?")
+                params.append(min_solex)
+            if max_cons is not None:
+                where.append(f"{r}.cons <= ?")
+                params.append(max_cons)
+            if exclude_mem:
+                where.append(f"{r}.mem NOT IN ({', '.join('?' * len(exclude_mem))})")
+                params.extend(exclude_mem)
+        if protein_set is not None:
+            where.append("r1.pdb_id IN (SELECT pdb_id FROM protein_sets WHERE set_name = ?)")
+            params.append(protein_set)
+        if pdb_ids:
+            where.append(f"r1.pdb_id IN ({', '.join('?' * len(pdb_ids))})")
+            params.extend(pdb_ids)
+
+        sql = ("SELECT r1.pdb_id, r1.chain, r1.num, r1.aa, r2.chain, r2.num, r2.aa, p.dist, p.job_id "
+               "FROM pairs p JOIN residues r1 ON r1.res_id = p.res_1 JOIN residues r2 ON r2.res_id = p.res_2")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY r1.pdb_id, p.dist"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._conn.execute(sql, params).fetchall()
+
+    def query_residues(self, sql_where: str = "1", params: tuple = ()) -> list:
+
+        r"""
+        Runs a free-form query on the residue annotations.
+        :param sql_where: the WHERE clause, e.g. "secstruct = ? AND solex > ?"
+        :param params: the parameters of the clause
+        :return: a list of tuples (pdb_id, chain, num, aa, mem, solex, rsa, cons, secstruct, job_id)
+        """
+
+        return self._conn.execute(
+            "SELECT pdb_id, chain, num, aa, mem, solex, rsa, cons, secstruct, job_id FROM residues "
+            f"WHERE {sql_where} ORDER BY pdb_id, chain, num", params).fetchall()
+
+    def execute(self, sql: str, params: tuple = ()) -> list:
+
+        r"""
+        Runs any SQL statement on the store.
+        :param sql: the statement
+        :param params: its parameters
+        :return: the rows returned
+        """
+
+        return self._conn.execute(sql, params).fetchall()
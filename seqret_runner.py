@@ -1,5 +1,6 @@
 import requests
 import time
+from workspace import get_workspace
 
 
 class SeqretRunner:
@@ -14,6 +15,7 @@ class SeqretRunner:
         self.mode: the output format. In this context, fasta or clustal.
         self.server_url: seqret server url
         self.out_name: output file name
+        self.workspace: the Workspace the output file is written to
 
     Reference:
     Madeira F, Pearce M, Tivey ARN, et al.
@@ -30,7 +32,8 @@ class SeqretRunner:
             seq: str="",
             mode: str = "",
             server_url: str = "https://www.ebi.ac.uk/Tools/services/rest/emboss_seqret/run",
-            out_name: str=""
+            out_name: str="",
+            workspace=None
     ):
 
         r"""
@@ -41,6 +44,7 @@ class SeqretRunner:
         :param mode: the output format. In this context, fasta or clustal.
         :param server_url: url of seqret server
         :param out_name: output file name
+        :param workspace: the Workspace of the job. Defaults to the current working directory
         """
 
         self._email = email
@@ -49,6 +53,7 @@ class SeqretRunner:
         self._mode = mode
         self._server_url = server_url
         self._out_name = out_name
+        self._workspace = get_workspace(workspace)
 
     def _init_id(self) -> str:
 
@@ -78,7 +83,7 @@ class SeqretRunner:
 
         r"""
         Runs the job.
-        :return: the name of the output file
+        :return: the path of the output file
         """
 
         print("Submitting job...")
@@ -96,14 +101,16 @@ class SeqretRunner:
             "sequence": self._seq
         }
         result = requests.post(self._server_url, data=values).text
-        result_url = f"https://www.ebi.ac.uk/Tools/services/rest/emboss_seqret/result/{result}/out"
+        # The result endpoint sits next to the run endpoint, so a mirror or local server_url works as well
+        result_url = f"{self._server_url.rsplit('/run', 1)[0]}/result/{result}/out"
         print("Converting...")
         while not (requests.get(result_url).text.startswith(self._init_id())):
             time.sleep(1)
         print(f"Fetching {self._mode.upper()} file...")
-        with open(self._out_name + self._post_id(), "w") as out:
+        out_path = self._workspace.path(self._out_name + self._post_id())
+        with open(out_path, "w") as out:
             out.write(requests.get(result_url).text)
-        return self._out_name + self._post_id()
+        return out_path
 
 
 
@@ -0,0 +1,217 @@
+import itertools
+import numpy as np
+from filter_expr import aliases, compile_expr
+from residue_table import ResidueTable, iter_pairs
+from stages import get_stage
+
+
+r"""
+Cost-aware planning of the expensive stages of a job. Cheap local stages (parsing, burial, accessibility, DSSP) fill in
+the structure columns first; before each expensive stage the planner asks which residues can still end up in a
+candidate pair, and the stage only runs for the chains that hold such residues. A stage whose columns the filters do
+not use is skipped entirely, and when no pair can survive every remaining stage is skipped, which for a screen of many
+structures saves most of the ConSurf time.
+
+Columns that are not known yet are handled exactly rather than optimistically: mem and cons take few values, so a
+residue may still qualify if the filter holds for some value of its unknown columns. Columns without a known set of
+values do not prune anything.
+"""
+
+# The values an annotation can take once it is known
+domains = {
+    "mem": ("-", "i", "o", "M", "S"),
+    "cons": tuple(range(10)),
+}
+
+
+def _column(name: str) -> str:
+    name = aliases.get(name, name)
+    if name.endswith("_1") or name.endswith("_2"):
+        name = aliases.get(name[:-2], name[:-2])
+    return name
+
+
+class StagePlanner:
+
+    r"""
+    Class name: StagePlanner
+    Description: Decides which chains an expensive stage has to run for, from the current residue table, the filters
+                 and the distance window, and keeps the estimated time of what was skipped.
+    Variables:
+        self.table: the ResidueTable of the job; later stages update its columns in place
+        self.where: the residue filter expression
+        self.pair_where: an optional pair filter expression
+        self.min_dist: smallest pair distance in Angstrom
+        self.max_dist: largest pair distance in Angstrom
+        self.min_cost: stages estimated to take less than this (seconds per chain) always run
+        self.decisions: a dictionary from stage name to {"run": chains, "skip": chains, "saved": seconds}
+    """
+
+    def __init__(
+            self,
+            table: ResidueTable,
+            where: str = None,
+            pair_where: str = None,
+            min_dist: float = 20.0,
+            max_dist: float = 50.0,
+            min_cost: float = 60.0
+                 ):
+
+        r"""
+        Object constructor.
+        :param table: the ResidueTable of the job
+        :param where: the residue filter expression. Defaults to protein_seq.default_filter
+        :param pair_where: an optional pair filter expression
+        :param min_dist: smallest pair distance in Angstrom
+        :param max_dist: largest pair distance in Angstrom
+        :param min_cost: stages estimated to take less than this (seconds per chain) always run
+        """
+
+        if where is None:
+            from protein_seq import default_filter
+            where = default_filter
+        self._table = table
+        self._where = compile_expr(where)
+        self._pair_where = compile_expr(pair_where) if pair_where else None
+        self._min_dist = min_dist
+        self._max_dist = max_dist
+        self._min_cost = min_cost
+        self._decisions = {}
+
+    def set_table(self, table: ResidueTable):
+
+        r"""
+        Replaces the residue table, e.g. after annotations were read into a new one.
+        :param table: the ResidueTable
+        :return: N/A
+        """
+
+        self._table = table
+
+    def get_decisions(self) -> dict:
+
+        r"""
+        Returns decisions.
+        :return: a dictionary from stage name to {"run": chains, "skip": chains, "saved": seconds}
+        """
+
+        return dict(self._decisions)
+
+    def get_saved(self) -> float:
+
+        r"""
+        Returns the estimated time saved by the skipped stages.
+        :return: seconds
+        """
+
+        return float(sum(decision["saved"] for decision in self._decisions.values()))
+
+    def uses(self, columns) -> bool:
+
+        r"""
+        Checks whether the filters depend on any of some columns.
+        :param columns: column names
+        :return: True if the residue or pair filter names one of them
+        """
+
+        names = {_column(name) for name in self._where.get_names()}
+        if self._pair_where is not None:
+            names |= {_column(name) for name in self._pair_where.get_names()}
+        return bool(names & {_column(name) for name in columns})
+
+    def possible(self, pending=()) -> np.ndarray:
+
+        r"""
+        Finds the residues that pass the residue filter now or may pass it once the pending columns are known.
+        :param pending: the columns that are not known yet, e.g. ["mem", "cons"]
+        :return: a boolean array, one value per residue
+        """
+
+        names = {_column(name) for name in self._where.get_names()}
+        unknown = [name for name in dict.fromkeys(_column(p) for p in pending) if name in names]
+        n = self._table.get_length()
+        if not unknown:
+            return self._where.mask(self._table)
+        if any(name not in domains for name in unknown):
+            return np.ones(n, dtype=bool)
+        columns = {name: self._table.get_column(name) for name in names if self._table.has_column(name)}
+        possible = np.zeros(n, dtype=bool)
+        for values in itertools.product(*(domains[name] for name in unknown)):
+            for name, value in zip(unknown, values):
+                dtype = columns[name].dtype if name in columns else None
+                columns[name] = np.full(n, value, dtype=dtype)
+            possible |= self._where.mask(ResidueTable(self._table.get_pdb_id(), columns))
+            if possible.all():
+                break
+        return possible
+
+    def candidates(self, pending=()) -> np.ndarray:
+
+        r"""
+        Finds the residues that may still be part of a candidate pair: they may pass the residue filter, and another such
+        residue lies within the distance window (and passes the pair filter with it, when the pair filter only uses
+        known columns).
+        :param pending: the columns that are not known yet
+        :return: a boolean array, one value per residue
+        """
+
+        possible = self.possible(pending)
+        paired = np.zeros(len(possible), dtype=bool)
+        pair_filter = self._pair_where
+        if pair_filter is not None and any(_column(name) in {_column(p) for p in pending}
+                                           for name in pair_filter.get_names()):
+            # Cannot be decided before the pending columns arrive
+            pair_filter = None
+        for chunk in iter_pairs(self._table, mask=possible, min_dist=self._min_dist, max_dist=self._max_dist):
+            i, j = chunk["i"], chunk["j"]
+            if pair_filter is not None and len(i):
+                keep = pair_filter.mask(self._table, chunk)
+                i, j = i[keep], j[keep]
+            paired[i] = True
+            paired[j] = True
+        return paired
+
+    def regions(self, pending=()) -> dict:
+
+        r"""
+        Lists the stretches of residues that may still be part of a candidate pair.
+        :param pending: the columns that are not known yet
+        :return: a dictionary from chain identifier to a list of (first, last) residue numbers
+        """
+
+        keep = self.candidates(pending)
+        chain, num = self._table.get_column("chain"), self._table.get_column("num")
+        out = {}
+        for chainID in dict.fromkeys(chain[keep]):
+            rows = np.flatnonzero(keep & (chain == chainID))
+            # A new stretch starts wherever the next candidate is not the next row
+            breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+            out[str(chainID)] = [(int(num[part[0]]), int(num[part[-1]])) for part in np.split(rows, breaks)]
+        return out
+
+    def chains_for(self, stage: str, chains: list, pending=()) -> list:
+
+        r"""
+        Decides which chains a stage runs for. Cheap stages run for every chain. An expensive stage is skipped when the
+        filters do not use its columns, and otherwise runs only for the chains with residues that may still be part of
+        a candidate pair. The decision is recorded with the estimated time saved.
+        :param stage: the stage name, e.g. "topcons" or "consurf"
+        :param chains: the chains the stage would run for
+        :param pending: the columns that are not known yet, including those of the stage
+        :return: the chains to run the stage for, in the order given
+        """
+
+        info = get_stage(stage)
+        chains = list(chains)
+        if info.get_cost() < self._min_cost:
+            run = chains
+        elif info.get_provides() and not self.uses(info.get_provides()):
+            run = []
+        else:
+            keep = self.candidates(pending)
+            found = set(self._table.get_column("chain")[keep].tolist())
+            run = [chainID for chainID in chains if chainID in found]
+        skip = [chainID for chainID in chains if chainID not in run]
+        self._decisions[stage] = {"run": run, "skip": skip, "saved": info.get_cost() * len(skip)}
+        return run
+
@@ -0,0 +1,232 @@
+import importlib
+import importlib.util
+
+
+class Stage:
+
+    r"""
+    Class name: Stage
+    Description: An entry of the stage registry. A Stage only knows where its implementation lives; the module (and the
+                 heavy packages it imports, such as selenium or Bio) is imported the first time the stage is loaded,
+                 so a run that never reaches a stage never pays for its imports.
+    Variables:
+        self.name: the name of the stage
+        self.module: the module that implements the stage
+        self.attr: the class or function in the module
+        self.description: a one-line description
+        self.requires: third-party packages the module needs
+        self.remote: whether the stage talks to a remote service
+        self.cost: a rough estimate of the time the stage takes for one chain, in seconds (queue waits included)
+        self.provides: the residue table columns the stage fills in
+    """
+
+    def __init__(
+            self,
+            name: str,
+            module: str,
+            attr: str,
+            description: str = "",
+            requires: tuple = (),
+            remote: bool = False,
+            cost: float = 1.0,
+            provides: tuple = ()
+                 ):
+
+        r"""
+        Object constructor.
+        :param name: the name of the stage
+        :param module: the module that implements the stage
+        :param attr: the class or function in the module
+        :param description: a one-line description
+        :param requires: third-party packages the module needs
+        :param remote: whether the stage talks to a remote service
+        :param cost: a rough estimate of the time the stage takes for one chain, in seconds
+        :param provides: the residue table columns the stage fills in
+        """
+
+        self._name = name
+        self._module = module
+        self._attr = attr
+        self._description = description
+        self._requires = tuple(requires)
+        self._remote = remote
+        self._cost = cost
+        self._provides = tuple(provides)
+        self._loaded = None
+
+    def get_name(self) -> str:
+
+        r"""
+        Returns name.
+        :return: name
+        """
+
+        return self._name
+
+    def get_description(self) -> str:
+
+        r"""
+        Returns description.
+        :return: description
+        """
+
+        return self._description
+
+    def is_remote(self) -> bool:
+
+        r"""
+        Returns remote.
+        :return: remote
+        """
+
+        return self._remote
+
+    def get_cost(self) -> float:
+
+        r"""
+        Returns cost.
+        :return: the estimated time for one chain, in seconds
+        """
+
+        return self._cost
+
+    def get_provides(self) -> tuple:
+
+        r"""
+        Returns provides.
+        :return: the residue table columns the stage fills in
+        """
+
+        return self._provides
+
+    def is_loaded(self) -> bool:
+
+        r"""
+        Checks whether the implementation has been imported.
+        :return: True if load has been called
+        """
+
+        return self._loaded is not None
+
+    def missing_requirements(self) -> list:
+
+        r"""
+        Finds the required packages that are not installed, without importing anything.
+        :return: a list of package names
+        """
+
+        return [pkg for pkg in self._requires if importlib.util.find_spec(pkg) is None]
+
+    def load(self):
+
+        r"""
+        Imports the implementation of the stage.
+        :return: the class or function implementing the stage
+        """
+
+        if self._loaded is None:
+            self._loaded = getattr(importlib.import_module(self._module), self._attr)
+        return self._loaded
+
+    def describe(self) -> str:
+
+        r"""
+        Returns a one-line summary of the stage.
+        :return: the summary
+        """
+
+        where = "remote" if self._remote else "local"
+        target = f"{self._module}.{self._attr}"
+        return f"{self._name:<16} {where:<7} {target:<38} {self._description}"
+
+
+stage_registry = {}
+
+
+def register_stage(stage: Stage) -> Stage:
+
+    r"""
+    Adds a stage to the registry. Registering a stage with an existing name replaces it.
+    :param stage: the Stage
+    :return: the Stage
+    """
+
+    stage_registry[stage.get_name()] = stage
+    return stage
+
+
+def get_stage(name: str) -> Stage:
+
+    r"""
+    Looks up a stage.
+    :param name: the name of the stage
+    :return: the Stage
+    """
+
+    if name not in stage_registry:
+        raise KeyError(f"Unknown stage {name}. Known stages: {', '.join(stage_registry)}")
+    return stage_registry[name]
+
+
+def load_stage(name: str):
+
+    r"""
+    Imports and returns the implementation of a stage.
+    :param name: the name of the stage
+    :return: the class or function implementing the stage
+    """
+
+    return get_stage(name).load()
+
+
+def list_stages() -> list:
+
+    r"""
+    Returns all registered stages in registration order.
+    :return: a list of Stages
+    """
+
+    return list(stage_registry.values())
+
+
+register_stage(Stage("download", "pdb_downloader", "PDBDownloader",
+                     "download the PDB file", ("requests",), remote=True, cost=2))
+register_stage(Stage("sequence", "primary_sequence", "get_seq",
+                     "read the primary sequence from SEQRES"))
+register_stage(Stage("parse", "protein_seq", "Protein",
+                     "parse residues into a Protein object"))
+register_stage(Stage("burial", "burial", "pdb_burial",
+                     "burial proxies (contact number, half-sphere exposure, hull depth) as a cheap pre-filter",
+                     ("numpy",), cost=3, provides=("cn8", "cn12", "hse_up", "hse_down", "depth")))
+register_stage(Stage("msa", "mmseqs_runner", "MMSeqs2Runner",
+                     "fetch the MSA from the MMseqs2 server", ("requests", "numpy", "absl"), remote=True, cost=600))
+register_stage(Stage("msa_batch", "mmseqs_runner", "MMSeqs2BatchRunner",
+                     "fetch the MSAs of many sequences in one MMseqs2 ticket", ("requests", "numpy", "absl"),
+                     remote=True, cost=600))
+register_stage(Stage("msa_convert", "msa_converter", "msa_convert",
+                     "convert the a3m MSA into FASTA", cost=5))
+register_stage(Stage("dssp", "dssp_runner", "DSSPRunner",
+                     "secondary structure and accessibility from XSSP", ("requests",), remote=True, cost=120,
+                     provides=("secstruct", "solex")))
+register_stage(Stage("dssp_batch", "dssp_runner", "DSSPBatchRunner",
+                     "DSSP for many PDB files at once", ("requests",), remote=True, cost=120,
+                     provides=("secstruct", "solex")))
+register_stage(Stage("sasa", "sasa", "pdb_sasa",
+                     "solvent accessibility computed locally", ("numpy",), cost=20, provides=("solex", "rsa")))
+register_stage(Stage("topcons", "topcons_runner", "run_topcons",
+                     "membrane topology from the TOPCONS server", ("selenium", "webdriver_manager", "requests"),
+                     remote=True, cost=300, provides=("mem",)))
+register_stage(Stage("topcons_batch", "topcons_runner", "run_topcons_batch",
+                     "membrane topology of many chains in one TOPCONS submission",
+                     ("selenium", "webdriver_manager", "requests"), remote=True, cost=100, provides=("mem",)))
+register_stage(Stage("topology_local", "membrane_predictor", "run_local_topology",
+                     "membrane topology estimated locally", ("numpy",), cost=10, provides=("mem",)))
+register_stage(Stage("consurf", "consurf_runner", "ConsurfRunner",
+                     "conservation grades from the ConSurf server", ("selenium", "webdriver_manager", "requests"),
+                     remote=True, cost=7200, provides=("cons",)))
+register_stage(Stage("pairs", "residue_table", "find_pairs",
+                     "candidate pairs in a distance window", ("numpy",)))
+register_stage(Stage("assembly", "assembly", "Assembly",
+                     "expand the biological assembly (REMARK 350) and enumerate symmetry-unique pairs", ("numpy",)))
+register_stage(Stage("store", "result_store", "ResultStore",
+                     "record residues and pairs in the result store", ("numpy",)))
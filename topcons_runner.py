@@ -1,17 +1,21 @@
-import os
 import requests
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
+from workspace import get_workspace
 
 
-def run_topcons(pdb_id, chainID):
+def run_topcons(pdb_id, chainID, driver=None, server_url="https://topcons.cbr.su.se/pred/", workspace=None):
 
     r"""
     Runs the topcons server to determine membrane affiliation of residues
     :param pdb_id: PDB ID of the protein
+    :param chainID: chain identifier
+    :param driver: an already running webdriver to reuse. A new Chrome window is started (and closed) when not given.
+    :param server_url: the url of the TOPCONS prediction page
+    :param workspace: the Workspace holding {pdb_id}_{chainID}_SEQ.fasta. Defaults to the current working directory
     :return: N/A
 
     Reference:
@@ -30,14 +34,36 @@ def run_topcons(pdb_id, chainID):
 
 
     # Starts a webdriver
-    driver = webdriver.Chrome(ChromeDriverManager().install())
-    server_url = "https://topcons.cbr.su.se/pred/"
+    own_driver = driver is None
+    if own_driver:
+        driver = webdriver.Chrome(ChromeDriverManager().install())
+    workspace = get_workspace(workspace)
+
+    # Fetch result
+    with open(workspace.mem(pdb_id, chainID), "w") as out:
+        out.write(_submit(driver, workspace.seq_fasta(pdb_id, chainID), server_url))
+
+    print(f"{pdb_id}_{chainID}_MEM.txt has been successfully generated.")
+
+    if own_driver:
+        driver.quit()
+
+
+def _submit(driver, seq_path: str, server_url: str, timeout: float = 90) -> str:
+
+    r"""
+    Uploads a FASTA file through the TOPCONS form and waits for the result.
+    :param driver: a running webdriver
+    :param seq_path: the FASTA file, with one or more sequences
+    :param server_url: the url of the TOPCONS prediction page
+    :param timeout: seconds to wait for each page
+    :return: the text of the result file
+    """
+
     driver.get(server_url)
-    current_path = os.getcwd()
 
     # Provide the sequence
     seq_FILE = driver.find_element(By.XPATH, "/html/body/table[2]/tbody/tr/td[2]/table/tbody/tr/td/div/table[1]/tbody/tr/td/form/p[2]/input")
-    seq_path = os.path.join(current_path, f"{pdb_id}_{chainID}_SEQ.fasta")
     seq_FILE.send_keys(seq_path)
 
     # Submit job
@@ -45,11 +71,11 @@ def run_topcons(pdb_id, chainID):
     submit.click()
 
     # Wait until the job is finished
-    WebDriverWait(driver, 90).until(
+    WebDriverWait(driver, timeout).until(
          EC.url_changes(server_url)
     )
 
-    WebDriverWait(driver, 90).until(
+    WebDriverWait(driver, timeout).until(
          EC.element_to_be_clickable((By.XPATH, "/html/body/table[2]/tbody/tr/td[2]/table/tbody/tr/td/div/table[1]/tbody/tr/td/p[2]/a"))
     )
 
@@ -60,18 +86,66 @@ def run_topcons(pdb_id, chainID):
     result.click()
 
     # Wait for the result to load
-    WebDriverWait(driver, 90).until(
+    WebDriverWait(driver, timeout).until(
          EC.url_changes(final_url)
     )
 
-    result_url = driver.current_url
-
-    # Fetch result
-    with open(f"{pdb_id}_{chainID}_MEM.txt", "w") as out:
-        out.write(requests.get(result_url).text)
+    return requests.get(driver.current_url).text
 
-    print(f"{pdb_id}_{chainID}_MEM.txt has been successfully generated.")
 
-    driver.quit()
+def run_topcons_batch(seqs: dict, driver=None, server_url="https://topcons.cbr.su.se/pred/", max_queries: int = 100,
+                      workspace=None) -> dict:
 
+    r"""
+    Runs the topcons server for many chains at once. Every unique sequence is written into one multi-sequence FASTA
+    file and submitted once (max_queries sequences per submission), so N chains of a job or of a whole screen cost one
+    browser session and one queue wait instead of N. The combined result is split back into one
+    {pdb_id}_{chainID}_MEM.txt per chain, in the layout Protein.check_mem reads.
+    :param seqs: a dictionary from (pdb_id, chainID) to the amino acid sequence of the chain
+    :param driver: an already running webdriver to reuse. A new Chrome window is started (and closed) when not given.
+    :param server_url: the url of the TOPCONS prediction page
+    :param max_queries: largest number of sequences per submission
+    :param workspace: the Workspace the files are written in. Defaults to the current working directory
+    :return: a dictionary from (pdb_id, chainID) to the predicted topology, or None where TOPCONS gave no prediction
+             (no file is written for those chains)
+    """
 
+    from result_parsers import parse_topcons
+
+    workspace = get_workspace(workspace)
+    unique = list(dict.fromkeys(seqs.values()))
+    topologies = {}
+
+    own_driver = driver is None
+    if own_driver:
+        driver = webdriver.Chrome(ChromeDriverManager().install())
+    try:
+        for start in range(0, len(unique), max_queries):
+            batch = unique[start:start + max_queries]
+            # Sequences are named by their position in the batch; blocks are matched back by sequence first
+            seq_path = workspace.path(f"topcons_batch_{start // max_queries}.fasta")
+            with open(seq_path, "w") as f:
+                f.write("".join(f">seq{k + 1}\n{seq}\n" for k, seq in enumerate(batch)))
+            text = _submit(driver, seq_path, server_url, timeout=90 * len(batch))
+            with open(workspace.path(f"topcons_batch_{start // max_queries}.txt"), "w") as out:
+                out.write(text)
+
+            records = parse_topcons(text)
+            by_seq = {record["sequence"]: record["topology"] for record in records if record["sequence"]}
+            by_number = {record["number"]: record["topology"] for record in records}
+            for k, seq in enumerate(batch):
+                topologies[seq] = by_seq[seq] if seq in by_seq else by_number.get(k + 1)
+    finally:
+        if own_driver:
+            driver.quit()
+
+    out = {}
+    for (pdb_id, chainID), seq in seqs.items():
+        topology = topologies.get(seq)
+        if topology is not None:
+            with open(workspace.mem(pdb_id, chainID), "w") as f:
+                f.write(f"TOPCONS batch result ({pdb_id} chain {chainID})\n\nTOPCONS predicted topology:\n{topology}\n")
+        out[(pdb_id, chainID)] = topology
+    print(f"TOPCONS predicted {sum(t is not None for t in out.values())} of {len(out)} chains "
+          f"in {-(-len(unique) // max_queries)} submission(s).")
+    return out
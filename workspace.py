@@ -0,0 +1,178 @@
+import os
+
+
+class Workspace:
+
+    r"""
+    Class name: Workspace
+    Description: The directory of one job. Runners, parsers and the Protein object resolve every file name through
+                 the workspace instead of the current working directory, so several jobs can run in one process, in
+                 threads or in an event loop, without os.chdir.
+    Variables:
+        self.root: the absolute path of the directory
+    """
+
+    def __init__(self, root: str = None, create: bool = True):
+
+        r"""
+        Object constructor.
+        :param root: the directory of the job. Defaults to the current working directory at the time of the call,
+                     which keeps the behaviour of scripts that run from inside the job directory
+        :param create: create the directory if it does not exist
+        """
+
+        self._root = os.path.abspath(root if root is not None else os.getcwd())
+        if create:
+            os.makedirs(self._root, exist_ok=True)
+
+    def __repr__(self) -> str:
+        return f"Workspace({self._root!r})"
+
+    def get_root(self) -> str:
+
+        r"""
+        Returns root.
+        :return: root
+        """
+
+        return self._root
+
+    def path(self, *parts: str) -> str:
+
+        r"""
+        Resolves a file name inside the workspace. Absolute paths are returned as they are.
+        :param parts: path components, e.g. "1abc.pdb" or "msa", "uniref.a3m"
+        :return: the absolute path
+        """
+
+        return os.path.join(self._root, *parts)
+
+    def exists(self, *parts: str) -> bool:
+
+        r"""
+        Checks whether a file exists in the workspace.
+        :param parts: path components
+        :return: True if the file exists
+        """
+
+        return os.path.isfile(self.path(*parts))
+
+    def open(self, name: str, mode: str = "r", **kwargs):
+
+        r"""
+        Opens a file of the workspace.
+        :param name: file name relative to the workspace
+        :param mode: the mode, as for open
+        :param kwargs: passed to open
+        :return: the file object
+        """
+
+        return open(self.path(name), mode, **kwargs)
+
+    def makedirs(self, *parts: str) -> str:
+
+        r"""
+        Creates a sub-directory of the workspace.
+        :param parts: path components
+        :return: the absolute path of the directory
+        """
+
+        path = self.path(*parts)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def pdb(self, pdb_id: str) -> str:
+
+        r"""
+        Returns the path of the PDB file.
+        :param pdb_id: PDB ID
+        :return: {root}/{pdb_id}.pdb
+        """
+
+        return self.path(f"{pdb_id}.pdb")
+
+    def dssp(self, pdb_id: str) -> str:
+
+        r"""
+        Returns the path of the DSSP file.
+        :param pdb_id: PDB ID
+        :return: {root}/{pdb_id}.dssp
+        """
+
+        return self.path(f"{pdb_id}.dssp")
+
+    def a3m(self, pdb_id: str) -> str:
+
+        r"""
+        Returns the path of the MSA in a3m format.
+        :param pdb_id: PDB ID
+        :return: {root}/{pdb_id}.a3m
+        """
+
+        return self.path(f"{pdb_id}.a3m")
+
+    def msa_fasta(self, pdb_id: str) -> str:
+
+        r"""
+        Returns the path of the MSA in FASTA format.
+        :param pdb_id: PDB ID
+        :return: {root}/{pdb_id}_MSA.fasta
+        """
+
+        return self.path(f"{pdb_id}_MSA.fasta")
+
+    def seq_fasta(self, pdb_id: str, chainID: str) -> str:
+
+        r"""
+        Returns the path of the sequence of one chain in FASTA format.
+        :param pdb_id: PDB ID
+        :param chainID: chain identifier
+        :return: {root}/{pdb_id}_{chainID}_SEQ.fasta
+        """
+
+        return self.path(f"{pdb_id}_{chainID}_SEQ.fasta")
+
+    def mem(self, pdb_id: str, chainID: str) -> str:
+
+        r"""
+        Returns the path of the membrane topology of one chain.
+        :param pdb_id: PDB ID
+        :param chainID: chain identifier
+        :return: {root}/{pdb_id}_{chainID}_MEM.txt
+        """
+
+        return self.path(f"{pdb_id}_{chainID}_MEM.txt")
+
+    def cons(self, pdb_id: str, chainID: str = None) -> str:
+
+        r"""
+        Returns the path of the ConSurf grades.
+        :param pdb_id: PDB ID
+        :param chainID: chain identifier. Without it, the grades of the whole protein
+        :return: {root}/{pdb_id}_{chainID}_CONS.txt or {root}/{pdb_id}_CONS.txt
+        """
+
+        return self.path(f"{pdb_id}_{chainID}_CONS.txt" if chainID else f"{pdb_id}_CONS.txt")
+
+    def summary(self, pdb_id: str) -> str:
+
+        r"""
+        Returns the path of the result summary.
+        :param pdb_id: PDB ID
+        :return: {root}/{pdb_id}_SUMMARY.txt
+        """
+
+        return self.path(f"{pdb_id}_SUMMARY.txt")
+
+
+def get_workspace(workspace=None) -> Workspace:
+
+    r"""
+    Returns the given workspace, or one for the current working directory when none is given.
+    :param workspace: a Workspace, a directory path or None
+    :return: a Workspace
+    """
+
+    if isinstance(workspace, Workspace):
+        return workspace
+    return Workspace(workspace, create=workspace is not None)